@@ -1,208 +1,202 @@
+import time
+
+# Taken before any other import so startup measurements include the cost of loading modules
+STARTUP_TIME = time.time()
+
+import json
+import multiprocessing
 import os
-from datetime import datetime
-import pandas as pd
-from docx import Document
-from docx.enum.text import WD_ALIGN_PARAGRAPH
-from docx.enum.table import WD_TABLE_ALIGNMENT
-from docx.shared import Pt, Inches
-from docx.oxml import OxmlElement
-from docx.oxml.ns import qn
-from reportlab.lib.pagesizes import letter
-from reportlab.lib import colors
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph
-from reportlab.lib.styles import getSampleStyleSheet
+import queue
+import sys
+import threading
 import tkinter as tk
 from tkinter import filedialog, messagebox
 from tkinter import ttk
-from docx2pdf import convert
-
-# Configuration settings
-config = {
-    'percentage_mark_label': 'Percentage Mark:',
-    'tutor_name': 'Dr. Kazber',
-    'module_title': 'Introduction to Game Design',
-    'module_code': 'GD101',
-    'assignment_title': 'Assignment 1',
-    'percent_of_module': '100%',
-    'font_sizes': {
-        'title': 20,
-        'year': 12,
-        'comment': 14,
-        'footer': 9
-    }
-}
+from feedback_config import config, FORM_ENGINE_NAMES, OUTPUT_LAYOUTS
 
 excel_file_path = None
 word_file_path = None
+template_file_path = None
+worksheet_file_path = None
+# State of the running background job, None when idle
+job_state = None
+# Timestamps recorded when started with --measure-startup, None otherwise
+startup_marks = None
 
 
-# Updated function to set cell border using proper namespaced attributes
-def set_cell_border(cell, **kwargs):
+def warm_up():
     """
-    Sets the border of a table cell in a Word document.
+    Import the generation engine and its document libraries in the background.
 
-    Args:
-        cell: The table cell whose border will be set.
-        **kwargs: Border size values for 'top', 'left', 'bottom', and 'right' edges. If an edge is not provided, it will not be modified.
+    The GUI only needs the lightweight settings module, so the window appears before python-docx, reportlab
+    and openpyxl are loaded; by the time the user has picked their files the engine is usually ready.
+    """
+    import feedback_engine  # noqa: F401
 
-    The `kwargs` should contain integer values representing the size of the border for each specified edge.
-    For each edge specified in the arguments, the function sets the border properties such as style, size, spacing, and color.
 
-    Example of usage:
-        set_cell_border(cell, top=2, left=2, bottom=2, right=2)
-    """
-    tc = cell._tc
-    tcPr = tc.get_or_add_tcPr()
-    for edge in ('top', 'left', 'bottom', 'right'):
-        edge_data = kwargs.get(edge, None)
-        if edge_data:
-            edge_element = OxmlElement(f'w:{edge}')
-            edge_element.set(qn('w:val'), 'single')
-            edge_element.set(qn('w:sz'), str(edge_data * 8))
-            edge_element.set(qn('w:space'), '0')
-            edge_element.set(qn('w:color'), '000000')
-            tcPr.append(edge_element)
-
-
-def add_centered_heading(doc, text, font_size=18):
-    paragraph = doc.add_paragraph()
-    run = paragraph.add_run(text)
-    run.bold = True
-    run.font.size = Pt(font_size)
-    paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
-
-
-def extract_last_table_from_docx(doc_path):
-    doc = Document(doc_path)
-    if doc.tables:
-        return doc.tables[-1]
-    return None
-
-
-def append_table_to_document(target_doc, table):
-    new_table = target_doc.add_table(rows=len(table.rows), cols=len(table.columns))
-    new_table.autofit = False
-    for row_idx, row in enumerate(table.rows):
-        for cell_idx, cell in enumerate(row.cells):
-            new_cell = new_table.cell(row_idx, cell_idx)
-            new_cell.text = cell.text
-            set_cell_border(new_cell, top=1, left=1, bottom=1, right=1)
-            for paragraph in cell.paragraphs:
-                new_p = new_cell.paragraphs[0]
-                for run in paragraph.runs:
-                    new_run = new_p.add_run(run.text)
-                    if run.bold:
-                        new_run.bold = True
-                    if run.italic:
-                        new_run.italic = True
-                    new_run.font.name = run.font.name
-                    new_run.font.size = run.font.size
-                new_p.alignment = paragraph.alignment
-
-
-def create_feedback_form_in_docx(student_name, student_mark, feedback, extra_table, output_format):
-    doc_file_name = f'Assignment_Feedback_Form_{student_name}.docx'
-    doc = Document()
-    core_properties = doc.core_properties
-    core_properties.author = config['tutor_name']
-    sections = doc.sections
-    for section in sections:
-        section.top_margin = Inches(1)
-        section.bottom_margin = Inches(1)
-        section.left_margin = Inches(1)
-        section.right_margin = Inches(1)
-    add_centered_heading(doc, 'ASSIGNMENT FEEDBACK FORM', font_size=config['font_sizes']['title'])
-    add_centered_heading(doc, '2024-25', font_size=config['font_sizes']['year'])
-    table = doc.add_table(rows=3, cols=4)
-    table.autofit = False
-    table.alignment = WD_TABLE_ALIGNMENT.CENTER
-    for row in table.rows:
-        for cell in row.cells:
-            cell.width = Inches(1.5)
-    table.cell(0, 0).text = 'STUDENT:'
-    table.cell(0, 1).text = student_name
-    table.cell(0, 2).text = 'TUTOR:'
-    table.cell(0, 3).text = config['tutor_name']
-    table.cell(1, 0).text = 'MODULE TITLE:'
-    table.cell(1, 1).text = config['module_title']
-    table.cell(1, 2).text = 'MODULE CODE:'
-    table.cell(1, 3).text = config['module_code']
-    table.cell(2, 0).text = 'ASSIGNMENT:'
-    table.cell(2, 1).text = config['assignment_title']
-    table.cell(2, 2).text = '% of module:'
-    table.cell(2, 3).text = config['percent_of_module']
-    for row in table.rows:
-        for cell in row.cells:
-            set_cell_border(cell, top=1, left=1, bottom=1, right=1)
-    doc.add_paragraph()
-    add_centered_heading(doc, 'OVERALL COMMENT', font_size=config['font_sizes']['comment'])
-    comment_table = doc.add_table(rows=1, cols=1)
-    comment_table.autofit = False
-    comment_table.alignment = WD_TABLE_ALIGNMENT.CENTER
-    comment_table.cell(0, 0).width = Inches(6)
-    comment_table.cell(0, 0).text = feedback if feedback else ' '
-    set_cell_border(comment_table.cell(0, 0), top=1, left=1, bottom=1, right=1)
-    doc.add_paragraph()
-    table = doc.add_table(rows=1, cols=3)
-    table.autofit = False
-    table.alignment = WD_TABLE_ALIGNMENT.CENTER
-    for cell in table.rows[0].cells:
-        cell.width = Inches(2)
-    table.cell(0, 0).text = config['percentage_mark_label']
-    mark_paragraph = table.cell(0, 1).paragraphs[0]
-    mark_run = mark_paragraph.add_run(str(student_mark))
-    mark_run.bold = True
-    table.cell(0, 1).paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.CENTER
-    table.cell(0, 2).text = 'Date:'
-    table.cell(0, 2).paragraphs[0].add_run(datetime.now().strftime('%Y-%m-%d')).bold = True
-    for row in table.rows:
-        for cell in row.cells:
-            set_cell_border(cell, top=1, left=1, bottom=1, right=1)
-    doc.add_paragraph()
-    footer = doc.add_paragraph()
-    footer_run = footer.add_run(
-        "NB All marks are provisional until confirmed by a formally constituted Board of Examiners")
-    footer_run.font.size = Pt(config['font_sizes']['footer'])
-    footer.alignment = WD_ALIGN_PARAGRAPH.CENTER
-    doc.add_paragraph()
-    doc.add_page_break()
-    if extra_table:
-        append_table_to_document(doc, extra_table)
-    doc.save(doc_file_name)
-    print(f"Saved: {doc_file_name}")
-
-    # Convert to PDF if needed
-    if output_format == 'PDF':
-        pdf_file_name = doc_file_name.replace('.docx', '.pdf')
-        convert(doc_file_name, pdf_file_name)
-        print(f"Converted to PDF: {pdf_file_name}")
-        return pdf_file_name
-
-    return doc_file_name
+def run_job(excel_path, rubric_path, output_format, engine, workers, incremental, layout, all_sheets, worksheet_path,
+            updates, cancel_event):
+    """Background worker thread: generates every form and reports back to the GUI through `updates`."""
+    try:
+        from feedback_engine import run_generation
+        results = run_generation(excel_path, output_format=output_format, engine=engine, workers=workers,
+                                 rubric_path=rubric_path, incremental=incremental, layout=layout,
+                                 all_sheets=all_sheets, grading_worksheet=worksheet_path,
+                                 on_start=lambda total: updates.put(('start', total)),
+                                 on_result=lambda result: updates.put(('result', result)),
+                                 cancel_event=cancel_event,
+                                 on_stage=lambda stage: updates.put(('stage', stage)),
+                                 on_report=lambda report: updates.put(('report', (report.summary(), report.path))))
+        updates.put(('done', results))
+    except Exception as e:
+        updates.put(('error', str(e)))
 
 
 def process_files():
-    global excel_file_path, word_file_path
+    global excel_file_path, word_file_path, job_state
     if not excel_file_path:
         messagebox.showerror("Error", "Please select an Excel file.")
         return
+    if template_checkbox_var.get() and not template_file_path:
+        messagebox.showerror("Error", "Please select a form template.")
+        return
+    layout = OUTPUT_LAYOUTS[layout_var.get()]
+    if layout == 'lms' and not worksheet_file_path:
+        messagebox.showerror("Error", "Please select the grading worksheet downloaded from the assignment.")
+        return
+    if job_state:
+        return
 
-    extra_table = None
-    if word_checkbox_var.get() and word_file_path:
-        extra_table = extract_last_table_from_docx(word_file_path)
+    rubric_path = word_file_path if word_checkbox_var.get() else None
+    config['form_template'] = template_file_path if template_checkbox_var.get() else None
+    try:
+        workers = workers_var.get()
+    except tk.TclError:
+        messagebox.showerror("Error", "Worker Processes must be a whole number.")
+        return
 
+    job_state = {
+        'updates': queue.Queue(),
+        'cancel_event': multiprocessing.Event(),
+        'started': time.perf_counter(),
+        'total': 0,
+        'done': 0,
+        'stage': None,
+        'report': None,
+    }
+    progress_bar.config(value=0, maximum=1)
+    progress_label.config(text="Reading Excel file...")
+    report_label.config(text="")
+    error_list.delete(0, tk.END)
+    process_button.config(state=tk.DISABLED)
+    cancel_button.config(state=tk.NORMAL)
+    threading.Thread(target=run_job, daemon=True,
+                     args=(excel_file_path, rubric_path, output_format_var.get(), engine_var.get(), workers,
+                           incremental_var.get(), layout, all_sheets_var.get(), worksheet_file_path,
+                           job_state['updates'], job_state['cancel_event'])).start()
+    root.after(100, poll_job)
+
+
+def poll_job():
+    """Apply queued progress updates from the background job, then check again unless it has finished."""
+    global job_state
+    finished = None
     try:
-        df = pd.read_excel(excel_file_path)
-        student_data = df.iloc[:, [0, 1, 2]]
-
-        for index, row in student_data.iterrows():
-            student_name = row.iloc[0]
-            student_mark = row.iloc[1]
-            feedback = row.iloc[2]
-            output_format = output_format_var.get()
-            create_feedback_form_in_docx(student_name, student_mark, feedback, extra_table, output_format)
-    except Exception as e:
-        messagebox.showerror("Error", f"Failed to process files: {e}")
+        while True:
+            kind, payload = job_state['updates'].get_nowait()
+            if kind == 'start':
+                # The sheet dimensions are only an estimate and may be missing altogether
+                job_state['total'] = payload or 0
+                progress_bar.config(maximum=max(job_state['total'], 1))
+            elif kind == 'result':
+                if startup_marks is not None and 'first_form' not in startup_marks:
+                    startup_marks['first_form'] = time.time()
+                job_state['done'] += 1
+                if payload.error:
+                    error_list.insert(tk.END, f"{payload.student_name}: {payload.error}")
+            elif kind == 'stage':
+                job_state['stage'] = payload
+            elif kind == 'report':
+                job_state['report'] = payload
+            else:
+                finished = (kind, payload)
+                break
+    except queue.Empty:
+        pass
+
+    done, total = job_state['done'], job_state['total']
+    elapsed = time.perf_counter() - job_state['started']
+    if job_state['stage']:
+        progress_label.config(text=f"{job_state['stage']}...")
+    elif done:
+        rate = done / elapsed if elapsed > 0 else 0
+        if done < total:
+            eta = f"{(total - done) / rate:.0f}s" if rate else "--"
+            progress_label.config(text=f"{done}/{total} forms, {rate:.1f} forms/s, ETA {eta}")
+        else:
+            progress_label.config(text=f"{done} forms, {rate:.1f} forms/s")
+        progress_bar.config(value=done, maximum=max(total, done))
+
+    if finished is None:
+        root.after(100, poll_job)
+        return
+
+    kind, payload = finished
+    cancelled = job_state['cancel_event'].is_set()
+    report = job_state['report']
+    job_state = None
+    process_button.config(state=tk.NORMAL)
+    cancel_button.config(state=tk.DISABLED)
+    if startup_marks is not None:
+        finish_startup_measurement(kind)
+        return
+    if kind == 'error':
+        progress_label.config(text="Failed")
+        messagebox.showerror("Error", f"Failed to process files: {payload}")
+        return
+    # The final results include PDF conversion failures, which are only known once the batch is converted
+    error_list.delete(0, tk.END)
+    for result in payload:
+        if result.error:
+            error_list.insert(tk.END, f"{result.student_name}: {result.error}")
+    failures = sum(1 for result in payload if result.error)
+    skipped = sum(1 for result in payload if result.skipped)
+    status = "Cancelled" if cancelled else "Finished"
+    progress_bar.config(value=len(payload), maximum=max(len(payload), 1))
+    progress_label.config(text=f"{status}: {len(payload) - failures - skipped} of {len(payload)} forms created "
+                               f"in {elapsed:.1f}s, {skipped} unchanged, {failures} failed")
+    if report:
+        summary, report_path = report
+        report_label.config(text=f"{summary}\nFull report: {report_path}")
+
+
+def start_startup_measurement(excel_path):
+    """Record when the window is first drawn, then generate forms from `excel_path` to time the first form."""
+    global excel_file_path
+    root.update_idletasks()
+    startup_marks['first_window'] = time.time()
+    excel_file_path = excel_path
+    process_files()
+
+
+def finish_startup_measurement(outcome):
+    # Written to a file because the windowed executable has no console to print to
+    report = {
+        'outcome': outcome,
+        'module_start': STARTUP_TIME,
+        'first_window': startup_marks['first_window'],
+        'first_form': startup_marks.get('first_form'),
+    }
+    with open(startup_marks['report_path'], 'a', encoding='utf-8') as fh:
+        fh.write(json.dumps(report) + '\n')
+    root.destroy()
+
+
+def cancel_job():
+    if job_state:
+        job_state['cancel_event'].set()
+        cancel_button.config(state=tk.DISABLED)
+        progress_label.config(text="Cancelling after the current form...")
 
 
 def select_excel_file():
@@ -213,6 +207,14 @@ def select_excel_file():
         excel_label.config(text=f"Excel file: {os.path.basename(file_path)}")
 
 
+def select_excel_folder():
+    global excel_file_path
+    folder_path = filedialog.askdirectory()
+    if folder_path:
+        excel_file_path = folder_path
+        excel_label.config(text=f"Excel folder: {os.path.basename(folder_path)} (every sheet of every workbook)")
+
+
 def select_word_file():
     global word_file_path
     file_path = filedialog.askopenfilename(filetypes=[("Word files", "*.docx")])
@@ -221,6 +223,28 @@ def select_word_file():
         word_label.config(text=f"Word file: {os.path.basename(file_path)}")
 
 
+def select_template_file():
+    global template_file_path
+    file_path = filedialog.askopenfilename(filetypes=[("Word files", "*.docx")])
+    if file_path:
+        template_file_path = file_path
+        template_label.config(text=f"Form template: {os.path.basename(file_path)}")
+
+
+def select_worksheet_file():
+    global worksheet_file_path
+    file_path = filedialog.askopenfilename(filetypes=[("Grading worksheets", "*.csv")])
+    if file_path:
+        worksheet_file_path = file_path
+        worksheet_label.config(text=f"Grading worksheet: {os.path.basename(file_path)}")
+
+
+def toggle_worksheet_file_selection(*_):
+    state = tk.NORMAL if OUTPUT_LAYOUTS[layout_var.get()] == 'lms' else tk.DISABLED
+    worksheet_button.config(state=state)
+    worksheet_label.config(state=state)
+
+
 def update_config():
     config['tutor_name'] = tutor_name_var.get()
     config['module_title'] = module_title_var.get()
@@ -239,80 +263,161 @@ def toggle_word_file_selection():
         word_label.config(state=tk.DISABLED)
 
 
+def toggle_template_file_selection():
+    state = tk.NORMAL if template_checkbox_var.get() else tk.DISABLED
+    template_button.config(state=state)
+    template_label.config(state=state)
+
+
 def open_website(event):
     import webbrowser
     webbrowser.open_new("https://kasper7777.github.io/")
 
 
-# GUI setup
-root = tk.Tk()
-root.title("Assignment Feedback Form Generator")
-
-# Configuration frame
-config_frame = tk.LabelFrame(root, text="Configuration", padx=10, pady=10)
-config_frame.pack(padx=10, pady=10, fill="x")
-
-tutor_name_var = tk.StringVar(value=config['tutor_name'])
-module_title_var = tk.StringVar(value=config['module_title'])
-module_code_var = tk.StringVar(value=config['module_code'])
-assignment_title_var = tk.StringVar(value=config['assignment_title'])
-percent_of_module_var = tk.StringVar(value=config['percent_of_module'])
-
-tk.Label(config_frame, text="Tutor Name:").grid(row=0, column=0)
-tk.Entry(config_frame, textvariable=tutor_name_var).grid(row=0, column=1)
-
-tk.Label(config_frame, text="Module Title:").grid(row=1, column=0)
-tk.Entry(config_frame, textvariable=module_title_var).grid(row=1, column=1)
-
-tk.Label(config_frame, text="Module Code:").grid(row=2, column=0)
-tk.Entry(config_frame, textvariable=module_code_var).grid(row=2, column=1)
-
-tk.Label(config_frame, text="Assignment Title:").grid(row=3, column=0)
-tk.Entry(config_frame, textvariable=assignment_title_var).grid(row=3, column=1)
-
-tk.Label(config_frame, text="Percent of Module:").grid(row=4, column=0)
-tk.Entry(config_frame, textvariable=percent_of_module_var).grid(row=4, column=1)
-
-tk.Button(config_frame, text="Update Configuration", command=update_config).grid(row=5, columnspan=2, pady=10)
-
-# File selection frame
-file_frame = tk.LabelFrame(root, text="Select Files", padx=10, pady=10)
-file_frame.pack(padx=10, pady=10, fill="x")
-
-excel_button = tk.Button(file_frame, text="Select Excel File", command=select_excel_file)
-excel_button.pack(pady=5)
-excel_label = tk.Label(file_frame, text="No Excel file selected")
-excel_label.pack(pady=5)
-
-word_checkbox_var = tk.BooleanVar(value=False)
-word_checkbox = tk.Checkbutton(file_frame, text="Include Rubric (Word Doc)", variable=word_checkbox_var,
-                               command=toggle_word_file_selection)
-word_checkbox.pack(pady=5)
-
-word_button = tk.Button(file_frame, text="Select Word File", command=select_word_file, state=tk.DISABLED)
-word_button.pack(pady=5)
-word_label = tk.Label(file_frame, text="No Word file selected", state=tk.DISABLED)
-word_label.pack(pady=5)
-
-# Output format selection
-output_format_var = tk.StringVar(value="Word")
-tk.Label(file_frame, text="Output Format:").pack(pady=5)
-output_format_menu = ttk.OptionMenu(file_frame, output_format_var, "Word", "Word", "PDF")
-output_format_menu.pack(pady=5)
-
-# Process button
-process_button = tk.Button(root, text="Process Files", command=process_files)
-process_button.pack(pady=10)
-
-# Link and Copyright
-footer_frame = tk.Frame(root)
-footer_frame.pack(pady=10)
-
-link = ttk.Label(footer_frame, text="Visit my website: kasper7777.github.io", foreground="blue", cursor="hand2")
-link.pack(side="top")
-link.bind("<Button-1>", open_website)
-
-copyright_label = tk.Label(footer_frame, text="©2025 Kestrel Kinetics Research & Technology. All Rights Reserved.")
-copyright_label.pack(side="bottom")
+if __name__ == '__main__':
+    # Lets the frozen executable act as a worker process when generating in parallel
+    multiprocessing.freeze_support()
+
+    # GUI setup
+    root = tk.Tk()
+    root.title("Assignment Feedback Form Generator")
+
+    # Configuration frame
+    config_frame = tk.LabelFrame(root, text="Configuration", padx=10, pady=10)
+    config_frame.pack(padx=10, pady=10, fill="x")
+
+    tutor_name_var = tk.StringVar(value=config['tutor_name'])
+    module_title_var = tk.StringVar(value=config['module_title'])
+    module_code_var = tk.StringVar(value=config['module_code'])
+    assignment_title_var = tk.StringVar(value=config['assignment_title'])
+    percent_of_module_var = tk.StringVar(value=config['percent_of_module'])
+
+    tk.Label(config_frame, text="Tutor Name:").grid(row=0, column=0)
+    tk.Entry(config_frame, textvariable=tutor_name_var).grid(row=0, column=1)
+
+    tk.Label(config_frame, text="Module Title:").grid(row=1, column=0)
+    tk.Entry(config_frame, textvariable=module_title_var).grid(row=1, column=1)
+
+    tk.Label(config_frame, text="Module Code:").grid(row=2, column=0)
+    tk.Entry(config_frame, textvariable=module_code_var).grid(row=2, column=1)
+
+    tk.Label(config_frame, text="Assignment Title:").grid(row=3, column=0)
+    tk.Entry(config_frame, textvariable=assignment_title_var).grid(row=3, column=1)
+
+    tk.Label(config_frame, text="Percent of Module:").grid(row=4, column=0)
+    tk.Entry(config_frame, textvariable=percent_of_module_var).grid(row=4, column=1)
+
+    tk.Button(config_frame, text="Update Configuration", command=update_config).grid(row=5, columnspan=2, pady=10)
+
+    # File selection frame
+    file_frame = tk.LabelFrame(root, text="Select Files", padx=10, pady=10)
+    file_frame.pack(padx=10, pady=10, fill="x")
+
+    excel_button = tk.Button(file_frame, text="Select Excel File", command=select_excel_file)
+    excel_button.pack(pady=5)
+    excel_folder_button = tk.Button(file_frame, text="Select Folder of Workbooks", command=select_excel_folder)
+    excel_folder_button.pack(pady=5)
+    excel_label = tk.Label(file_frame, text="No Excel file selected")
+    excel_label.pack(pady=5)
+    all_sheets_var = tk.BooleanVar(value=False)
+    all_sheets_checkbox = tk.Checkbutton(file_frame, text="Process every sheet of the workbook",
+                                         variable=all_sheets_var)
+    all_sheets_checkbox.pack(pady=5)
+
+    word_checkbox_var = tk.BooleanVar(value=False)
+    word_checkbox = tk.Checkbutton(file_frame, text="Include Rubric (Word Doc)", variable=word_checkbox_var,
+                                   command=toggle_word_file_selection)
+    word_checkbox.pack(pady=5)
+
+    word_button = tk.Button(file_frame, text="Select Word File", command=select_word_file, state=tk.DISABLED)
+    word_button.pack(pady=5)
+    word_label = tk.Label(file_frame, text="No Word file selected", state=tk.DISABLED)
+    word_label.pack(pady=5)
+
+    template_checkbox_var = tk.BooleanVar(value=False)
+    template_checkbox = tk.Checkbutton(file_frame, text="Use Own Form Template (Word Doc with {{student}}, "
+                                                        "{{mark}}, {{comment}})",
+                                       variable=template_checkbox_var, command=toggle_template_file_selection)
+    template_checkbox.pack(pady=5)
+    template_button = tk.Button(file_frame, text="Select Form Template", command=select_template_file,
+                                state=tk.DISABLED)
+    template_button.pack(pady=5)
+    template_label = tk.Label(file_frame, text="No form template selected", state=tk.DISABLED)
+    template_label.pack(pady=5)
+
+    # Output format selection
+    output_format_var = tk.StringVar(value="Word")
+    tk.Label(file_frame, text="Output Format:").pack(pady=5)
+    output_format_menu = ttk.OptionMenu(file_frame, output_format_var, "Word", "Word", "PDF")
+    output_format_menu.pack(pady=5)
+
+    # Document engine selection
+    engine_var = tk.StringVar(value="python-docx")
+    tk.Label(file_frame, text="Document Engine:").pack(pady=5)
+    engine_menu = ttk.OptionMenu(file_frame, engine_var, "python-docx", *FORM_ENGINE_NAMES)
+    engine_menu.pack(pady=5)
+
+    # Parallel generation
+    workers_var = tk.IntVar(value=1)
+    tk.Label(file_frame, text="Worker Processes:").pack(pady=5)
+    workers_spinbox = tk.Spinbox(file_frame, from_=1, to=os.cpu_count() or 1, textvariable=workers_var, width=5)
+    workers_spinbox.pack(pady=5)
+
+    incremental_var = tk.BooleanVar(value=True)
+    incremental_checkbox = tk.Checkbutton(file_frame, text="Only regenerate changed students",
+                                          variable=incremental_var)
+    incremental_checkbox.pack(pady=5)
+
+    # Output layout selection
+    layout_var = tk.StringVar(value="One file per student")
+    tk.Label(file_frame, text="Output Layout:").pack(pady=5)
+    layout_menu = ttk.OptionMenu(file_frame, layout_var, "One file per student", *OUTPUT_LAYOUTS,
+                                 command=toggle_worksheet_file_selection)
+    layout_menu.pack(pady=5)
+    # The LMS upload package is matched to the grading worksheet downloaded from the VLE assignment
+    worksheet_button = tk.Button(file_frame, text="Select Grading Worksheet", command=select_worksheet_file,
+                                 state=tk.DISABLED)
+    worksheet_button.pack(pady=5)
+    worksheet_label = tk.Label(file_frame, text="No grading worksheet selected", state=tk.DISABLED)
+    worksheet_label.pack(pady=5)
+
+    # Process button
+    process_button = tk.Button(root, text="Process Files", command=process_files)
+    process_button.pack(pady=10)
+
+    # Progress of the background job
+    progress_frame = tk.LabelFrame(root, text="Progress", padx=10, pady=10)
+    progress_frame.pack(padx=10, pady=10, fill="x")
+
+    progress_bar = ttk.Progressbar(progress_frame, mode="determinate")
+    progress_bar.pack(fill="x", pady=5)
+    progress_label = tk.Label(progress_frame, text="Idle")
+    progress_label.pack(pady=5)
+    # Slowest stages, peak memory and bytes written of the last run; the full report is saved with the forms
+    report_label = tk.Label(progress_frame, text="", wraplength=380, justify=tk.LEFT)
+    report_label.pack(pady=5)
+    error_list = tk.Listbox(progress_frame, height=4)
+    error_list.pack(fill="x", pady=5)
+    cancel_button = tk.Button(progress_frame, text="Cancel", command=cancel_job, state=tk.DISABLED)
+    cancel_button.pack(pady=5)
+
+    # Link and Copyright
+    footer_frame = tk.Frame(root)
+    footer_frame.pack(pady=10)
+
+    link = ttk.Label(footer_frame, text="Visit my website: kasper7777.github.io", foreground="blue", cursor="hand2")
+    link.pack(side="top")
+    link.bind("<Button-1>", open_website)
+
+    copyright_label = tk.Label(footer_frame, text="©2025 Kestrel Kinetics Research & Technology. All Rights Reserved.")
+    copyright_label.pack(side="bottom")
+
+    # `FeedbackCreator.py --measure-startup marks.xlsx report.jsonl` times the first window and the first
+    # form, see benchmarks/startup.py
+    if len(sys.argv) == 4 and sys.argv[1] == '--measure-startup':
+        startup_marks = {'report_path': os.path.abspath(sys.argv[3])}
+        root.after_idle(start_startup_measurement, os.path.abspath(sys.argv[2]))
+    else:
+        threading.Thread(target=warm_up, daemon=True).start()
 
-root.mainloop()
\ No newline at end of file
+    root.mainloop()
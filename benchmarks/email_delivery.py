@@ -0,0 +1,256 @@
+"""
+Check and time emailing the forms of a cohort against a local SMTP stand-in, without a real mail server.
+
+The stand-in accepts SMTP on 127.0.0.1 and records every message it receives. It can wait before greeting a
+new connection and before accepting each message, to mimic the TLS handshake, login and delivery times of
+a real server, and answer every nth message with a temporary 451 error, to exercise the retries.
+
+The script generates forms for a synthetic cohort with an email column (Direct XML engine), then:
+
+    pooled     sends them with `send_feedback_emails` over the configured number of connections, with
+               temporary failures injected, and checks that every student got exactly one message with
+               their own form attached
+    resume     runs the same send again and checks that the send log skips every student
+    baseline   with --compare, sends `--baseline` messages over one fresh connection each, for reference
+
+The results are printed as JSON; the script exits with status 1 if a check fails.
+
+Usage:
+    python benchmarks/email_delivery.py [--students 1500] [--connections 4] [--connect-delay 0.3]
+        [--message-delay 0.02] [--fail-every 50] [--compare] [--work-dir bench]
+"""
+import argparse
+import contextlib
+import email.policy
+import json
+import os
+import random
+import shutil
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from openpyxl import Workbook  # noqa: E402
+
+from pipeline import fixture_path, synthetic_comment  # noqa: E402
+
+
+class SmtpStandIn(socketserver.ThreadingTCPServer):
+    """
+    Minimal SMTP server on a free local port that keeps the messages it accepts in `messages`.
+
+    It speaks just enough of the protocol for `smtplib` (EHLO/HELO, MAIL, RCPT, DATA, RSET, NOOP, QUIT)
+    and advertises no STARTTLS, so use the 'none' security setting.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, connect_delay=0.0, message_delay=0.0, fail_every=0):
+        super().__init__(('127.0.0.1', 0), _SmtpSession)
+        self.connect_delay = connect_delay
+        self.message_delay = message_delay
+        self.fail_every = fail_every
+        self.messages = []
+        self.connections = 0
+        self.refused = 0
+        self._lock = threading.Lock()
+        self._received = 0
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def accept_message(self, recipients, data):
+        """Return the reply to a message: accepted, or a temporary failure every `fail_every` messages."""
+        time.sleep(self.message_delay)
+        with self._lock:
+            self._received += 1
+            if self.fail_every and self._received % self.fail_every == 0:
+                self.refused += 1
+                return b'451 4.3.0 Try again later'
+            self.messages.append((recipients, data))
+        return b'250 2.0.0 Queued'
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _SmtpSession(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line + b'\r\n')
+
+    def handle(self):
+        server = self.server
+        with server._lock:
+            server.connections += 1
+        time.sleep(server.connect_delay)
+        self.reply(b'220 localhost SMTP stand-in')
+        recipients = []
+        for line in self.rfile:
+            command = line.strip().split(b' ', 1)[0].upper()
+            if command == b'EHLO':
+                self.reply(b'250-localhost')
+                self.reply(b'250 8BITMIME')
+            elif command in (b'HELO', b'NOOP'):
+                self.reply(b'250 OK')
+            elif command in (b'MAIL', b'RSET'):
+                recipients = []
+                self.reply(b'250 OK')
+            elif command == b'RCPT':
+                recipients.append(line.split(b':', 1)[1].strip().strip(b'<>').decode())
+                self.reply(b'250 OK')
+            elif command == b'DATA':
+                self.reply(b'354 End data with <CR><LF>.<CR><LF>')
+                lines = []
+                for data_line in self.rfile:
+                    if data_line == b'.\r\n':
+                        break
+                    # Undo the dot-stuffing of lines starting with a dot
+                    lines.append(data_line[1:] if data_line.startswith(b'..') else data_line)
+                self.reply(server.accept_message(recipients, b''.join(lines)))
+                recipients = []
+            elif command == b'QUIT':
+                self.reply(b'221 Bye')
+                return
+            else:
+                self.reply(b'502 Command not implemented')
+
+
+def make_email_workbook(path, students, seed=0):
+    rng = random.Random(seed)
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(['Name', 'Mark', 'Feedback', 'Email'])
+    for index in range(students):
+        sheet.append([f'Student {index:05d}', rng.randint(20, 95), synthetic_comment(rng, 40),
+                      f'student{index:05d}@example.ac.uk'])
+    workbook.save(path)
+
+
+def email_settings(server, connections, messages_per_connection=100):
+    return {'sender': 'Dr. Kazber <kazber@example.ac.uk>', 'smtp_host': '127.0.0.1', 'smtp_port': server.port,
+            'security': 'none', 'username': '', 'connections': connections,
+            'messages_per_connection': messages_per_connection, 'retries': 3, 'timeout': 10}
+
+
+def check_delivery(server, students):
+    """Return a list of problems with the messages the stand-in received: one per student, own form attached."""
+    problems = []
+    received = {}
+    for recipients, data in server.messages:
+        message = email.message_from_bytes(data, policy=email.policy.default)
+        attachments = [part.get_filename() for part in message.iter_attachments()]
+        for recipient in recipients:
+            received.setdefault(recipient, []).append(attachments)
+    for index in range(students):
+        address = f'student{index:05d}@example.ac.uk'
+        copies = received.get(address, [])
+        if len(copies) != 1:
+            problems.append(f'{address} received {len(copies)} messages')
+        elif copies[0] != [f'Assignment_Feedback_Form_Student {index:05d}.docx']:
+            problems.append(f'{address} received the attachments {copies[0]}')
+    return problems
+
+
+def timed_send(workbook, output_dir, retry_delay=0.05):
+    from email_distribution import send_feedback_emails
+
+    start = time.perf_counter()
+    results = send_feedback_emails(workbook, output_dir, retry_delay=retry_delay)
+    return {'seconds': time.perf_counter() - start, 'sent': sum(1 for result in results
+                                                                if not result.error and not result.skipped),
+            'skipped': sum(1 for result in results if result.skipped),
+            'failed': sum(1 for result in results if result.error),
+            'retried': sum(1 for result in results if result.attempts > 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=1500)
+    parser.add_argument('--connections', type=int, default=4)
+    parser.add_argument('--connect-delay', type=float, default=0.3,
+                        help='Seconds the stand-in takes to greet a new connection, like a TLS handshake and login')
+    parser.add_argument('--message-delay', type=float, default=0.02,
+                        help='Seconds the stand-in takes to accept each message')
+    parser.add_argument('--fail-every', type=int, default=50,
+                        help='Answer every nth message with a temporary error (0 for none)')
+    parser.add_argument('--compare', action='store_true',
+                        help='Also time one connection per message, the way forms were sent before')
+    parser.add_argument('--baseline', type=int, default=50, help='Messages sent for the --compare baseline')
+    parser.add_argument('--work-dir', help='Directory for the synthetic mark sheet, kept between runs '
+                                           '(default: a temporary directory)')
+    args = parser.parse_args()
+
+    from feedback_config import config
+    from feedback_engine import run_generation
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='feedback_email_')
+    os.makedirs(work_dir, exist_ok=True)
+    output_dir = tempfile.mkdtemp(prefix='forms_', dir=work_dir)
+    runs = {}
+    problems = []
+    try:
+        workbook = fixture_path(work_dir, f'marks_{args.students}_email.xlsx', make_email_workbook, args.students)
+        print(f'Generating {args.students} forms', file=sys.stderr)
+        # The per-form progress lines would end up in the JSON
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            run_generation(workbook, output_dir, engine='Direct XML', workers=os.cpu_count() or 1,
+                           statistics_formats=())
+
+        server = SmtpStandIn(args.connect_delay, args.message_delay, args.fail_every)
+        try:
+            config['email'].update(email_settings(server, args.connections))
+            runs['pooled'] = timed_send(workbook, output_dir)
+            runs['pooled'].update(connections=server.connections, refused=server.refused)
+            problems += check_delivery(server, args.students)
+            if runs['pooled']['failed']:
+                problems.append(f"{runs['pooled']['failed']} messages failed")
+            received = len(server.messages)
+            runs['resume'] = timed_send(workbook, output_dir)
+            if runs['resume']['skipped'] != args.students or len(server.messages) != received:
+                problems.append(f"The repeated run sent {len(server.messages) - received} messages again")
+        finally:
+            server.stop()
+
+        if args.compare:
+            from email_distribution import EmailJob, SmtpConnectionPool, build_message
+
+            server = SmtpStandIn(args.connect_delay, args.message_delay)
+            try:
+                config['email'].update(email_settings(server, 1, messages_per_connection=1))
+                pool = SmtpConnectionPool(config['email'])
+                start = time.perf_counter()
+                for index in range(args.baseline):
+                    name = f'Student {index:05d}'
+                    path = os.path.join(output_dir, f'Assignment_Feedback_Form_{name}.docx')
+                    pool.send(build_message(EmailJob(name, f'student{index:05d}@example.ac.uk', path, '', config)))
+                seconds = time.perf_counter() - start
+                runs['baseline'] = {'seconds': seconds, 'sent': args.baseline, 'connections': server.connections,
+                                    'estimated_seconds': seconds / args.baseline * args.students}
+            finally:
+                server.stop()
+    finally:
+        if args.work_dir:
+            shutil.rmtree(output_dir, ignore_errors=True)
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    for name, run in runs.items():
+        print(f"{name}: {run['sent']} sent in {run['seconds']:.1f}s", file=sys.stderr)
+    print(json.dumps({'students': args.students, 'connections': args.connections, 'runs': runs,
+                      'problems': problems}, indent=2))
+    for problem in problems:
+        print(f'FAIL: {problem}', file=sys.stderr)
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
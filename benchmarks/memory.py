@@ -0,0 +1,116 @@
+"""
+Check that low-memory generation stays under a fixed memory ceiling however large the cohort is.
+
+Synthetic mark sheets of 10k and 50k students (see `pipeline.make_workbook`) are generated into a work
+directory and reused by later runs. Each cohort is generated with `run_generation(..., low_memory=True)` in
+a fresh process per layout, so every measurement starts from a clean interpreter. Like the CLI, runs are
+incremental: each cohort is generated twice into the same directory, the second time skipping every
+student whose form is current, so reading and writing the run manifest count towards the peak too (the
+combined document is not incremental and is simply built again).
+
+    files      one Direct XML .docx per student
+    combined   one python-docx combined document, which low-memory mode streams to disk
+
+The peak resident set size of the run, minus the resident set size after the imports, must stay under
+`--ceiling` megabytes for every cohort; as the ceiling does not depend on the number of students, this
+asserts that memory use is flat. `--compare` also measures the default mode, for reference only. The script
+exits with status 1 if a run exceeds the ceiling.
+
+Usage:
+    python benchmarks/memory.py [--cohorts 10000 50000] [--ceiling 40] [--compare] [--work-dir bench]
+"""
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+COHORT_SIZES = (10000, 50000)
+# Layout -> engine it is measured with
+LAYOUTS = {'files': 'Direct XML', 'combined': 'python-docx'}
+
+
+def measure(workbook, layout, engine, output_dir, low_memory):
+    """Run one generation in this process and return its memory use; called in the child process."""
+    from feedback_engine import run_generation
+    from run_report import peak_rss_bytes
+
+    baseline = peak_rss_bytes()
+    reports = []
+    # The per-form progress lines would end up in the JSON read by the parent
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(2):
+            run_generation(workbook, output_dir, engine=engine, layout=layout, low_memory=low_memory,
+                           incremental=True, on_report=reports.append)
+    report = reports[0]
+    return {'baseline_bytes': baseline, 'peak_bytes': peak_rss_bytes(), 'forms': report.forms,
+            'failed': report.failed, 'wall_seconds': report.to_dict()['wall_seconds']}
+
+
+def measure_in_child(workbook, layout, engine, work_dir, low_memory):
+    output_dir = tempfile.mkdtemp(prefix='forms_', dir=work_dir)
+    try:
+        command = [sys.executable, os.path.abspath(__file__), '--child', workbook, layout, engine, output_dir]
+        if low_memory:
+            command.append('--low-memory')
+        completed = subprocess.run(command, capture_output=True, text=True, check=True)
+        return json.loads(completed.stdout)
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cohorts', type=int, nargs='+', default=COHORT_SIZES, help='Cohort sizes to generate')
+    parser.add_argument('--layouts', nargs='+', choices=LAYOUTS, default=list(LAYOUTS))
+    parser.add_argument('--ceiling', type=float, default=40.0,
+                        help='Largest allowed growth of the peak resident set size during a run, in MB')
+    parser.add_argument('--compare', action='store_true', help='Also measure the default mode, for reference')
+    parser.add_argument('--work-dir', help='Directory for the synthetic mark sheets, kept between runs '
+                                           '(default: a temporary directory)')
+    parser.add_argument('--child', nargs=4, metavar=('WORKBOOK', 'LAYOUT', 'ENGINE', 'OUTPUT_DIR'),
+                        help=argparse.SUPPRESS)
+    parser.add_argument('--low-memory', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(*args.child, low_memory=args.low_memory)))
+        return 0
+
+    from pipeline import fixture_path, make_workbook
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='feedback_memory_')
+    os.makedirs(work_dir, exist_ok=True)
+    runs = []
+    try:
+        for students in args.cohorts:
+            workbook = fixture_path(work_dir, f'marks_{students}_memory.xlsx', make_workbook, students, 40)
+            for layout in args.layouts:
+                for low_memory in (True, False) if args.compare else (True,):
+                    run = measure_in_child(workbook, layout, LAYOUTS[layout], work_dir, low_memory)
+                    run.update(students=students, layout=layout, engine=LAYOUTS[layout], low_memory=low_memory)
+                    run['growth_mb'] = (run['peak_bytes'] - run['baseline_bytes']) / 1e6
+                    run['within_ceiling'] = run['growth_mb'] <= args.ceiling if low_memory else None
+                    runs.append(run)
+                    print(f"{students} students, {layout}{' (low memory)' if low_memory else ''}: "
+                          f"peak +{run['growth_mb']:.1f} MB in {run['wall_seconds']:.1f}s", file=sys.stderr)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(json.dumps({'ceiling_mb': args.ceiling, 'runs': runs}, indent=2))
+    exceeded = [run for run in runs if run['within_ceiling'] is False]
+    for run in exceeded:
+        print(f"FAIL: {run['students']} students, {run['layout']}: peak grew by {run['growth_mb']:.1f} MB, "
+              f"over the {args.ceiling:.0f} MB ceiling", file=sys.stderr)
+    return 1 if exceeded else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
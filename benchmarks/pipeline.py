@@ -0,0 +1,239 @@
+"""
+Benchmark every stage of feedback form generation on synthetic cohorts and rubrics.
+
+Synthetic mark sheets (50, 1k and 10k students, with short and long comments) and rubric documents (small,
+medium and large, with merged cells) are generated into a work directory and reused by later runs. Each
+stage is timed separately:
+
+    read         streaming every student out of the workbook with `iter_students`
+    rubric       extracting the rubric table with `load_rubric`, cold (empty cache), warm (from the disk
+                 cache, as in a new process) and in-process (from the memory cache of a long-running one)
+    build        building the per-engine template and rendering forms in memory
+    append       `append_table_to_document` onto a fresh python-docx document
+    save         rendering and writing each form to disk
+    convert      batch conversion of the saved .docx forms with a stub converter that copies the files,
+                 which measures the staging overhead without Word
+
+Per-form stages run on the first `--forms` students of each cohort and report both the total and the time
+per form. Results are written as JSON, so runs before and after a change can be compared.
+
+Usage:
+    python benchmarks/pipeline.py [--output results.json] [--cohorts 50 1000] [--forms 100] [--work-dir bench]
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from itertools import islice
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from docx import Document  # noqa: E402
+from openpyxl import Workbook  # noqa: E402
+
+import feedback_engine  # noqa: E402
+from feedback_engine import (FORM_ENGINES, FormResult, append_table_to_document,  # noqa: E402
+                             convert_staged_forms_to_pdf, form_file_name, load_rubric)
+from student_reader import READER_BACKENDS, iter_students  # noqa: E402
+
+COHORT_SIZES = (50, 1000, 10000)
+# Comment length in words
+COMMENT_LENGTHS = {'short': 12, 'long': 300}
+# Rubric size -> (criteria rows, mark band columns)
+RUBRIC_SIZES = {'small': (4, 4), 'medium': (12, 5), 'large': (40, 6)}
+
+_WORDS = ('clear structure good research evidence argument analysis references critical reflection design '
+          'prototype iteration testing feedback concept presentation narrative mechanics balance level').split()
+
+
+def synthetic_comment(rng, words):
+    return ' '.join(rng.choice(_WORDS) for _ in range(words)).capitalize() + '.'
+
+
+def make_workbook(path, students, comment_words, seed=0):
+    rng = random.Random(seed)
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(['Name', 'Mark', 'Feedback'])
+    for index in range(students):
+        sheet.append([f'Student {index:05d}', rng.randint(20, 95), synthetic_comment(rng, comment_words)])
+    workbook.save(path)
+
+
+def make_rubric(path, criteria, bands, seed=0):
+    rng = random.Random(seed)
+    doc = Document()
+    doc.add_paragraph('Marking rubric')
+    table = doc.add_table(rows=criteria + 1, cols=bands + 1)
+    table.cell(0, 0).text = 'Criterion'
+    for band in range(bands):
+        table.cell(0, band + 1).text = f'Band {band + 1}'
+    for row in range(1, criteria + 1):
+        table.cell(row, 0).text = f'Criterion {row}'
+        for band in range(bands):
+            table.cell(row, band + 1).text = synthetic_comment(rng, 15)
+    # A horizontal and a vertical merge, like real rubrics that group bands or criteria
+    table.cell(1, 1).merge(table.cell(1, 2))
+    table.cell(2, 0).merge(table.cell(3, 0))
+    doc.save(path)
+
+
+def fixture_path(work_dir, name, build, *args):
+    path = os.path.join(work_dir, name)
+    if not os.path.exists(path):
+        build(path, *args)
+    return path
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    value = function(*args, **kwargs)
+    return time.perf_counter() - start, value
+
+
+def per_form(seconds, forms):
+    return {'seconds': seconds, 'forms': forms, 'ms_per_form': seconds * 1000 / forms if forms else None}
+
+
+def stub_converter(input_dir, output_dir):
+    """Stand-in for `docx2pdf.convert` that copies every .docx in `input_dir` to a .pdf in `output_dir`."""
+    for name in os.listdir(input_dir):
+        if name.endswith('.docx'):
+            shutil.copyfile(os.path.join(input_dir, name), os.path.join(output_dir, name[:-5] + '.pdf'))
+
+
+def bench_read(workbook_path):
+    timings = {}
+    for backend in READER_BACKENDS:
+        seconds, count = timed(lambda: sum(1 for _ in iter_students(workbook_path, backend=backend)))
+        timings[backend] = {'seconds': seconds, 'students': count}
+    return timings
+
+
+def bench_rubric(rubric_path, cache_dir):
+    # The memory cache would turn the warm load into a dict lookup, so it is emptied before the cold and warm
+    # loads and only left in place for the in-process one
+    feedback_engine._loaded_rubrics.clear()
+    cold, rubric = timed(load_rubric, rubric_path, cache_dir=cache_dir)
+    feedback_engine._loaded_rubrics.clear()
+    warm, _ = timed(load_rubric, rubric_path, cache_dir=cache_dir)
+    in_process, _ = timed(load_rubric, rubric_path, cache_dir=cache_dir)
+    return {'cold_seconds': cold, 'warm_seconds': warm, 'in_process_seconds': in_process,
+            'rows': len(rubric.rows), 'xml_bytes': len(rubric.xml)}, rubric
+
+
+def bench_append(rubric, forms):
+    docs = [Document() for _ in range(forms)]
+    start = time.perf_counter()
+    for doc in docs:
+        append_table_to_document(doc, rubric)
+    return per_form(time.perf_counter() - start, forms)
+
+
+def bench_engine(engine, students, rubric, work_dir):
+    template_seconds, template = timed(FORM_ENGINES[engine], rubric)
+    start = time.perf_counter()
+    for name, mark, feedback in students:
+        template.render(name, mark, feedback)
+    build = per_form(time.perf_counter() - start, len(students))
+
+    output_dir = tempfile.mkdtemp(prefix='save_', dir=work_dir)
+    try:
+        results = []
+        start = time.perf_counter()
+        for index, (name, mark, feedback) in enumerate(students):
+            path = form_file_name(name, template.extension, output_dir)
+            template.save(path, name, mark, feedback)
+            results.append(FormResult(index, name, path, None))
+        save = per_form(time.perf_counter() - start, len(students))
+        save['bytes'] = sum(os.path.getsize(result.path) for result in results)
+        timings = {'template_seconds': template_seconds, 'build': build, 'save': save}
+        if template.extension == '.docx':
+            pdf_dir = os.path.join(work_dir, 'pdf')
+            os.makedirs(pdf_dir, exist_ok=True)
+            # The per-file progress lines would end up in the JSON report on stdout
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                seconds, _ = timed(convert_staged_forms_to_pdf, results, output_dir, pdf_dir,
+                                   converter=stub_converter)
+            timings['convert'] = per_form(seconds, len(students))
+            shutil.rmtree(pdf_dir, ignore_errors=True)
+        return timings
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', help='JSON file to write the results to (default: print them)')
+    parser.add_argument('--cohorts', type=int, nargs='+', default=COHORT_SIZES, help='Cohort sizes to generate')
+    parser.add_argument('--comments', nargs='+', choices=COMMENT_LENGTHS, default=list(COMMENT_LENGTHS))
+    parser.add_argument('--rubrics', nargs='+', choices=RUBRIC_SIZES, default=list(RUBRIC_SIZES))
+    parser.add_argument('--engines', nargs='+', choices=FORM_ENGINES, default=list(FORM_ENGINES))
+    parser.add_argument('--forms', type=int, default=100, help='Students per cohort used for per-form stages')
+    parser.add_argument('--work-dir', help='Directory for the synthetic inputs, kept between runs '
+                                           '(default: a temporary directory)')
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='feedback_bench_')
+    os.makedirs(work_dir, exist_ok=True)
+    report = {
+        'started': datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'forms_per_stage': args.forms,
+        'rubrics': {},
+        'cohorts': [],
+    }
+    try:
+        rubrics = {'none': None}
+        for size in args.rubrics:
+            path = fixture_path(work_dir, f'rubric_{size}.docx', make_rubric, *RUBRIC_SIZES[size])
+            timings, rubrics[size] = bench_rubric(path, tempfile.mkdtemp(prefix='cache_', dir=work_dir))
+            timings['append'] = bench_append(rubrics[size], args.forms)
+            report['rubrics'][size] = timings
+            print(f"rubric {size}: cold {timings['cold_seconds']:.3f}s, warm {timings['warm_seconds']:.3f}s, "
+                  f"in-process {timings['in_process_seconds'] * 1000:.3f}ms", file=sys.stderr)
+
+        for students in args.cohorts:
+            for comments in args.comments:
+                path = fixture_path(work_dir, f'marks_{students}_{comments}.xlsx', make_workbook, students,
+                                    COMMENT_LENGTHS[comments])
+                sample = list(islice(iter_students(path), args.forms))
+                cohort = {'students': students, 'comments': comments, 'read': bench_read(path), 'engines': {}}
+                for engine in args.engines:
+                    cohort['engines'][engine] = {size: bench_engine(engine, sample, rubric, work_dir)
+                                                 for size, rubric in rubrics.items()}
+                report['cohorts'].append(cohort)
+                print(f"cohort {students} {comments}: done", file=sys.stderr)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as fh:
+            fh.write(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
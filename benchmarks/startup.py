@@ -0,0 +1,63 @@
+"""
+Measure the startup time of the FeedbackCreator GUI.
+
+Each run launches the application in a fresh process with `--measure-startup`, so it reports:
+
+    first_window  seconds from launching the process until the main window has been drawn
+    first_form    seconds from launching the process until the first feedback form has been saved
+
+The first form is seen by the GUI's progress poll, so it is accurate to about 100 ms. Forms are written to a
+temporary directory that is removed afterwards. Needs a display, like the GUI itself.
+
+Usage:
+    python benchmarks/startup.py marks.xlsx [--runs 5] [--exe dist/FeedbackCreator.exe]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure_once(command, excel_path):
+    with tempfile.TemporaryDirectory() as work_dir:
+        report_path = os.path.join(work_dir, 'startup.jsonl')
+        launched = time.time()
+        subprocess.run(command + ['--measure-startup', excel_path, report_path], cwd=work_dir, check=True,
+                       timeout=600)
+        with open(report_path, encoding='utf-8') as fh:
+            report = json.loads(fh.readline())
+    return {
+        'outcome': report['outcome'],
+        'interpreter_start': report['module_start'] - launched,
+        'first_window': report['first_window'] - launched,
+        'first_form': report['first_form'] - launched if report['first_form'] else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('excel_path', help='Mark sheet used to time the first form')
+    parser.add_argument('--runs', type=int, default=5, help='Number of launches to take the median of')
+    parser.add_argument('--exe', help='Measure a frozen executable instead of FeedbackCreator.py')
+    args = parser.parse_args()
+
+    command = [args.exe] if args.exe else [sys.executable, os.path.join(REPO_DIR, 'FeedbackCreator.py')]
+    runs = [measure_once(command, os.path.abspath(args.excel_path)) for _ in range(args.runs)]
+    summary = {
+        'command': command,
+        'runs': runs,
+        'median_first_window': statistics.median(run['first_window'] for run in runs),
+        'median_first_form': statistics.median(run['first_form'] for run in runs if run['first_form'] is not None)
+        if any(run['first_form'] is not None for run in runs) else None,
+    }
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+"""Cohort statistics gathered while a mark sheet is streamed, written next to the forms as JSON, CSV and DOCX."""
+import csv
+import json
+import math
+import os
+
+import numpy as np
+
+STATISTICS_NAME = 'feedback_statistics'
+STATISTICS_FORMATS = ('json', 'csv', 'docx')
+
+# Columns of the CSV and DOCX summaries besides the grade bands, by key of `CohortStatistics.to_dict`
+_SUMMARY_COLUMNS = {
+    'label': 'Mark sheet',
+    'module_code': 'Module code',
+    'assignment_title': 'Assignment',
+    'students': 'Students',
+    'marked': 'Marked',
+    'mean': 'Mean',
+    'median': 'Median',
+    'std_dev': 'Std dev',
+    'min': 'Min',
+    'max': 'Max',
+    'fails': 'Fails',
+}
+
+
+class CohortStatistics:
+    """
+    Mean, median, standard deviation, grade-band counts and fails of one mark sheet, updated block by block.
+
+    `add` receives the marks of each block of rows worked out by `mark_aggregation.MarkScheme` (see the
+    `on_chunk` argument of `mark_aggregation.aggregate_marks`), so the statistics come out of the same pass
+    as the forms and memory does not grow with the cohort. Mean and variance are merged per block with
+    Chan's parallel form of Welford's algorithm; the median is exact, taken from the counts of each distinct
+    mark. Entered or rounded marks take a few hundred values at most; unrounded criterion totals can take
+    one per student, so set a `rounding` policy for those on very large cohorts.
+
+    Args:
+        label: Name of the mark sheet, such as `student_reader.MarkSheet.name`.
+        settings: The `config` of the sheet; its module code, assignment title and marking settings are used.
+    """
+
+    def __init__(self, label, settings):
+        self.label = label
+        self.module_code = settings['module_code']
+        self.assignment_title = settings['assignment_title']
+        self.pass_mark = settings['marking']['pass_mark']
+        bands = sorted(settings['marking']['grade_bands'], key=lambda band: band[0], reverse=True)
+        self.grades = {label: 0 for _, label in bands}
+        if bands:
+            self.grades[''] = 0
+        self.students = 0
+        self.marked = 0
+        self.fails = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+        self._min = math.inf
+        self._max = -math.inf
+        self._mark_counts = {}
+
+    def add(self, marks, grades):
+        """Add a block of marks (NaN for students without a numeric mark) and their grade bands."""
+        self.students += len(marks)
+        numeric = ~np.isnan(marks)
+        values = marks[numeric]
+        if not len(values):
+            return
+        count = len(values)
+        mean = float(values.mean())
+        m2 = float(((values - mean) ** 2).sum())
+        total = self.marked + count
+        delta = mean - self._mean
+        self._mean += delta * count / total
+        self._m2 += m2 + delta * delta * self.marked * count / total
+        self.marked = total
+        self._min = min(self._min, float(values.min()))
+        self._max = max(self._max, float(values.max()))
+        self.fails += int((values < self.pass_mark).sum())
+        for mark, mark_count in zip(*np.unique(values, return_counts=True)):
+            self._mark_counts[float(mark)] = self._mark_counts.get(float(mark), 0) + int(mark_count)
+        if self.grades:
+            for grade, grade_count in zip(*np.unique(grades[numeric].astype(str), return_counts=True)):
+                self.grades[str(grade)] = self.grades.get(str(grade), 0) + int(grade_count)
+
+    def median(self):
+        if not self.marked:
+            return None
+        # The one or two middle marks, counted from the lowest
+        middle = ((self.marked - 1) // 2, self.marked // 2)
+        found = []
+        seen = 0
+        for mark in sorted(self._mark_counts):
+            seen += self._mark_counts[mark]
+            found.extend(mark for position in middle[len(found):] if position < seen)
+            if len(found) == 2:
+                break
+        return (found[0] + found[1]) / 2
+
+    def to_dict(self):
+        grades = {label or 'Below bands': count for label, count in self.grades.items()}
+        return {
+            'label': self.label,
+            'module_code': self.module_code,
+            'assignment_title': self.assignment_title,
+            'students': self.students,
+            'marked': self.marked,
+            'no_mark': self.students - self.marked,
+            'mean': self._mean if self.marked else None,
+            'median': self.median(),
+            # Sample standard deviation, as Excel's STDEV.S
+            'std_dev': math.sqrt(self._m2 / (self.marked - 1)) if self.marked > 1 else None,
+            'min': self._min if self.marked else None,
+            'max': self._max if self.marked else None,
+            'pass_mark': self.pass_mark,
+            'fails': self.fails,
+            'grades': grades,
+        }
+
+
+def _cell(value):
+    if isinstance(value, float):
+        return f'{value:.2f}'.rstrip('0').rstrip('.')
+    return '' if value is None else str(value)
+
+
+def _summary_table(statistics):
+    # Header and rows of the CSV and DOCX summaries: one row per mark sheet, one column per grade band
+    entries = [entry.to_dict() for entry in statistics]
+    grades = list(dict.fromkeys(grade for entry in entries for grade in entry['grades']))
+    header = list(_SUMMARY_COLUMNS.values()) + grades
+    rows = [[_cell(entry[key]) for key in _SUMMARY_COLUMNS] + [_cell(entry['grades'].get(grade, 0))
+                                                                for grade in grades]
+            for entry in entries]
+    return header, rows
+
+
+def write_statistics(statistics, output_dir=None, formats=STATISTICS_FORMATS):
+    """
+    Write the statistics of every mark sheet of a run to `output_dir` as `STATISTICS_NAME` with each extension.
+
+    Args:
+        statistics: List of `CohortStatistics`, one row of the summary each.
+        formats: Any of `STATISTICS_FORMATS`.
+
+    Returns:
+        The paths written.
+    """
+    base = os.path.join(output_dir or '.', STATISTICS_NAME)
+    paths = []
+    if 'json' in formats:
+        paths.append(f'{base}.json')
+        with open(paths[-1], 'w', encoding='utf-8') as fh:
+            json.dump({'assignments': [entry.to_dict() for entry in statistics]}, fh, indent=1)
+    header, rows = _summary_table(statistics)
+    if 'csv' in formats:
+        paths.append(f'{base}.csv')
+        # utf-8-sig so Excel recognises the encoding of names with accents
+        with open(paths[-1], 'w', encoding='utf-8-sig', newline='') as fh:
+            writer = csv.writer(fh)
+            writer.writerow(header)
+            writer.writerows(rows)
+    if 'docx' in formats:
+        # python-docx is only needed for this format
+        from docx import Document
+        from docx.enum.section import WD_ORIENT
+
+        doc = Document()
+        section = doc.sections[0]
+        section.orientation = WD_ORIENT.LANDSCAPE
+        section.page_width, section.page_height = section.page_height, section.page_width
+        doc.add_heading('Cohort statistics', level=1)
+        table = doc.add_table(rows=1, cols=len(header))
+        table.style = 'Table Grid'
+        for cell, text in zip(table.rows[0].cells, header):
+            cell.text = text
+            cell.paragraphs[0].runs[0].bold = True
+        for row in rows:
+            for cell, text in zip(table.add_row().cells, row):
+                cell.text = text
+        paths.append(f'{base}.docx')
+        doc.save(paths[-1])
+    return paths
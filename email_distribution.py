@@ -0,0 +1,337 @@
+"""Email every student their generated feedback form over a small pool of persistent SMTP connections."""
+import json
+import mimetypes
+import os
+import queue
+import smtplib
+import ssl
+import string
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from email.message import EmailMessage
+from email.utils import formatdate, make_msgid, parseaddr
+
+from feedback_config import config
+from feedback_engine import FORM_ENGINES, form_file_name, sheet_config, sheet_output_dir
+from student_reader import find_mark_sheets, iter_student_column
+
+SEND_LOG_NAME = 'feedback_email_log.jsonl'
+PASSWORD_VARIABLE = 'FEEDBACK_SMTP_PASSWORD'
+SECURITY_MODES = ('starttls', 'ssl', 'none')
+
+# One message to send: the settings of its sheet fill in the subject and body, `form` is relative to the
+# output directory and keys the send log
+EmailJob = namedtuple('EmailJob', ['student_name', 'address', 'path', 'form', 'settings'])
+
+# Outcome of emailing one student; `error` is None once the server has accepted the message, `skipped` is
+# True when the send log shows the form was already sent to the address and `attempts` counts the tries
+EmailResult = namedtuple('EmailResult', ['student_name', 'address', 'path', 'error', 'skipped', 'attempts'],
+                         defaults=(False, 0))
+
+
+class SendLog:
+    """
+    Append-only JSON Lines log of every message sent, or failed, in an output directory.
+
+    Each line is written and flushed as soon as the server has answered, so a run that is interrupted, or
+    crashes, can be repeated and only sends the forms not yet logged as sent. A form counts as sent when a
+    line records it as sent to the same address.
+    """
+
+    def __init__(self, output_dir=None):
+        self.path = os.path.join(output_dir or '.', SEND_LOG_NAME)
+        self._sent = set()
+        self._lock = threading.Lock()
+        try:
+            with open(self.path, encoding='utf-8') as fh:
+                for line in fh:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # The last line of a log whose run was killed while writing it
+                        continue
+                    if entry.get('status') == 'sent':
+                        self._sent.add((entry['form'], entry['address'].lower()))
+        except OSError:
+            pass
+        self._fh = None
+
+    def is_sent(self, job):
+        return (job.form, job.address.lower()) in self._sent
+
+    def record(self, job, result):
+        entry = {'time': datetime.now().isoformat(timespec='seconds'), 'student': str(job.student_name),
+                 'address': job.address, 'form': job.form, 'status': 'failed' if result.error else 'sent',
+                 'attempts': result.attempts, 'error': result.error}
+        with self._lock:
+            if self._fh is None:
+                self._fh = open(self.path, 'a', encoding='utf-8')
+            self._fh.write(json.dumps(entry) + '\n')
+            self._fh.flush()
+            if not result.error:
+                self._sent.add((job.form, job.address.lower()))
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+
+class _Connection:
+    def __init__(self, smtp):
+        self.smtp = smtp
+        self.sent = 0
+
+
+class SmtpConnectionPool:
+    """
+    Up to `connections` persistent SMTP connections shared by the sending threads.
+
+    A thread takes an idle connection, or opens one if none is idle, and returns it after sending. Opening
+    a connection costs a TLS handshake and a login, so reusing it makes each further message a single
+    exchange with the server. A connection is closed after `messages_per_connection` messages, since servers
+    limit the messages of one session. A message the server refuses with a reply leaves the session usable,
+    but after any other error, or a 421 reply, the connection is closed.
+
+    Args:
+        settings: The 'email' settings, see `feedback_config.config`.
+        password: Password of the settings' `username`.
+    """
+
+    def __init__(self, settings, password=None):
+        if settings['security'] not in SECURITY_MODES:
+            raise ValueError(f"Unknown email security '{settings['security']}'; use one of {', '.join(SECURITY_MODES)}")
+        self.settings = settings
+        self.password = password
+        self._idle = queue.LifoQueue()
+
+    def connect(self):
+        """Open and log in a new connection."""
+        settings = self.settings
+        if settings['security'] == 'ssl':
+            smtp = smtplib.SMTP_SSL(settings['smtp_host'], settings['smtp_port'], timeout=settings['timeout'],
+                                    context=ssl.create_default_context())
+        else:
+            smtp = smtplib.SMTP(settings['smtp_host'], settings['smtp_port'], timeout=settings['timeout'])
+        try:
+            if settings['security'] == 'starttls':
+                smtp.starttls(context=ssl.create_default_context())
+            if settings['username']:
+                smtp.login(settings['username'], self.password or '')
+        except BaseException:
+            smtp.close()
+            raise
+        return _Connection(smtp)
+
+    def send(self, message):
+        try:
+            connection = self._idle.get_nowait()
+        except queue.Empty:
+            connection = self.connect()
+        try:
+            connection.smtp.send_message(message)
+        except smtplib.SMTPResponseException as e:
+            if e.smtp_code == 421:
+                connection.smtp.close()
+            else:
+                self.release(connection)
+            raise
+        except smtplib.SMTPRecipientsRefused:
+            self.release(connection)
+            raise
+        except BaseException:
+            connection.smtp.close()
+            raise
+        connection.sent += 1
+        self.release(connection)
+
+    def release(self, connection):
+        if connection.sent >= self.settings['messages_per_connection']:
+            self._quit(connection)
+        else:
+            self._idle.put(connection)
+
+    def close(self):
+        while True:
+            try:
+                self._quit(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+    @staticmethod
+    def _quit(connection):
+        try:
+            connection.smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            connection.smtp.close()
+
+
+def _is_temporary(error):
+    # 4xx replies, dropped connections and timeouts are worth another try; 5xx replies are final
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    return isinstance(error, (smtplib.SMTPServerDisconnected, OSError))
+
+
+def _describe(error):
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        code, reply = next(iter(error.recipients.values()))
+        return f"{code} {reply.decode('utf-8', 'replace')}"
+    if isinstance(error, smtplib.SMTPResponseException):
+        reply = error.smtp_error.decode('utf-8', 'replace') if isinstance(error.smtp_error, bytes) else error.smtp_error
+        return f"{error.smtp_code} {reply}"
+    return str(error) or type(error).__name__
+
+
+def _message_values(settings, student_name):
+    values = {key: value for key, value in settings.items() if not isinstance(value, dict)}
+    values['student'] = student_name
+    return values
+
+
+def _check_placeholders(settings):
+    # Unknown placeholders are reported before the first message is sent rather than once per student
+    values = _message_values(settings, '')
+    for part in ('subject', 'body'):
+        for _, name, _, _ in string.Formatter().parse(settings['email'][part]):
+            if name is not None and name not in values:
+                raise ValueError(f"Unknown placeholder {{{name}}} in the email {part}; use {{student}} or a "
+                                 f"setting such as {{module_code}}")
+
+
+def build_message(job):
+    """Return the `EmailMessage` of a job, with the student's form attached."""
+    email_settings = job.settings['email']
+    values = _message_values(job.settings, job.student_name)
+    message = EmailMessage()
+    message['From'] = email_settings['sender']
+    message['To'] = job.address
+    message['Subject'] = email_settings['subject'].format(**values)
+    message['Date'] = formatdate(localtime=True)
+    message['Message-ID'] = make_msgid()
+    message.set_content(email_settings['body'].format(**values))
+    content_type = mimetypes.guess_type(job.path)[0] or 'application/octet-stream'
+    maintype, subtype = content_type.split('/', 1)
+    with open(job.path, 'rb') as fh:
+        message.add_attachment(fh.read(), maintype=maintype, subtype=subtype, filename=os.path.basename(job.path))
+    return message
+
+
+def _deliver(pool, job, retries, retry_delay, cancel_event):
+    if cancel_event is not None and cancel_event.is_set():
+        return None
+    # Built per attempt inside the sending thread, so only the messages in flight are held in memory
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            pool.send(build_message(job))
+            return EmailResult(job.student_name, job.address, job.path, None, attempts=attempt)
+        except Exception as e:
+            if attempt > retries or not _is_temporary(e) or (cancel_event is not None and cancel_event.is_set()):
+                return EmailResult(job.student_name, job.address, job.path, _describe(e), attempts=attempt)
+        # 1, 2, 4... times `retry_delay`, which also gives a server that is throttling us time to recover
+        time.sleep(retry_delay * 2 ** (attempt - 1))
+
+
+def email_jobs(excel_path, output_dir=None, output_format='Word', all_sheets=False, engine='python-docx'):
+    """
+    Yield an `EmailJob` for every student of a mark sheet, or of every sheet as in `run_generation`.
+
+    Each student's form is looked for where `run_generation` writes it with the 'files' layout, with the
+    extension `output_format` and `engine` give it (.pdf for PDF output and for the ReportLab engine in any
+    format). Students without an address or form are yielded too, with a None `address` or `path`, so they
+    are reported.
+    """
+    extension = '.pdf' if output_format == 'PDF' else FORM_ENGINES[engine].extension
+    if all_sheets or os.path.isdir(excel_path):
+        sheets = [(mark_sheet.workbook, mark_sheet.sheet, sheet_config(mark_sheet),
+                   sheet_output_dir(mark_sheet, output_dir)) for mark_sheet in find_mark_sheets(excel_path)]
+    else:
+        # The first sheet, with the settings of its header area and sidecar, as `run_generation` reads it
+        mark_sheet = next(find_mark_sheets(excel_path), None)
+        settings = sheet_config(mark_sheet) if mark_sheet is not None else config
+        sheets = [(excel_path, None, settings, output_dir or '.')]
+    for workbook, sheet, settings, sheet_dir in sheets:
+        _check_placeholders(settings)
+        for student_name, address in iter_student_column(workbook, settings['email']['column'], sheet):
+            path = form_file_name(student_name, extension, sheet_dir)
+            form = os.path.relpath(path, output_dir or '.').replace(os.sep, '/')
+            yield EmailJob(student_name, address, path if os.path.exists(path) else None, form, settings)
+
+
+def send_feedback_emails(excel_path, output_dir=None, output_format='Word', all_sheets=False, password=None,
+                         resend=False, retry_delay=2.0, on_result=None, cancel_event=None, engine='python-docx'):
+    """
+    Email every student of a mark sheet the form generated for them, with the form as an attachment.
+
+    Messages are sent by `config['email']['connections']` threads over an `SmtpConnectionPool`, and
+    messages that fail with a temporary error (a 4xx reply, a dropped connection or a timeout) are tried
+    again up to `retries` times with growing pauses. Every outcome is appended to the `SendLog` in
+    `output_dir`, and students the log shows as already sent their form are skipped unless `resend` is
+    set, so an interrupted run is finished by running it again. The server settings are taken from
+    `config['email']`; the subject, body and sender may differ per sheet.
+
+    Args:
+        excel_path: The mark sheet, or directory of workbooks, the forms in `output_dir` were generated from.
+        output_format: 'Word' or 'PDF', the format the forms were generated in.
+        engine: Name of the form engine the forms were generated with, which also decides their extension.
+        all_sheets: Email the students of every sheet, as `run_generation` with `all_sheets`.
+        password: Password of the configured `username`; read from the `PASSWORD_VARIABLE` environment
+            variable when not given.
+        on_result: Optional callable invoked with each `EmailResult` as it is known, from any thread.
+
+    Raises:
+        ValueError: If the settings are incomplete, the sheet has no email column or the server cannot be
+            reached or refuses the login; nothing has been sent then.
+
+    Returns:
+        A list of `EmailResult`, in the order of the students. After a cancellation it only covers the
+        students whose messages were attempted.
+    """
+    settings = config['email']
+    if not settings['sender']:
+        raise ValueError("Set the sender address of the emails, 'sender' in the 'email' settings")
+    jobs = list(email_jobs(excel_path, output_dir, output_format, all_sheets, engine))
+    pool = SmtpConnectionPool(settings, password if password is not None else os.environ.get(PASSWORD_VARIABLE))
+    try:
+        # One connection is opened first, so a wrong host or password fails the run before anything is sent
+        pool.release(pool.connect())
+    except (smtplib.SMTPException, OSError) as e:
+        raise ValueError(f"Cannot log in to {settings['smtp_host']}:{settings['smtp_port']}: {_describe(e)}") from e
+    log = SendLog(output_dir)
+    results = [None] * len(jobs)
+
+    def settle(index, job, result):
+        if result is None:
+            return
+        if not result.skipped:
+            log.record(job, result)
+        results[index] = result
+        if on_result:
+            on_result(result)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, settings['connections'])) as executor:
+            for index, job in enumerate(jobs):
+                if job.address is None or not parseaddr(job.address)[1] or '@' not in job.address:
+                    error = f"No email address for {job.student_name}" if job.address is None else \
+                        f"'{job.address}' is not an email address"
+                    settle(index, job, EmailResult(job.student_name, job.address or '', job.path, error))
+                elif not resend and log.is_sent(job):
+                    settle(index, job, EmailResult(job.student_name, job.address, job.path, None, skipped=True))
+                elif job.path is None:
+                    settle(index, job, EmailResult(job.student_name, job.address, None,
+                                                   f"No feedback form found for {job.student_name}"))
+                else:
+                    future = executor.submit(_deliver, pool, job, settings['retries'], retry_delay, cancel_event)
+                    future.add_done_callback(lambda done, index=index, job=job: settle(index, job, done.result()))
+    finally:
+        pool.close()
+        log.close()
+    return [result for result in results if result is not None]
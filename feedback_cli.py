@@ -0,0 +1,207 @@
+"""
+Headless command line interface to the feedback form generator.
+
+Examples:
+    python feedback_cli.py generate marks.xlsx --output-dir forms --format PDF --engine "ReportLab PDF" --workers 8
+    python feedback_cli.py watch //share/marks --output-dir //share/forms --rubric rubric.docx
+    python feedback_cli.py email marks.xlsx --output-dir forms --config module.json
+    python feedback_cli.py generate marks.xlsx --output-dir upload --layout lms --grading-worksheet Grades.csv
+"""
+import argparse
+import getpass
+import multiprocessing
+import os
+import sys
+from cohort_statistics import STATISTICS_FORMATS, STATISTICS_NAME
+from feedback_config import config, FORM_ENGINE_NAMES, OUTPUT_LAYOUTS, load_config
+
+
+def generate(args):
+    from feedback_engine import run_generation
+    if args.config:
+        load_config(args.config)
+    if args.template:
+        config['form_template'] = args.template
+    if args.email and args.layout != 'files':
+        print("Error: --email sends one form per student, so it needs the 'files' layout", file=sys.stderr)
+        return 2
+    reports = []
+    try:
+        results = run_generation(args.input, output_dir=args.output_dir, output_format=args.format,
+                                 engine=args.engine, workers=args.workers, rubric_path=args.rubric,
+                                 incremental=not args.force, layout=args.layout, on_report=reports.append,
+                                 all_sheets=args.all_sheets, converters=args.converters,
+                                 low_memory=args.low_memory, statistics_formats=args.statistics,
+                                 grading_worksheet=args.grading_worksheet)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    failures = [result for result in results if result.error]
+    for result in failures:
+        print(f"Failed: {result.student_name}: {result.error}", file=sys.stderr)
+    # The report counts every student, also in low-memory mode where only failures are returned
+    report, = reports
+    print(f"Created {report.forms} of {report.forms + report.skipped + report.failed} forms for "
+          f"{config['module_code']} in {os.path.abspath(args.output_dir)} ({report.skipped} unchanged)")
+    print(f"{report.summary()}. Report: {report.path}")
+    if args.statistics and 'statistics' in report.stages:
+        base = os.path.join(args.output_dir, STATISTICS_NAME)
+        print(f"Cohort statistics: {', '.join(f'{base}.{extension}' for extension in args.statistics)}")
+    if args.email:
+        if failures:
+            # Their previous forms, if any, are out of date
+            print(f"Not emailing the forms because {len(failures)} failed; fix them and run the email command",
+                  file=sys.stderr)
+            return 1
+        return send_emails(args)
+    return 1 if failures else 0
+
+
+def email(args):
+    if args.config:
+        load_config(args.config)
+    return send_emails(args)
+
+
+def send_emails(args):
+    from email_distribution import PASSWORD_VARIABLE, SEND_LOG_NAME, send_feedback_emails
+    if args.connections:
+        config['email']['connections'] = args.connections
+    password = os.environ.get(PASSWORD_VARIABLE)
+    if password is None and config['email']['username']:
+        password = getpass.getpass(f"SMTP password for {config['email']['username']}: ")
+
+    def on_result(result):
+        if result.error:
+            print(f"Not sent: {result.student_name}: {result.error}", file=sys.stderr)
+        elif not result.skipped:
+            print(f"Sent: {result.address}")
+
+    try:
+        results = send_feedback_emails(args.input, output_dir=args.output_dir, output_format=args.format,
+                                       all_sheets=args.all_sheets, password=password, resend=args.resend,
+                                       on_result=on_result, engine=args.engine)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    failed = sum(1 for result in results if result.error)
+    skipped = sum(1 for result in results if result.skipped)
+    print(f"Emailed {len(results) - failed - skipped} of {len(results)} forms ({skipped} sent before, {failed} "
+          f"failed). Log: {os.path.join(args.output_dir, SEND_LOG_NAME)}")
+    return 1 if failed else 0
+
+
+def watch(args):
+    from watch_folder import FolderWatcher
+    if args.config:
+        load_config(args.config)
+    if args.template:
+        config['form_template'] = args.template
+    os.makedirs(args.output_dir, exist_ok=True)
+    watcher = FolderWatcher(args.folder, args.output_dir, rubric_path=args.rubric, output_format=args.format,
+                            engine=args.engine, workers=args.workers, interval=args.interval, debounce=args.debounce)
+    watcher.run()
+    return 0
+
+
+def existing_file(path):
+    if not os.path.isfile(path):
+        raise argparse.ArgumentTypeError(f"{path} does not exist")
+    return path
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='feedback_cli', description="Assignment feedback form generator")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    generate_parser = commands.add_parser('generate',
+                                          help="Generate a feedback form for every student in a mark sheet")
+    generate_parser.add_argument('input', help="Excel mark sheet with name, mark and feedback in the first columns, "
+                                               "or a directory whose workbooks are all processed")
+    generate_parser.add_argument('-o', '--output-dir', default='.', help="Directory to write the forms to")
+    generate_parser.add_argument('-f', '--format', choices=('Word', 'PDF'), default='Word', help="Output format")
+    generate_parser.add_argument('-e', '--engine', choices=FORM_ENGINE_NAMES, default='python-docx',
+                                 help="Document engine")
+    generate_parser.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1,
+                                 help="Number of worker processes (default: one per CPU)")
+    generate_parser.add_argument('-r', '--rubric', help="Word document whose last table is appended to every form")
+    generate_parser.add_argument('-c', '--config', help="JSON file overriding the settings in feedback_config.py")
+    generate_parser.add_argument('-t', '--template', type=existing_file,
+                                 help="Word form template with {{student}}, {{mark}}, {{comment}} and {{date}} "
+                                      "placeholders to use instead of the built-in layout")
+    generate_parser.add_argument('-l', '--layout', choices=tuple(OUTPUT_LAYOUTS.values()), default='files',
+                                 help="One file per student, one combined document with a bookmark per student, "
+                                      "one ZIP archive of per-student files, or a VLE bulk feedback upload package "
+                                      "(see --grading-worksheet)")
+    generate_parser.add_argument('-g', '--grading-worksheet', type=existing_file,
+                                 help="With --layout lms, the grading worksheet CSV downloaded from the assignment; "
+                                      "students are matched to it by the 'lms' settings and it is written back "
+                                      "with their grades")
+    generate_parser.add_argument('--all-sheets', action='store_true',
+                                 help="Process every sheet of the workbook, each into its own folder (always the "
+                                      "case for a directory)")
+    generate_parser.add_argument('--converters', type=int, default=1,
+                                 help="Number of threads converting forms to PDF while later forms are built "
+                                      "(Word converts one document at a time, so more only help other converters)")
+    generate_parser.add_argument('--low-memory', action='store_true',
+                                 help="Keep memory use flat for very large cohorts: only failed students are listed "
+                                      "in the report and combined Word documents are streamed to disk")
+    generate_parser.add_argument('--statistics', nargs='+', choices=STATISTICS_FORMATS, default=STATISTICS_FORMATS,
+                                 help="Formats of the cohort statistics written next to the forms (default: all)")
+    generate_parser.add_argument('--no-statistics', dest='statistics', action='store_const', const=(),
+                                 help="Do not write cohort statistics")
+    generate_parser.add_argument('--force', action='store_true',
+                                 help="Regenerate every form, even those whose inputs have not changed")
+    generate_parser.add_argument('--email', action='store_true',
+                                 help="Email every student their form once all forms are generated (see the email "
+                                      "command)")
+    generate_parser.add_argument('--connections', type=int,
+                                 help="With --email, number of SMTP connections sending at once")
+    generate_parser.add_argument('--resend', action='store_true',
+                                 help="With --email, also email forms the send log shows as sent")
+    generate_parser.set_defaults(handler=generate)
+
+    email_parser = commands.add_parser('email', help="Email every student the form generated for them")
+    email_parser.add_argument('input', help="The mark sheet, or directory of workbooks, the forms were generated "
+                                            "from, with an email column (see the 'email' settings)")
+    email_parser.add_argument('-o', '--output-dir', default='.', help="Directory the forms were written to")
+    email_parser.add_argument('-f', '--format', choices=('Word', 'PDF'), default='Word',
+                              help="Format the forms were generated in")
+    email_parser.add_argument('-e', '--engine', choices=FORM_ENGINE_NAMES, default='python-docx',
+                              help="Document engine the forms were generated with")
+    email_parser.add_argument('-c', '--config', help="JSON file overriding the settings in feedback_config.py, "
+                                                     "including the SMTP server under 'email'")
+    email_parser.add_argument('--all-sheets', action='store_true',
+                              help="Email the students of every sheet of the workbook")
+    email_parser.add_argument('--connections', type=int, help="Number of SMTP connections sending at once")
+    email_parser.add_argument('--resend', action='store_true',
+                              help="Also email forms the send log shows as sent already")
+    email_parser.set_defaults(handler=email)
+
+    watch_parser = commands.add_parser('watch', help="Keep the forms of every mark sheet in a folder up to date")
+    watch_parser.add_argument('folder', help="Drop folder searched for .xlsx workbooks, including subfolders")
+    watch_parser.add_argument('-o', '--output-dir', default='.', help="Directory to write the forms to")
+    watch_parser.add_argument('-f', '--format', choices=('Word', 'PDF'), default='Word', help="Output format")
+    watch_parser.add_argument('-e', '--engine', choices=FORM_ENGINE_NAMES, default='python-docx',
+                              help="Document engine")
+    watch_parser.add_argument('-w', '--workers', type=int, default=1, help="Number of worker processes")
+    watch_parser.add_argument('-r', '--rubric', help="Word document whose last table is appended to every form; "
+                                                     "changing it rebuilds every form")
+    watch_parser.add_argument('-c', '--config', help="JSON file overriding the settings in feedback_config.py")
+    watch_parser.add_argument('-t', '--template', type=existing_file,
+                              help="Word form template to use instead of the built-in layout")
+    watch_parser.add_argument('--interval', type=float, default=1.0, help="Seconds between checks of the folder")
+    watch_parser.add_argument('--debounce', type=float, default=2.0,
+                              help="Seconds a workbook must stay unchanged before it is processed")
+    watch_parser.set_defaults(handler=watch)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,95 @@
+"""Settings shared by the GUI and the generation engine; importing this module is cheap."""
+import json
+
+# Configuration settings
+config = {
+    'percentage_mark_label': 'Percentage Mark:',
+    'tutor_name': 'Dr. Kazber',
+    'module_title': 'Introduction to Game Design',
+    'module_code': 'GD101',
+    'assignment_title': 'Assignment 1',
+    'percent_of_module': '100%',
+    'form_template': None,  # Path of a .docx form with {{student}}, {{mark}} and {{comment}} placeholders
+    'font_sizes': {
+        'title': 20,
+        'year': 12,
+        'comment': 14,
+        'footer': 9
+    },
+    # How the mark on each form is worked out from the sheet, see `mark_aggregation.MarkScheme`
+    'marking': {
+        'criteria': {},  # Criterion column header -> weight; empty to use the mark column
+        'out_of': 100,  # Highest score of every criterion, or a dict of it per criterion
+        'late_column': 'Days Late',
+        'late_penalty': 0,  # Percentage points deducted per day late
+        'cap': None,  # Highest mark awarded, e.g. 40 for a capped resit
+        'rounding': None,  # None keeps marks as entered; 'half_up', 'half_even', 'down' or 'up' rounds them
+        'decimals': 0,  # Places marks are rounded to, when `rounding` is set
+        'grade_bands': [],  # [lowest mark, label] pairs, e.g. [[70, "First"], [60, "2:1"]]
+        'pass_mark': 40,  # Marks below it count as fails in the cohort statistics
+        'mark_format': '{mark}',  # Text of the mark cell, from {mark} and {grade}
+    },
+    # How forms are emailed to students, see `email_distribution.send_feedback_emails`. The password of
+    # `username` is read from the FEEDBACK_SMTP_PASSWORD environment variable rather than stored here
+    'email': {
+        'column': 'Email',  # Header of the column holding each student's address
+        'sender': '',  # From address, e.g. "Dr. Kazber <kazber@example.ac.uk>"
+        'subject': 'Feedback: {module_code} {assignment_title}',  # From {student} and the settings above
+        'body': 'Dear {student},\n\nPlease find attached your feedback for {assignment_title}.\n\n{tutor_name}\n',
+        'smtp_host': 'localhost',
+        'smtp_port': 587,
+        'security': 'starttls',  # 'starttls', 'ssl' or 'none'
+        'username': '',  # Empty for servers that do not need a login
+        'connections': 4,  # Messages sent at once, each over its own persistent connection
+        'messages_per_connection': 100,  # Reconnect after this many, as servers limit messages per session
+        'retries': 3,  # Further attempts after a temporary failure, with growing pauses
+        'timeout': 60,  # Seconds to wait for the server
+    },
+    # Bulk feedback upload package for the VLE, joined to its grading worksheet, see `lms_export.GradingWorksheet`
+    'lms': {
+        'sheet_key': 'Email',  # Mark sheet column identifying each student
+        'worksheet_key': 'Email address',  # Grading worksheet column holding the same identifiers
+        'identifier_column': 'Identifier',  # e.g. 'Participant 1234567'
+        'name_column': 'Full name',
+        'grade_column': 'Grade',
+        'comments_column': 'Feedback comments',  # Filled in with the feedback when present; '' to leave it
+        # Folder of each participant's feedback, from {full_name}, {participant} (the number) and {identifier}
+        'folder_name': '{full_name}_{participant}_assignsubmission_file_',
+    }
+}
+
+# Settings that only affect how finished forms are delivered, so changing them leaves the forms current
+DELIVERY_SETTINGS = ('email', 'lms')
+
+# Names of the form engines in `feedback_engine.FORM_ENGINES`, listed here so the GUI can offer them before the
+# engine and its document libraries are imported
+FORM_ENGINE_NAMES = ('python-docx', 'Direct XML', 'ReportLab PDF')
+
+
+def load_config(path):
+    """
+    Update `config` in place from a JSON file.
+
+    The file holds any subset of the keys of `config`, e.g. {"tutor_name": "Dr. Smith", "font_sizes": {"title": 22}};
+    nested dicts such as 'font_sizes' are merged rather than replaced.
+    """
+    with open(path, encoding='utf-8') as fh:
+        merge_settings(config, json.load(fh))
+
+
+def merge_settings(settings, overrides):
+    """Update the settings dict `settings` in place from `overrides`, merging nested dicts such as 'font_sizes'."""
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(settings.get(key), dict):
+            settings[key].update(value)
+        else:
+            settings[key] = value
+
+
+# Ways of laying out the output of a run, by GUI label, mapped to the `layout` of `feedback_engine.run_generation`
+OUTPUT_LAYOUTS = {
+    'One file per student': 'files',
+    'Combined document': 'combined',
+    'ZIP archive': 'archive',
+    'LMS upload package': 'lms',
+}
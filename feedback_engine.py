@@ -0,0 +1,1841 @@
+"""Feedback form generation engine, kept free of any GUI code so it can run in worker processes."""
+import copy
+import hashlib
+import io
+import json
+import os
+import queue
+import re
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import zipfile
+import zlib
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime
+from itertools import chain, islice
+from xml.sax.saxutils import escape
+from docx import Document
+from docx.enum.style import WD_STYLE_TYPE
+from docx.enum.text import WD_ALIGN_PARAGRAPH
+from docx.enum.table import WD_TABLE_ALIGNMENT
+from docx.shared import Pt, Inches
+from docx.oxml import OxmlElement, parse_xml
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.oxml.ns import nsdecls, qn
+from lxml import etree
+from reportlab.lib import colors
+from reportlab.lib.enums import TA_CENTER
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.units import inch
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak, Flowable
+from reportlab.platypus.doctemplate import LayoutError
+from feedback_config import config, DELIVERY_SETTINGS, FORM_ENGINE_NAMES, merge_settings
+from run_manifest import RunManifest, run_fingerprint, student_fingerprint
+from cohort_statistics import STATISTICS_FORMATS, CohortStatistics, write_statistics
+from lms_export import GradingWorksheet, lms_package_name
+from run_report import RunReport, peak_rss_bytes
+from student_reader import estimate_student_count, find_mark_sheets, iter_students
+
+# Named styles written once into the style part of every form. Tables and paragraphs refer to them by name, so
+# the form carries no per-cell border markup and a restyle only has to happen here.
+FORM_TABLE_STYLE = 'Feedback Grid'
+# python-docx derives the style ID that markup refers to from the name, without the spaces
+_FORM_TABLE_STYLE_ID = FORM_TABLE_STYLE.replace(' ', '')
+# Paragraph style name -> (key of config['font_sizes'], bold)
+FORM_PARAGRAPH_STYLES = {
+    'Feedback Title': ('title', True),
+    'Feedback Year': ('year', True),
+    'Feedback Heading': ('comment', True),
+    'Feedback Footer': ('footer', False),
+}
+
+
+def add_form_styles(doc):
+    """Define the `FORM_TABLE_STYLE` and `FORM_PARAGRAPH_STYLES` styles in `doc`, if it does not have them."""
+    styles = doc.styles
+    names = {style.name for style in styles}
+    if FORM_TABLE_STYLE not in names:
+        table_style = styles.add_style(FORM_TABLE_STYLE, WD_STYLE_TYPE.TABLE)
+        table_style.base_style = styles['Normal Table']
+        borders = ''.join(f'<w:{edge} w:val="single" w:sz="8" w:space="0" w:color="000000"/>'
+                          for edge in ('top', 'left', 'bottom', 'right', 'insideH', 'insideV'))
+        table_style.element.append(parse_xml(f'<w:tblPr {nsdecls("w")}><w:tblBorders>{borders}</w:tblBorders>'
+                                             f'</w:tblPr>'))
+    for name, (size_key, bold) in FORM_PARAGRAPH_STYLES.items():
+        if name in names:
+            continue
+        paragraph_style = styles.add_style(name, WD_STYLE_TYPE.PARAGRAPH)
+        paragraph_style.base_style = styles['Normal']
+        paragraph_style.font.size = Pt(config['font_sizes'][size_key])
+        paragraph_style.font.bold = bold or None
+        paragraph_style.paragraph_format.alignment = WD_ALIGN_PARAGRAPH.CENTER
+
+
+def extract_last_table_from_docx(doc_path):
+    doc = Document(doc_path)
+    if doc.tables:
+        return doc.tables[-1]
+    return None
+
+
+# Bumped whenever the cached rubric format changes, so stale cache entries are ignored
+RUBRIC_CACHE_VERSION = 2
+
+# Markup that points at parts of the source document (styles, numbering, images, notes) and would
+# dangle once the rubric is copied into a feedback form
+_RUBRIC_DANGLING_XPATH = ('.//w:tblStyle | .//w:pStyle | .//w:rStyle | .//w:numPr | .//w:drawing | .//w:pict'
+                          ' | .//w:object | .//w:commentReference | .//w:footnoteReference | .//w:endnoteReference'
+                          ' | .//w:tblBorders | .//w:tcBorders')
+
+
+class RubricFragment:
+    """
+    Compact, picklable copy of a rubric table, extracted once per rubric file.
+
+    Attributes:
+        xml: Serialized `w:tbl` element using the `FORM_TABLE_STYLE` borders, ready to be copied into a form.
+        rows: Cell text on the table grid, one list per row. Cells covered by a merge hold ''.
+        spans: Merged regions as (first_col, first_row, last_col, last_row) tuples on the same grid.
+        fingerprint: Hash of the rubric file the fragment was extracted from.
+    """
+
+    __slots__ = ('xml', 'rows', 'spans', 'fingerprint')
+
+    def __init__(self, xml, rows, spans, fingerprint=None):
+        self.xml = xml
+        self.rows = rows
+        self.spans = spans
+        self.fingerprint = fingerprint
+
+    @classmethod
+    def from_table(cls, table, fingerprint=None):
+        """Build a fragment from a python-docx `Table`, keeping merged cells and run formatting."""
+        tbl = copy.deepcopy(table._tbl)
+        for element in tbl.xpath(_RUBRIC_DANGLING_XPATH):
+            element.getparent().remove(element)
+        for hyperlink in tbl.xpath('.//w:hyperlink'):
+            parent = hyperlink.getparent()
+            index = parent.index(hyperlink)
+            for child in reversed(list(hyperlink)):
+                parent.insert(index, child)
+            parent.remove(hyperlink)
+        tbl.tblPr.insert(0, parse_xml(f'<w:tblStyle {nsdecls("w")} w:val="{_FORM_TABLE_STYLE_ID}"/>'))
+
+        rows = []
+        spans = []
+        # Grid column -> merged region of the vertical merge that is still open in that column
+        vertical_merges = {}
+        for row_index, tr in enumerate(tbl.tr_lst):
+            row = []
+            for tc in tr.tc_lst:
+                col_index = len(row)
+                span = tc.grid_span
+                if tc.vMerge == 'continue' and col_index in vertical_merges:
+                    vertical_merges[col_index][3] = row_index
+                    row.extend([''] * span)
+                    continue
+                row.append('\n'.join(''.join(p.xpath('.//w:t/text()')) for p in tc.p_lst))
+                row.extend([''] * (span - 1))
+                merge = [col_index, row_index, col_index + span - 1, row_index]
+                spans.append(merge)
+                if tc.vMerge == 'restart':
+                    vertical_merges[col_index] = merge
+                else:
+                    vertical_merges.pop(col_index, None)
+            rows.append(row)
+        width = max((len(row) for row in rows), default=0)
+        rows = [row + [''] * (width - len(row)) for row in rows]
+        spans = [tuple(merge) for merge in spans if merge[0] != merge[2] or merge[1] != merge[3]]
+        return cls(etree.tostring(tbl, encoding='unicode'), rows, spans, fingerprint)
+
+    def to_dict(self):
+        return {'version': RUBRIC_CACHE_VERSION, 'xml': self.xml, 'rows': self.rows,
+                'spans': [list(merge) for merge in self.spans], 'fingerprint': self.fingerprint}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['xml'], data['rows'], [tuple(merge) for merge in data['spans']], data['fingerprint'])
+
+
+def rubric_cache_dir():
+    base = os.environ.get('LOCALAPPDATA') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'FeedbackCreator', 'rubrics')
+
+
+# Rubrics loaded by this process, by absolute path: ((modification time, size), fragment). Keeps them warm in
+# long-running processes, such as the folder watcher, without even hashing the file again
+_loaded_rubrics = {}
+
+
+def load_rubric(doc_path, cache_dir=None):
+    """
+    Return the `RubricFragment` for the last table of `doc_path`, or None if it has no tables.
+
+    Parsed rubrics are cached on disk as JSON, keyed by the file's content hash and modification time, so
+    repeated runs with the same rubric skip parsing the .docx, and in memory for the rest of the process.
+    Pass `cache_dir=False` to disable both caches.
+    """
+    if cache_dir is False:
+        return _read_rubric(doc_path, cache_dir)
+    stat = os.stat(doc_path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    loaded = _loaded_rubrics.get(os.path.abspath(doc_path))
+    if loaded is not None and loaded[0] == signature:
+        return loaded[1]
+    fragment = _read_rubric(doc_path, cache_dir)
+    _loaded_rubrics[os.path.abspath(doc_path)] = (signature, fragment)
+    return fragment
+
+
+def _read_rubric(doc_path, cache_dir):
+    with open(doc_path, 'rb') as fh:
+        fingerprint = hashlib.sha256(fh.read()).hexdigest()
+    cache_file = None
+    if cache_dir is not False:
+        key = f'{fingerprint}-{os.stat(doc_path).st_mtime_ns}'
+        cache_file = os.path.join(cache_dir or rubric_cache_dir(), f'{key}.json')
+        try:
+            with open(cache_file, encoding='utf-8') as fh:
+                data = json.load(fh)
+            if data.get('version') == RUBRIC_CACHE_VERSION:
+                return RubricFragment.from_dict(data) if data['xml'] else None
+        except (OSError, ValueError, KeyError):
+            pass
+
+    table = extract_last_table_from_docx(doc_path)
+    fragment = RubricFragment.from_table(table, fingerprint) if table is not None else None
+    if cache_file:
+        data = fragment.to_dict() if fragment else {'version': RUBRIC_CACHE_VERSION, 'xml': None}
+        try:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            temp_file = f'{cache_file}.{os.getpid()}.tmp'
+            with open(temp_file, 'w', encoding='utf-8') as fh:
+                json.dump(data, fh)
+            os.replace(temp_file, cache_file)
+        except OSError:
+            pass
+    return fragment
+
+
+def append_table_to_document(target_doc, rubric):
+    """Append a copy of the `RubricFragment` table to the end of `target_doc`."""
+    tbl = parse_xml(rubric.xml)
+    body = target_doc.element.body
+    if body.sectPr is not None:
+        body.sectPr.addprevious(tbl)
+    else:
+        body.append(tbl)
+
+
+class FeedbackFormTemplate:
+    """
+    Pre-built feedback form that is cloned for each student.
+
+    Everything that does not depend on the student (headings, tables, borders, margins, footer and the
+    optional rubric) is built once with python-docx. `render` deep-copies the resulting XML body and only
+    fills in the student name, comment, mark and date runs, which is much cheaper than rebuilding the
+    whole document for every student.
+
+    Args:
+        rubric: Optional `RubricFragment` appended after the page break.
+    """
+
+    extension = '.docx'
+
+    def __init__(self, rubric=None):
+        doc = Document()
+        core_properties = doc.core_properties
+        core_properties.author = config['tutor_name']
+        sections = doc.sections
+        for section in sections:
+            section.top_margin = Inches(1)
+            section.bottom_margin = Inches(1)
+            section.left_margin = Inches(1)
+            section.right_margin = Inches(1)
+        add_form_styles(doc)
+        doc.add_paragraph('ASSIGNMENT FEEDBACK FORM', style='Feedback Title')
+        doc.add_paragraph('2024-25', style='Feedback Year')
+        table = doc.add_table(rows=3, cols=4, style=FORM_TABLE_STYLE)
+        table.autofit = False
+        table.alignment = WD_TABLE_ALIGNMENT.CENTER
+        for row in table.rows:
+            for cell in row.cells:
+                cell.width = Inches(1.5)
+        table.cell(0, 0).text = 'STUDENT:'
+        student_run = table.cell(0, 1).paragraphs[0].add_run()
+        table.cell(0, 2).text = 'TUTOR:'
+        table.cell(0, 3).text = config['tutor_name']
+        table.cell(1, 0).text = 'MODULE TITLE:'
+        table.cell(1, 1).text = config['module_title']
+        table.cell(1, 2).text = 'MODULE CODE:'
+        table.cell(1, 3).text = config['module_code']
+        table.cell(2, 0).text = 'ASSIGNMENT:'
+        table.cell(2, 1).text = config['assignment_title']
+        table.cell(2, 2).text = '% of module:'
+        table.cell(2, 3).text = config['percent_of_module']
+        doc.add_paragraph()
+        doc.add_paragraph('OVERALL COMMENT', style='Feedback Heading')
+        comment_table = doc.add_table(rows=1, cols=1, style=FORM_TABLE_STYLE)
+        comment_table.autofit = False
+        comment_table.alignment = WD_TABLE_ALIGNMENT.CENTER
+        comment_table.cell(0, 0).width = Inches(6)
+        comment_run = comment_table.cell(0, 0).paragraphs[0].add_run()
+        doc.add_paragraph()
+        table = doc.add_table(rows=1, cols=3, style=FORM_TABLE_STYLE)
+        table.autofit = False
+        table.alignment = WD_TABLE_ALIGNMENT.CENTER
+        for cell in table.rows[0].cells:
+            cell.width = Inches(2)
+        table.cell(0, 0).text = config['percentage_mark_label']
+        mark_paragraph = table.cell(0, 1).paragraphs[0]
+        mark_run = mark_paragraph.add_run()
+        mark_run.bold = True
+        table.cell(0, 1).paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.CENTER
+        table.cell(0, 2).text = 'Date:'
+        date_run = table.cell(0, 2).paragraphs[0].add_run()
+        date_run.bold = True
+        doc.add_paragraph()
+        doc.add_paragraph("NB All marks are provisional until confirmed by a formally constituted Board of Examiners",
+                          style='Feedback Footer')
+        doc.add_paragraph()
+        doc.add_page_break()
+        if rubric:
+            append_table_to_document(doc, rubric)
+
+        self._doc = doc
+        self._body = doc.element.body
+        self._pristine_body = copy.deepcopy(self._body)
+        self._slots = {
+            'student': self._element_path(student_run._r),
+            'comment': self._element_path(comment_run._r),
+            'mark': self._element_path(mark_run._r),
+            'date': self._element_path(date_run._r),
+        }
+
+    def _element_path(self, element):
+        # Child indexes from the body down to `element`, valid for every deep copy of the body
+        path = []
+        while element is not self._body:
+            parent = element.getparent()
+            path.append(parent.index(element))
+            element = parent
+        return tuple(reversed(path))
+
+    def _filled_body(self, student_name, student_mark, feedback, date=None):
+        body = copy.deepcopy(self._pristine_body)
+        values = {
+            'student': str(student_name),
+            'comment': str(feedback),
+            'mark': str(student_mark),
+            'date': date or datetime.now().strftime('%Y-%m-%d'),
+        }
+        for slot, path in self._slots.items():
+            element = body
+            for index in path:
+                element = element[index]
+            element.text = values[slot]
+        return body
+
+    def _swap_body(self, body):
+        self._doc.element.replace(self._body, body)
+        self._body = body
+
+    def render(self, student_name, student_mark, feedback, date=None):
+        """
+        Fill a fresh copy of the template with one student's details.
+
+        Returns:
+            The python-docx `Document`, ready to be saved. The same object is reused by the next call,
+            so it must be saved before rendering the next student.
+        """
+        self._swap_body(self._filled_body(student_name, student_mark, feedback, date))
+        return self._doc
+
+    def write(self, file_name, form, student_name=None):
+        """Save a `Document` returned by `render` to `file_name`."""
+        form.save(file_name)
+
+    def save(self, file_name, student_name, student_mark, feedback, date=None):
+        self.write(file_name, self.render(student_name, student_mark, feedback, date))
+
+    def open_combined(self, file_name, title=None):
+        """Start a single document holding the forms of a whole cohort; see `generate_combined_feedback`."""
+        return _CombinedDocxWriter(self, file_name)
+
+
+def _bookmark_name(index, student_name):
+    # Word bookmark names must start with a letter, contain no spaces and be at most 40 characters long
+    return f"S{index + 1}_{re.sub(r'[^0-9A-Za-z_]', '_', str(student_name))}"[:40]
+
+
+def _is_page_break(block):
+    # A paragraph whose last run ends with a page break, such as the one `doc.add_page_break()` adds
+    if block.tag != qn('w:p'):
+        return False
+    runs = block.findall(qn('w:r'))
+    return bool(runs) and len(runs[-1]) > 0 and runs[-1][-1].tag == qn('w:br') \
+        and runs[-1][-1].get(qn('w:type')) == 'page'
+
+
+class _CombinedDocxWriter:
+    """Appends every student's filled-in template body to one python-docx document, saved on `close`."""
+
+    def __init__(self, template, file_name):
+        self._template = template
+        self._file_name = file_name
+        self._count = 0
+        body = copy.deepcopy(template._pristine_body)
+        for child in list(body):
+            if child.tag != qn('w:sectPr'):
+                body.remove(child)
+        template._swap_body(body)
+        self._sectPr = body.sectPr
+
+    def add(self, index, student_name, student_mark, feedback, date=None):
+        student_body = self._template._filled_body(student_name, student_mark, feedback, date)
+        blocks = [child for child in student_body if child.tag != qn('w:sectPr')]
+        # Forms are separated by the page breaks added here, so a form's own closing break would leave a blank page
+        if len(blocks) > 1 and _is_page_break(blocks[-1]):
+            blocks.pop()
+        bookmark_start = OxmlElement('w:bookmarkStart')
+        bookmark_start.set(qn('w:id'), str(index))
+        bookmark_start.set(qn('w:name'), _bookmark_name(index, student_name))
+        bookmark_end = OxmlElement('w:bookmarkEnd')
+        bookmark_end.set(qn('w:id'), str(index))
+        first_paragraph = blocks[0]
+        first_paragraph.insert(1 if first_paragraph.pPr is not None else 0, bookmark_start)
+        bookmark_start.addnext(bookmark_end)
+        if self._count:
+            page_break = parse_xml(f'<w:p {nsdecls("w")}><w:r><w:br w:type="page"/></w:r></w:p>')
+            self._sectPr.addprevious(page_break)
+        for block in blocks:
+            self._sectPr.addprevious(block)
+        self._count += 1
+
+    def close(self):
+        self._template._doc.save(self._file_name)
+
+
+# Characters that are not allowed in XML 1.0 text, e.g. stray control codes pasted into a spreadsheet
+_INVALID_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+_SLOT_MARKER = '@@FEEDBACK_SLOT_{}@@'
+# Details that differ between the students of a run, in the order `FeedbackFormTemplate.render` takes them
+TEMPLATE_SLOTS = ('student', 'mark', 'comment', 'date')
+
+
+def _xml_text(value):
+    """Escape `value` for use inside a `w:t` element, turning line breaks and tabs into Word markup."""
+    text = escape(_INVALID_XML_CHARS.sub('', str(value)))
+    text = text.replace('\r\n', '\n').replace('\r', '\n')
+    text = text.replace('\n', '</w:t><w:br/><w:t xml:space="preserve">')
+    return text.replace('\t', '</w:t><w:tab/><w:t xml:space="preserve">')
+
+
+def _zip_entry(name, data, level=6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush()
+    return name.encode('utf-8'), zlib.crc32(data), compressed, len(data)
+
+
+class OoxmlFormWriter:
+    """
+    Direct OOXML backend that writes the .docx package without building python-docx objects per student.
+
+    The form is laid out once by `FeedbackFormTemplate`, so both engines produce the same document. Its
+    `word/document.xml` is compiled into a list of escaped string chunks with the student slots between
+    them, and every other package part (styles, settings, theme, content types, ...) is compressed once
+    and kept as cached bytes. Writing a form is then a string join, one deflate of document.xml and a
+    sequential write of the zip container.
+
+    Args:
+        rubric: Optional `RubricFragment` appended after the page break.
+    """
+
+    extension = '.docx'
+    _DOCUMENT_PART = 'word/document.xml'
+
+    def __init__(self, rubric=None):
+        template = FeedbackFormTemplate(rubric)
+        self._compile(template.render(*(_SLOT_MARKER.format(slot) for slot in TEMPLATE_SLOTS)))
+
+    def _compile(self, doc):
+        # Splits the document.xml of `doc`, whose text holds a `_SLOT_MARKER` for every slot, into the chunks
+        # filled in by `render_body` and caches the other parts of the package
+        package = io.BytesIO()
+        doc.save(package)
+        package.seek(0)
+
+        self._static_entries = []
+        with zipfile.ZipFile(package) as source:
+            for name in source.namelist():
+                if name == self._DOCUMENT_PART:
+                    document_xml = source.read(name).decode('utf-8')
+                else:
+                    self._static_entries.append(_zip_entry(name, source.read(name)))
+
+        for slot in TEMPLATE_SLOTS:
+            marker = _SLOT_MARKER.format(slot)
+            document_xml = document_xml.replace(f'<w:t>{marker}</w:t>', f'<w:t xml:space="preserve">{marker}</w:t>')
+        # The body content is kept apart from the document prologue and the trailing section properties, so
+        # several students' bodies can be streamed into one combined document
+        body_start = document_xml.index('<w:body>') + len('<w:body>')
+        body_end = document_xml.rindex('<w:sectPr')
+        self._prefix = document_xml[:body_start]
+        self._suffix = document_xml[body_end:]
+        # Even indexes are literal XML, odd indexes are slot names
+        self._chunks = re.split('@@FEEDBACK_SLOT_({})@@'.format('|'.join(TEMPLATE_SLOTS)),
+                                document_xml[body_start:body_end])
+        now = datetime.now()
+        self._dos_time = (now.hour << 11) | (now.minute << 5) | (now.second // 2)
+        self._dos_date = ((now.year - 1980) << 9) | (now.month << 5) | now.day
+
+    def render_body(self, student_name, student_mark, feedback, date=None):
+        """Return the XML of the body content (without section properties) for one student."""
+        values = {
+            'student': _xml_text(student_name),
+            'comment': _xml_text(feedback),
+            'mark': _xml_text(student_mark),
+            'date': _xml_text(date or datetime.now().strftime('%Y-%m-%d')),
+        }
+        chunks = self._chunks[:]
+        for index in range(1, len(chunks), 2):
+            chunks[index] = values[chunks[index]]
+        return ''.join(chunks)
+
+    def render(self, student_name, student_mark, feedback, date=None):
+        """Return the `word/document.xml` bytes for one student."""
+        document_xml = self._prefix + self.render_body(student_name, student_mark, feedback, date) + self._suffix
+        return document_xml.encode('utf-8')
+
+    def open_combined(self, file_name, title=None):
+        """Start a single document holding the forms of a whole cohort; see `generate_combined_feedback`."""
+        return _CombinedOoxmlWriter(self, file_name)
+
+    def save(self, file_name, student_name, student_mark, feedback, date=None):
+        """Write one student's .docx to `file_name`, which may also be a writable binary file object."""
+        self.write(file_name, self.render(student_name, student_mark, feedback, date))
+
+    def write(self, file_name, document_xml, student_name=None):
+        """Write the .docx package around `document_xml` returned by `render` to `file_name`."""
+        entries = [_zip_entry(self._DOCUMENT_PART, document_xml, level=1)] + self._static_entries
+        central_directory = []
+        offset = 0
+        with (open(file_name, 'wb') if isinstance(file_name, (str, os.PathLike)) else nullcontext(file_name)) as fh:
+            for name, crc, compressed, size in entries:
+                header = struct.pack('<IHHHHHIIIHH', 0x04034b50, 20, 0x800, 8, self._dos_time, self._dos_date,
+                                     crc, len(compressed), size, len(name), 0)
+                fh.write(header)
+                fh.write(name)
+                fh.write(compressed)
+                central_directory.append(
+                    struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, 20, 20, 0x800, 8, self._dos_time, self._dos_date,
+                                crc, len(compressed), size, len(name), 0, 0, 0, 0, 0, offset) + name)
+                offset += len(header) + len(name) + len(compressed)
+            directory = b''.join(central_directory)
+            fh.write(directory)
+            fh.write(struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, len(entries), len(entries), len(directory),
+                                 offset, 0))
+
+
+# A paragraph holding nothing but a page break at the end of a form's body XML
+_TRAILING_PAGE_BREAK = re.compile(r'<w:p(?: [^>]*)?>(?:<w:pPr>(?:(?!</w:p>).)*</w:pPr>)?<w:r(?: [^>]*)?>'
+                                  r'(?:<w:rPr>(?:(?!</w:r>).)*</w:rPr>)?<w:br w:type="page"/></w:r></w:p>\s*$')
+
+
+class _CombinedOoxmlWriter:
+    """Streams every student's body XML into the `word/document.xml` entry of one .docx package."""
+
+    def __init__(self, writer, file_name):
+        self._writer = writer
+        self._count = 0
+        self._package = zipfile.ZipFile(file_name, 'w', zipfile.ZIP_DEFLATED)
+        for name, crc, compressed, size in writer._static_entries:
+            self._package.writestr(name.decode('utf-8'), zlib.decompress(compressed, -15))
+        self._document = self._package.open(writer._DOCUMENT_PART, 'w', force_zip64=True)
+        self._document.write(writer._prefix.encode('utf-8'))
+
+    def add(self, index, student_name, student_mark, feedback, date=None):
+        body = self._writer.render_body(student_name, student_mark, feedback, date)
+        # Forms are separated by the page breaks added here, so a form's own closing break would leave a blank page
+        body = _TRAILING_PAGE_BREAK.sub('', body)
+        # Bookmark the first run of the form, i.e. its title
+        first_run = re.search('<w:r[ >]', body).start()
+        bookmark = (f'<w:bookmarkStart w:id="{index}" w:name="{_bookmark_name(index, student_name)}"/>'
+                    f'<w:bookmarkEnd w:id="{index}"/>')
+        if self._count:
+            self._document.write(b'<w:p><w:r><w:br w:type="page"/></w:r></w:p>')
+        self._document.write((body[:first_run] + bookmark + body[first_run:]).encode('utf-8'))
+        self._count += 1
+
+    def close(self):
+        self._document.write(self._writer._suffix.encode('utf-8'))
+        self._document.close()
+        self._package.close()
+
+
+_PLACEHOLDER = re.compile(r'\{\{\s*(\w+)\s*\}\}')
+
+
+def _paragraph_texts(paragraph):
+    # The w:t elements of a paragraph itself, leaving out those of paragraphs nested in its text boxes
+    return [text for text in paragraph.iter(qn('w:t')) if next(text.iterancestors(qn('w:p'))) is paragraph]
+
+
+def _merge_split_placeholders(texts):
+    """
+    Move every placeholder in a paragraph's `w:t` elements into the element it starts in.
+
+    Word splits text into runs wherever formatting, spell checking or revision tracking changes, so a
+    '{{student}}' typed into a template is often stored as '{{', 'student' and '}}' in three runs. The
+    placeholder takes on the formatting of the run it starts in.
+    """
+    offsets = []
+    full_text = ''
+    for text in texts:
+        offsets.append(len(full_text))
+        full_text += text.text or ''
+    # From the last placeholder back, so the offsets of the runs before each placeholder stay valid
+    for match in reversed(list(_PLACEHOLDER.finditer(full_text))):
+        start, end = match.span()
+        first = max(index for index, offset in enumerate(offsets) if offset <= start)
+        last = max(index for index, offset in enumerate(offsets) if offset < end)
+        if first == last:
+            continue
+        texts[first].text = texts[first].text[:start - offsets[first]] + match.group(0)
+        for text in texts[first + 1:last]:
+            text.text = ''
+        texts[last].text = texts[last].text[end - offsets[last]:]
+
+
+def _fill_placeholders(texts, values, where):
+    def value(match):
+        name = match.group(1)
+        if name in values:
+            return values[name]
+        if name in TEMPLATE_SLOTS:
+            raise ValueError(f"{match.group(0)} can only be used in the body of a form template, not in {where}")
+        raise ValueError(f"Unknown placeholder {match.group(0)} in the {where} of the form template; use "
+                         f"{', '.join(TEMPLATE_SLOTS)}, rubric or a setting such as module_code")
+
+    for text in texts:
+        if text.text and '{{' in text.text:
+            text.text = _PLACEHOLDER.sub(value, text.text)
+            # Keeps the spaces around a student's details
+            text.set(qn('xml:space'), 'preserve')
+
+
+class DocxTemplateWriter(OoxmlFormWriter):
+    """
+    Fills in a school's own .docx form template instead of the built-in layout.
+
+    The template is compiled once per run. Placeholders that Word split over several runs are merged,
+    setting placeholders such as {{module_code}} or {{tutor_name}} are replaced by the values in `config`,
+    and {{student}}, {{mark}}, {{comment}} and {{date}} become the slots of `OoxmlFormWriter`, so writing a
+    form costs the same few string substitutions as with the Direct XML engine. A paragraph holding only
+    {{rubric}} is replaced by the rubric table; without it the rubric follows the template on a new page.
+    Headers and footers may hold setting placeholders only, as they are shared by every form.
+
+    Args:
+        template_path: The .docx template, as set by `config['form_template']`.
+        rubric: Optional `RubricFragment`.
+
+    Raises:
+        ValueError: If the template holds an unknown placeholder or a student placeholder outside the body.
+    """
+
+    def __init__(self, template_path, rubric=None):
+        doc = Document(template_path)
+        settings = {key: str(value) for key, value in config.items() if not isinstance(value, dict)}
+        values = dict(settings, **{slot: _SLOT_MARKER.format(slot) for slot in TEMPLATE_SLOTS})
+        rubric_paragraph = None
+        for paragraph in list(doc.element.body.iter(qn('w:p'))):
+            texts = _paragraph_texts(paragraph)
+            _merge_split_placeholders(texts)
+            match = _PLACEHOLDER.fullmatch(''.join(text.text or '' for text in texts).strip())
+            if match and match.group(1) == 'rubric':
+                rubric_paragraph = paragraph
+                for text in texts:
+                    text.text = ''
+                continue
+            _fill_placeholders(texts, values, 'body')
+        for relationship in doc.part.rels.values():
+            if relationship.reltype in (RT.HEADER, RT.FOOTER):
+                for paragraph in relationship.target_part.element.iter(qn('w:p')):
+                    texts = _paragraph_texts(paragraph)
+                    _merge_split_placeholders(texts)
+                    _fill_placeholders(texts, settings, 'headers and footers')
+        if rubric:
+            # The rubric table refers to the form's table style for its borders
+            add_form_styles(doc)
+            if rubric_paragraph is not None:
+                rubric_paragraph.addprevious(parse_xml(rubric.xml))
+            else:
+                doc.add_page_break()
+                append_table_to_document(doc, rubric)
+        self._compile(doc)
+
+
+def _paragraph_markup(value):
+    """Escape `value` for a reportlab `Paragraph`, keeping its line breaks."""
+    text = escape(_INVALID_XML_CHARS.sub('', str(value)))
+    return text.replace('\r\n', '\n').replace('\r', '\n').replace('\n', '<br/>')
+
+
+class ReportlabFormWriter:
+    """
+    Native PDF backend that draws the feedback form with reportlab, without Word or docx2pdf.
+
+    The layout follows `FeedbackFormTemplate`: centred headings, the bordered header table, the overall
+    comment box, the mark/date table, the provisional-marks footer and the optional rubric on its own page.
+    Paragraph styles, table styles and every constant cell are built once; rendering a student only creates
+    the three small tables that hold their details.
+
+    Args:
+        rubric: Optional `RubricFragment` drawn on the second page.
+    """
+
+    extension = '.pdf'
+
+    def __init__(self, rubric=None):
+        styles = getSampleStyleSheet()
+        font_sizes = config['font_sizes']
+        self._body_style = ParagraphStyle('FeedbackBody', parent=styles['Normal'], fontName='Helvetica',
+                                          fontSize=11, leading=14)
+        self._mark_style = ParagraphStyle('FeedbackMark', parent=self._body_style, fontName='Helvetica-Bold',
+                                          alignment=TA_CENTER)
+        self._footer_style = ParagraphStyle('FeedbackFooter', parent=self._body_style,
+                                            fontSize=font_sizes['footer'], leading=font_sizes['footer'] * 1.2,
+                                            alignment=TA_CENTER)
+        self._grid_style = TableStyle([
+            ('GRID', (0, 0), (-1, -1), 1, colors.black),
+            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+        ])
+        # The comment box holds one row per paragraph without lines between them, so it can break across pages
+        self._box_style = TableStyle([
+            ('BOX', (0, 0), (-1, -1), 1, colors.black),
+            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+        ])
+
+        def heading(text, font_size):
+            style = ParagraphStyle(f'FeedbackHeading{font_size}', parent=self._body_style,
+                                   fontName='Helvetica-Bold', fontSize=font_size, leading=font_size * 1.2,
+                                   alignment=TA_CENTER, spaceAfter=6)
+            return Paragraph(_paragraph_markup(text), style)
+
+        def cell(text):
+            return Paragraph(_paragraph_markup(text), self._body_style)
+
+        self._title = heading('ASSIGNMENT FEEDBACK FORM', font_sizes['title'])
+        self._year = heading('2024-25', font_sizes['year'])
+        self._comment_heading = heading('OVERALL COMMENT', font_sizes['comment'])
+        self._footer = Paragraph(
+            "NB All marks are provisional until confirmed by a formally constituted Board of Examiners",
+            self._footer_style)
+        # The student's name goes into the second cell of the first row
+        self._header_rows = [
+            [cell('STUDENT:'), None, cell('TUTOR:'), cell(config['tutor_name'])],
+            [cell('MODULE TITLE:'), cell(config['module_title']), cell('MODULE CODE:'), cell(config['module_code'])],
+            [cell('ASSIGNMENT:'), cell(config['assignment_title']), cell('% of module:'),
+             cell(config['percent_of_module'])],
+        ]
+        self._mark_label = cell(config['percentage_mark_label'])
+
+        self._rubric_rows = None
+        self._rubric_widths = None
+        self._rubric_style = None
+        if rubric and rubric.rows:
+            self._rubric_rows = [[cell(text) for text in row] for row in rubric.rows]
+            columns = len(rubric.rows[0])
+            self._rubric_widths = [6.5 * inch / columns] * columns
+            self._rubric_style = TableStyle(
+                list(self._grid_style.getCommands())
+                + [('SPAN', (first_col, first_row), (last_col, last_row))
+                   for first_col, first_row, last_col, last_row in rubric.spans])
+
+    def render(self, student_name, student_mark, feedback, date=None):
+        """Return the list of reportlab flowables for one student's form."""
+        date = date or datetime.now().strftime('%Y-%m-%d')
+        header_rows = [row[:] for row in self._header_rows]
+        header_rows[0][1] = Paragraph(_paragraph_markup(student_name), self._body_style)
+        header = Table(header_rows, colWidths=[1.5 * inch] * 4, hAlign='CENTER', style=self._grid_style)
+        # A single cell cannot be split, so a comment longer than a page would not fit; splitInRow also lets
+        # one long paragraph continue on the next page
+        lines = [line for line in str(feedback).splitlines() if line.strip()] or [' ']
+        comment = Table([[Paragraph(_paragraph_markup(line), self._body_style)] for line in lines],
+                        colWidths=[6 * inch], hAlign='CENTER', style=self._box_style, splitInRow=1)
+        marks = Table([[self._mark_label, Paragraph(_paragraph_markup(student_mark), self._mark_style),
+                        Paragraph(f'Date:<b>{_paragraph_markup(date)}</b>', self._body_style)]],
+                      colWidths=[2 * inch] * 3, hAlign='CENTER', style=self._grid_style)
+        # reportlab marks a flowable it pushes to the next page and never clears the mark, so the shared
+        # flowables are shallow-copied into each story; otherwise a form that overflows a page breaks every
+        # later form
+        title, year, comment_heading, footer = map(copy.copy, (self._title, self._year, self._comment_heading,
+                                                                self._footer))
+        story = [title, year, header, Spacer(1, 14), comment_heading, comment, Spacer(1, 14), marks,
+                 Spacer(1, 14), footer]
+        if self._rubric_rows:
+            story.append(PageBreak())
+            story.append(Table(self._rubric_rows, colWidths=self._rubric_widths, hAlign='CENTER',
+                               style=self._rubric_style))
+        return story
+
+    def _document_settings(self, title):
+        return dict(pagesize=letter, leftMargin=inch, rightMargin=inch, topMargin=inch, bottomMargin=inch,
+                    author=config['tutor_name'], title=title)
+
+    def _document(self, file_name, title):
+        return SimpleDocTemplate(file_name, **self._document_settings(title))
+
+    def write(self, file_name, story, student_name=None):
+        """Lay out the flowables returned by `render` and write the PDF to `file_name`."""
+        self._document(file_name, f'Assignment Feedback Form - {student_name}').build(story)
+
+    def save(self, file_name, student_name, student_mark, feedback, date=None):
+        self.write(file_name, self.render(student_name, student_mark, feedback, date), student_name)
+
+    def open_combined(self, file_name, title=None):
+        """Start a single document holding the forms of a whole cohort; see `generate_combined_feedback`."""
+        return _CombinedPdfWriter(self, file_name, title)
+
+
+class _OutlineBookmark(Flowable):
+    """Zero-size flowable that bookmarks the page it lands on and lists it in the PDF outline."""
+
+    def __init__(self, key, title, index=None):
+        super().__init__()
+        self.key = key
+        self.title = title
+        self.index = index
+
+    def wrap(self, available_width, available_height):
+        return 0, 0
+
+    def draw(self):
+        self.canv.bookmarkPage(self.key)
+        self.canv.addOutlineEntry(self.title, self.key, level=0)
+
+
+class _StudentGuardedDocTemplate(SimpleDocTemplate):
+    """
+    Lays out a combined story student by student: a form that cannot be laid out, e.g. because of a word too
+    wide for its cell, is cut short where it failed and the error is kept in `failures` by student index,
+    instead of aborting the whole document.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.failures = {}
+        self._student = None
+
+    def handle_flowable(self, flowables):
+        if flowables and isinstance(flowables[0], _OutlineBookmark):
+            self._student = flowables[0].index
+        try:
+            super().handle_flowable(flowables)
+        except LayoutError as e:
+            self.failures[self._student] = f"The form does not fit on a page: {str(e).splitlines()[0]}"
+            # Skip the rest of this form, keeping the page break before the next student's form
+            while flowables and not (isinstance(flowables[0], PageBreak) and len(flowables) > 1
+                                     and isinstance(flowables[1], _OutlineBookmark)):
+                del flowables[0]
+
+
+class _CombinedPdfWriter:
+    """Collects every student's flowables, separated by page breaks, and builds one PDF on `close`."""
+
+    def __init__(self, writer, file_name, title):
+        self._document = _StudentGuardedDocTemplate(file_name, **writer._document_settings(
+            title or 'Assignment Feedback Forms'))
+        self._writer = writer
+        self._story = []
+
+    def add(self, index, student_name, student_mark, feedback, date=None):
+        flowables = self._writer.render(student_name, student_mark, feedback, date)
+        if self._story:
+            self._story.append(PageBreak())
+        self._story.append(_OutlineBookmark(_bookmark_name(index, student_name), str(student_name), index))
+        self._story.extend(flowables)
+
+    def close(self):
+        """Build the PDF and return the errors of the forms that could not be laid out, by student index."""
+        self._document.build(self._story)
+        return self._document.failures
+
+
+# Output engines selectable from the GUI, by the names listed in `feedback_config.FORM_ENGINE_NAMES`
+FORM_ENGINES = dict(zip(FORM_ENGINE_NAMES, (FeedbackFormTemplate, OoxmlFormWriter, ReportlabFormWriter)))
+
+
+def template_fingerprint(path):
+    """Return the hash of the contents of a form template, or None when `path` is not set."""
+    if not path:
+        return None
+    with open(path, 'rb') as fh:
+        return hashlib.sha256(fh.read()).hexdigest()
+
+
+def form_engine(engine, rubric=None):
+    """
+    Build the form engine named `engine` in `FORM_ENGINES` for the current `config`.
+
+    When `config['form_template']` names a .docx template, the forms follow it instead of the built-in layout
+    (see `DocxTemplateWriter`), whichever Word engine is chosen.
+    """
+    if config['form_template']:
+        if FORM_ENGINES[engine].extension != '.docx':
+            raise ValueError(f"The '{engine}' engine draws the built-in layout; use a Word engine with a form "
+                             f"template")
+        return DocxTemplateWriter(config['form_template'], rubric)
+    return FORM_ENGINES[engine](rubric)
+
+
+def form_file_name(student_name, extension, output_dir=None):
+    file_name = f'Assignment_Feedback_Form_{student_name}{extension}'
+    return os.path.join(output_dir, file_name) if output_dir else file_name
+
+
+def write_form(template, target, student_name, student_mark, feedback, timings=None):
+    """
+    Render one student's form with `template` and write it to `target`, a path or a binary file object.
+
+    When a `timings` dict is given, the seconds spent rendering ('build') and writing ('save') are added to it.
+    """
+    start = time.perf_counter()
+    form = template.render(student_name, student_mark, feedback if feedback else ' ')
+    built = time.perf_counter()
+    template.write(target, form, student_name)
+    if timings is not None:
+        timings['build'] = built - start
+        timings['save'] = time.perf_counter() - built
+
+
+def create_feedback_form_in_docx(student_name, student_mark, feedback, extra_table, output_format, template=None,
+                                 output_dir=None, timings=None):
+    """
+    Generate one student's feedback form and return the path of the saved file.
+
+    Pass a form engine from `FORM_ENGINES` built once per run as `template` when generating many forms;
+    without it a python-docx template is built for this call alone. The form is written to `output_dir`,
+    or to the current directory when it is not given. Engines that draw PDF directly ignore `output_format`.
+
+    When a `timings` dict is given, it receives the seconds spent on 'build', 'save' and 'convert' and the
+    'bytes' of the saved file; see `run_report.RunReport`.
+    """
+    if template is None:
+        template = FeedbackFormTemplate(extra_table)
+    doc_file_name = form_file_name(student_name, template.extension, output_dir)
+    write_form(template, doc_file_name, student_name, student_mark, feedback, timings)
+    print(f"Saved: {doc_file_name}")
+
+    # Convert to PDF if needed
+    if output_format == 'PDF' and template.extension == '.docx':
+        from docx2pdf import convert
+        pdf_file_name = doc_file_name.replace('.docx', '.pdf')
+        start = time.perf_counter()
+        convert(doc_file_name, pdf_file_name)
+        if timings is not None:
+            timings['convert'] = time.perf_counter() - start
+            timings['bytes'] = os.path.getsize(pdf_file_name)
+        print(f"Converted to PDF: {pdf_file_name}")
+        return pdf_file_name
+
+    if timings is not None:
+        timings['bytes'] = os.path.getsize(doc_file_name)
+    return doc_file_name
+
+
+# Outcome of generating one student's form; `error` is None on success, `skipped` is True when an
+# incremental run found the existing form up to date and `timings` holds what `create_feedback_form_in_docx`
+# measured, plus the worker's peak memory
+FormResult = namedtuple('FormResult', ['index', 'student_name', 'path', 'error', 'skipped', 'timings'],
+                        defaults=(False, None))
+
+# Per-process state of the parallel workers, set up by `_init_worker`. A run holds one job per mark sheet and
+# each chunk carries the settings of its job, so a worker switches settings between chunks and keeps the form
+# engine it built for each settings warm, across runs as well when the pool is reused (see `start_worker_pool`)
+_worker_rubric = None
+_worker_engine = None
+_worker_templates = {}
+# Form template path -> content hash the engines in `_worker_templates` were built from
+_worker_template_versions = {}
+_worker_settings = None
+_worker_template = None
+_worker_output_format = None
+_worker_cancel_event = None
+_worker_output_dir = None
+_worker_in_memory = False
+
+
+def _init_worker(rubric, engine, cancel_event=None, in_memory=False):
+    global _worker_rubric, _worker_engine, _worker_templates, _worker_settings, _worker_cancel_event, \
+        _worker_in_memory
+    # Form engines built for earlier runs in this process stay valid as long as the rubric and engine are the same
+    if (engine, rubric.fingerprint if rubric else None) != \
+            (_worker_engine, _worker_rubric.fingerprint if _worker_rubric else None):
+        _worker_templates = {}
+    _worker_rubric = rubric
+    _worker_engine = engine
+    _worker_settings = None
+    _worker_cancel_event = cancel_event
+    _worker_in_memory = in_memory
+
+
+def _use_job(settings):
+    # Switches `config` to a job's (frozen config, template hash, output format, output directory) settings and
+    # builds the form engine for that config the first time it is seen
+    global _worker_settings, _worker_template, _worker_output_format, _worker_output_dir, _worker_templates
+    if settings == _worker_settings:
+        return
+    frozen_config, form_template_hash, _worker_output_format, _worker_output_dir = settings
+    config.clear()
+    config.update(frozen_config)
+    form_template = frozen_config['form_template']
+    if form_template and _worker_template_versions.get(form_template, form_template_hash) != form_template_hash:
+        # The template was edited since its engines were compiled
+        _worker_templates = {}
+    if form_template:
+        _worker_template_versions[form_template] = form_template_hash
+    template_key = json.dumps([frozen_config, form_template_hash], sort_keys=True, default=str)
+    if template_key not in _worker_templates:
+        _worker_templates[template_key] = form_engine(_worker_engine, _worker_rubric)
+    _worker_template = _worker_templates[template_key]
+    _worker_settings = settings
+
+
+def start_worker_pool(workers, rubric_path=None, engine='python-docx'):
+    """
+    Start a pool of worker processes that can be passed as `pool` to several generation runs in a row.
+
+    The workers keep their form engines between runs, so a long-running process such as the folder watcher
+    does not rebuild them for every batch. Runs using the pool must use the same rubric and engine.
+    """
+    rubric = load_rubric(rubric_path) if rubric_path else None
+    return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(rubric, engine))
+
+
+def _generate_chunk(chunk):
+    """
+    Generate a chunk of one job's forms.
+
+    Returns:
+        The job key and a list of (FormResult, bytes) pairs; the bytes are only set in memory mode.
+    """
+    key, settings, entries = chunk
+    _use_job(settings)
+    results = []
+    for index, (student_name, student_mark, feedback), current_path in entries:
+        if _worker_cancel_event is not None and _worker_cancel_event.is_set():
+            break
+        if current_path:
+            results.append((FormResult(index, student_name, current_path, None, skipped=True), None))
+            continue
+        timings = {}
+        try:
+            if _worker_in_memory:
+                buffer = io.BytesIO()
+                write_form(_worker_template, buffer, student_name, student_mark, feedback, timings)
+                data = buffer.getvalue()
+                timings['bytes'] = len(data)
+                timings['peak_rss'] = peak_rss_bytes()
+                path = form_file_name(student_name, _worker_template.extension)
+                results.append((FormResult(index, student_name, path, None, timings=timings), data))
+                continue
+            path = create_feedback_form_in_docx(student_name, student_mark, feedback, None, _worker_output_format,
+                                                template=_worker_template, output_dir=_worker_output_dir,
+                                                timings=timings)
+            timings['peak_rss'] = peak_rss_bytes()
+            results.append((FormResult(index, student_name, path, None, timings=timings), None))
+        except Exception as e:
+            results.append((FormResult(index, student_name, None, str(e), timings=timings), None))
+    return key, results
+
+
+class _FormJob:
+    """
+    The forms of one mark sheet within a run: its settings, output directory, incremental manifest and results.
+
+    In PDF mode with a Word engine the job's forms are staged as .docx in a directory of their own and
+    converted in batches by the run's `_ConversionPipeline`.
+
+    Results are settled once they are final, i.e. after conversion for staged forms. In low-memory mode a
+    settled result is added to the run's report straight away and only failures are kept, so the job's
+    bookkeeping does not grow with the cohort; the incremental manifest is then read and written on disk.
+    """
+
+    # Results are settled by the converter threads as well as the collecting thread, possibly into one report
+    _settle_lock = threading.Lock()
+
+    def __init__(self, key, students, run_config, rubric, output_format, engine, output_dir=None,
+                 incremental=False, archive_prefix='', low_memory=False, archive_entry=None, student_index=None):
+        self.key = key
+        self.students = students
+        self.config = run_config
+        self.output_dir = output_dir
+        self.archive_prefix = archive_prefix
+        self.archive_entry = archive_entry
+        self.student_index = student_index
+        self.final_extension = '.pdf' if output_format == 'PDF' else FORM_ENGINES[engine].extension
+        self.low_memory = low_memory
+        self.results = []
+        self.manifest = None
+        self.fingerprints = {}
+        # The contents of the template, not just its path, decide the layout of every form
+        self.template_fingerprint = template_fingerprint(run_config['form_template'])
+        if incremental:
+            self.manifest = RunManifest(output_dir, low_memory)
+            form_config = {key: value for key, value in run_config.items() if key not in DELIVERY_SETTINGS}
+            self._run_fingerprint = run_fingerprint(form_config, rubric.fingerprint if rubric else None,
+                                                    self.final_extension, engine, self.template_fingerprint)
+        self.staging_dir = None
+        self.output_format = output_format
+        if output_format == 'PDF' and FORM_ENGINES[engine].extension == '.docx':
+            self.staging_dir = tempfile.mkdtemp(prefix='.feedback_staging_', dir=output_dir or '.')
+            self.output_format = 'Word'
+
+    def worker_settings(self):
+        return self.config, self.template_fingerprint, self.output_format, self.staging_dir or self.output_dir
+
+    def plan(self):
+        """Yield the index, the student and the path of its existing form when that form is still current."""
+        for position, student in enumerate(self.students):
+            index = self.student_index(position) if self.student_index else position
+            if self.manifest is None:
+                yield index, student, None
+                continue
+            form_path = form_file_name(student[0], self.final_extension, self.output_dir)
+            fingerprint = student_fingerprint(student, self._run_fingerprint)
+            self.fingerprints[index] = fingerprint
+            yield index, student, form_path if self.manifest.is_current(form_path, fingerprint) else None
+
+    def chunks(self, chunk_size):
+        chunk = []
+        for index, student, current_path in self.plan():
+            chunk.append((index, student, current_path))
+            if len(chunk) == chunk_size:
+                yield self.key, self.worker_settings(), chunk
+                chunk = []
+        if chunk:
+            yield self.key, self.worker_settings(), chunk
+
+    def settle(self, results, report):
+        """Record the final results of some of the job's students in the manifest and, in low-memory mode, report."""
+        with self._settle_lock:
+            for result in results:
+                if self.manifest is not None:
+                    fingerprint = self.fingerprints.pop(result.index)
+                    if not result.error:
+                        self.manifest.record(result.path, fingerprint)
+                if result.error or not self.low_memory:
+                    self.results.append(result)
+            if self.low_memory:
+                report.add_results(results)
+
+    def finish(self, report):
+        """
+        Save the manifest and return the settled results of the job, in student order.
+
+        Call this once the `_ConversionPipeline` of the run, if any, has been closed.
+        """
+        if self.staging_dir is not None:
+            shutil.rmtree(self.staging_dir, ignore_errors=True)
+        # Converted forms are settled by batch, possibly out of order
+        self.results.sort(key=lambda result: result.index)
+        if self.manifest is not None:
+            with report.stage('manifest'):
+                self.manifest.save()
+        return self.results
+
+
+def convert_staged_forms_to_pdf(results, staging_dir, output_dir=None, converter=None):
+    """
+    Convert every .docx in `staging_dir` to PDF in one converter session and move the PDFs to `output_dir`.
+
+    Starting the converter (Word on Windows and macOS) dominates the cost of `docx2pdf.convert` for a single
+    short form, so converting a whole directory at once pays that cost once per batch instead of once per
+    student. The staging directory is removed afterwards.
+
+    Args:
+        converter: Function converting a directory of .docx files into a directory of PDFs, called like
+            `docx2pdf.convert(input_dir, output_dir)`. Defaults to `docx2pdf.convert`.
+
+    Returns:
+        `results` with each path replaced by its PDF, or an error for forms the converter did not produce.
+    """
+    if converter is None:
+        # docx2pdf pulls in the Word automation bindings, so it is only imported once a conversion is needed
+        from docx2pdf import convert as converter
+    pdf_dir = os.path.join(staging_dir, 'pdf')
+    os.makedirs(pdf_dir)
+    try:
+        converter(staging_dir, pdf_dir)
+        converted = []
+        for result in results:
+            if result.error or result.skipped:
+                converted.append(result)
+                continue
+            pdf_name = os.path.basename(result.path).replace('.docx', '.pdf')
+            staged_pdf = os.path.join(pdf_dir, pdf_name)
+            if os.path.exists(staged_pdf):
+                pdf_file_name = os.path.join(output_dir, pdf_name) if output_dir else pdf_name
+                os.replace(staged_pdf, pdf_file_name)
+                print(f"Converted to PDF: {pdf_file_name}")
+                timings = dict(result.timings or {}, bytes=os.path.getsize(pdf_file_name))
+                converted.append(result._replace(path=pdf_file_name, timings=timings))
+            else:
+                converted.append(result._replace(path=None, error='PDF conversion failed'))
+        return converted
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+
+class _ConversionPipeline:
+    """
+    Converts staged .docx forms to PDF on converter threads while the forms after them are still being built.
+
+    Finished forms are grouped per job into batches of `batch_size`; each batch is moved into a directory of
+    its own and queued for `convert_staged_forms_to_pdf`, so the converter start-up cost is paid once per batch
+    rather than once per form, and building (CPU-bound) overlaps with converting (bound by Word) instead of
+    alternating with it. The queue holds at most `queue_size` batches, so when the converters fall behind
+    the builders wait instead of staging ever more files.
+
+    The time the builders spend waiting for room in the queue and the converters spend waiting for work is
+    reported as the 'build_stalled' and 'convert_stalled' stages, next to the converters' busy time as 'convert'.
+    """
+
+    def __init__(self, report, converters=1, batch_size=32, queue_size=2, cancel_event=None, converter=None):
+        self._report = report
+        self._batch_size = batch_size
+        self._cancel_event = cancel_event
+        self._converter = converter
+        self._queue = queue.Queue(maxsize=queue_size)
+        # Job key -> forms staged but not queued yet
+        self._pending = {}
+        self._batches = 0
+        self._lock = threading.Lock()
+        self._threads = [threading.Thread(target=self._convert_batches, daemon=True) for _ in range(converters)]
+        for thread in self._threads:
+            thread.start()
+
+    def add(self, job, result):
+        """Hand over one student's staged form of a job with a staging directory; blocks while the queue is full."""
+        pending = self._pending.setdefault(job.key, [])
+        pending.append(result)
+        if len(pending) >= self._batch_size:
+            self._queue_batch(job)
+
+    def _queue_batch(self, job):
+        results = self._pending.pop(job.key, None)
+        if not results:
+            return
+        self._batches += 1
+        batch_dir = os.path.join(job.staging_dir, f'batch{self._batches}')
+        os.makedirs(batch_dir)
+        for result in results:
+            # A student listed twice in the batch shares one staged file, which has been moved already
+            if os.path.exists(result.path):
+                os.replace(result.path, os.path.join(batch_dir, os.path.basename(result.path)))
+        start = time.perf_counter()
+        self._queue.put((job, batch_dir, results))
+        self._add_time('build_stalled', time.perf_counter() - start)
+
+    def _add_time(self, stage, seconds):
+        with self._lock:
+            self._report.add_stage(stage, seconds)
+
+    def _convert_batches(self):
+        # docx2pdf drives Word through COM on Windows, which has to be initialised on every thread using it
+        try:
+            import pythoncom
+        except ImportError:
+            pythoncom = None
+        if pythoncom is not None:
+            pythoncom.CoInitialize()
+        try:
+            while True:
+                start = time.perf_counter()
+                item = self._queue.get()
+                self._add_time('convert_stalled', time.perf_counter() - start)
+                if item is None:
+                    return
+                job, batch_dir, results = item
+                if self._cancel_event is not None and self._cancel_event.is_set():
+                    shutil.rmtree(batch_dir, ignore_errors=True)
+                    self._cancel(job, results)
+                    continue
+                start = time.perf_counter()
+                try:
+                    converted = convert_staged_forms_to_pdf(results, batch_dir, job.output_dir, self._converter)
+                except Exception as e:
+                    converted = [result._replace(path=None, error=f'PDF conversion failed: {e}') for result in results]
+                self._add_time('convert', time.perf_counter() - start)
+                job.settle(converted, self._report)
+        finally:
+            if pythoncom is not None:
+                pythoncom.CoUninitialize()
+
+    def _cancel(self, job, results):
+        job.settle([result._replace(path=None, error='Cancelled before PDF conversion') for result in results],
+                   self._report)
+
+    def close(self, jobs):
+        """Queue the forms left over from every job, unless cancelled, and wait for the converters to finish."""
+        cancelled = self._cancel_event is not None and self._cancel_event.is_set()
+        for job in jobs:
+            if cancelled:
+                self._cancel(job, self._pending.pop(job.key, []))
+            else:
+                self._queue_batch(job)
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+
+def _generate_jobs(jobs, rubric, engine, workers, chunk_size, on_result, cancel_event, on_stage, archive_path,
+                   report, pool=None, converters=1):
+    # Runs the chunks of every job through one pool, so workers stay busy across sheet boundaries
+    initargs = (rubric, engine, cancel_event, bool(archive_path))
+    jobs_by_key = {job.key: job for job in jobs}
+    pipeline = None
+    if any(job.staging_dir for job in jobs):
+        pipeline = _ConversionPipeline(report, converters, cancel_event=cancel_event)
+    archive = None
+    archive_names = set()
+    if archive_path:
+        # The forms are compressed already, so they are stored rather than deflated a second time
+        archive = zipfile.ZipFile(archive_path, 'w', zipfile.ZIP_STORED, allowZip64=True)
+
+    def collect(chunk_results):
+        key, chunk_results = chunk_results
+        job = jobs_by_key[key]
+        for result, data in chunk_results:
+            if archive is not None and data is not None:
+                # Students with the same name would overwrite each other on disk; keep both in the archive
+                entry = job.archive_entry(result) if job.archive_entry else job.archive_prefix + result.path
+                name, extension = os.path.splitext(entry)
+                entry, copy_number = name + extension, 1
+                while entry in archive_names:
+                    copy_number += 1
+                    entry = f'{name} ({copy_number}){extension}'
+                archive_names.add(entry)
+                archive.writestr(entry, data)
+                result = result._replace(path=entry)
+            if pipeline is not None and not (result.error or result.skipped):
+                pipeline.add(job, result)
+            else:
+                job.settle([result], report)
+            if on_result:
+                on_result(result)
+
+    chunks = (chunk for job in jobs for chunk in job.chunks(chunk_size))
+    generate_start = time.perf_counter()
+    try:
+        if pool is None and workers <= 1:
+            # The in-process worker switches `config` between jobs, so the caller's settings are put back after
+            caller_config = copy.deepcopy(config)
+            try:
+                _init_worker(*initargs)
+                for chunk in chunks:
+                    collect(_generate_chunk(chunk))
+                    if cancel_event is not None and cancel_event.is_set():
+                        break
+            finally:
+                config.clear()
+                config.update(caller_config)
+        else:
+            if pool is None:
+                pool_context = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs)
+            else:
+                pool_context = nullcontext(pool)
+            with pool_context as pool:
+                # Keep a bounded number of chunks in flight so large cohorts are not queued up all at once; in
+                # archive mode this also bounds the number of rendered forms held in memory
+                pending = []
+                for chunk in chunks:
+                    if cancel_event is not None and cancel_event.is_set():
+                        break
+                    pending.append(pool.submit(_generate_chunk, chunk))
+                    if len(pending) >= workers * 2:
+                        collect(pending.pop(0).result())
+                for future in pending:
+                    collect(future.result())
+    finally:
+        if archive is not None:
+            archive.close()
+            print(f"Saved: {archive_path}")
+        report.add_stage('generate', time.perf_counter() - generate_start)
+        if pipeline is not None:
+            if on_stage:
+                on_stage("Finishing the PDF conversion")
+            pipeline.close(jobs)
+
+    results = []
+    for job in jobs:
+        results.extend(job.finish(report))
+    return results
+
+
+def generate_feedback_forms(students, rubric_path=None, output_format='Word', engine='python-docx', workers=1,
+                            chunk_size=16, on_result=None, cancel_event=None, on_stage=None, output_dir=None,
+                            incremental=False, archive_path=None, report=None, pool=None, converters=1,
+                            low_memory=False, archive_entry=None, student_index=None):
+    """
+    Generate a feedback form for every student, optionally spread over a pool of worker processes.
+
+    The rubric is loaded once through the on-disk cache of `load_rubric`. Each worker gets a frozen copy of
+    `config` taken when the run starts, plus the rubric fragment, and builds its own form engine once. A
+    failure for one student does not stop the run; it is reported in that student's result instead.
+
+    Args:
+        students: Iterable of (student_name, student_mark, feedback) tuples, such as the `StudentRecord`s
+            streamed by `student_reader.iter_students`. It is consumed lazily.
+        rubric_path: Optional .docx file whose last table is appended to every form.
+        output_format: 'Word' or 'PDF'.
+        engine: Name of the form engine in `FORM_ENGINES`. 'ReportLab PDF' always writes PDF directly.
+        workers: Number of processes to use; 1 generates everything in the calling process.
+        chunk_size: Number of students sent to a worker at a time.
+        on_result: Optional callable invoked in the calling process with each `FormResult`, in order.
+        cancel_event: Optional `multiprocessing.Event`. Once it is set every worker stops after the form
+            it is currently writing and no further students are started.
+        on_stage: Optional callable invoked with a short description when the run enters a new stage.
+        output_dir: Directory the forms are written to; the current directory when not given.
+        incremental: Skip students whose form already exists and whose inputs (row values, settings,
+            rubric, output format and engine) hash to the value in the `RunManifest` of `output_dir`.
+            Skipped forms keep the date they were generated on.
+        archive_path: Write every form into this single ZIP archive instead of separate files. Each form is
+            rendered into memory and streamed into the archive as soon as it is done, in student order, so
+            nothing but the archive touches the disk; a result's `path` is then its name inside the archive.
+            Word engines can only produce .docx archives, and `incremental` does not apply.
+        archive_entry: Optional callable returning the name inside the archive of a form from its
+            `FormResult`, called in the calling process before `on_result`; the form's file name by default.
+        student_index: Optional callable returning the `index` of a student's result from its position in
+            `students`, called as each student is read; e.g. its position in a mark sheet some of whose
+            students are left out. The position by default.
+        report: Optional `RunReport` that receives the wall time of the 'rubric', 'read', 'generate',
+            'convert' and 'manifest' stages.
+        pool: Optional pool from `start_worker_pool` to run on instead of starting one; `workers` should
+            match its size. `cancel_event` and `archive_path` are not supported with it.
+        converters: Number of threads converting staged forms to PDF. Word serialises conversions, so more
+            than one only helps with converters that run side by side.
+        low_memory: Keep memory use flat however many students there are: each result is added to `report`
+            as soon as it is final instead of being collected, and only failed results are returned.
+
+    In PDF mode every form is first written as .docx to a staging directory and converted in batches by
+    `converters` background threads while later forms are still being built (see `_ConversionPipeline`);
+    the results passed to `on_result` refer to the staged .docx files, while the returned results refer to
+    the PDFs.
+
+    Returns:
+        A list of `FormResult`, in the same order as `students`. After a cancellation it only covers the
+        students that were processed. In low-memory mode it only holds the failed students.
+    """
+    _check_archive_format(archive_path, output_format, engine)
+    if report is None:
+        report = RunReport()
+    with report.stage('rubric'):
+        rubric = load_rubric(rubric_path) if rubric_path else None
+    job = _FormJob(0, report.timed_iter('read', students), copy.deepcopy(config), rubric, output_format, engine,
+                   output_dir, incremental and not archive_path, low_memory=low_memory, archive_entry=archive_entry,
+                   student_index=student_index)
+    return _generate_jobs([job], rubric, engine, workers, chunk_size, on_result, cancel_event, on_stage,
+                          archive_path, report, pool, converters)
+
+
+def _check_archive_format(archive_path, output_format, engine):
+    if archive_path and output_format == 'PDF' and FORM_ENGINES[engine].extension == '.docx':
+        raise ValueError("PDF archives are written without intermediate files, so they need the 'ReportLab PDF' "
+                         "engine")
+
+
+def _reader_backend(low_memory):
+    # calamine loads a whole sheet at once, while openpyxl's read-only mode parses it row by row
+    return 'openpyxl' if low_memory else 'auto'
+
+
+def sheet_output_dir(mark_sheet, output_dir=None):
+    """Directory a batch run writes the forms of a `MarkSheet` to: its name below `output_dir`."""
+    return os.path.join(output_dir or '.', *mark_sheet.name.split('/'))
+
+
+def sheet_config(mark_sheet, base=None):
+    """Return a copy of `base` (by default `config`) with the settings of a `MarkSheet` applied."""
+    settings = copy.deepcopy(config if base is None else base)
+    merge_settings(settings, mark_sheet.settings)
+    return settings
+
+
+def generate_batch_feedback(mark_sheets, rubric_path=None, output_format='Word', engine='python-docx', workers=1,
+                            chunk_size=16, on_result=None, cancel_event=None, on_stage=None, output_dir=None,
+                            incremental=False, archive_path=None, report=None, pool=None, converters=1,
+                            low_memory=False, statistics=None):
+    """
+    Generate the forms of several mark sheets, such as every sheet of every workbook in a department folder.
+
+    Every sheet becomes a job with its own settings (`config` with the sheet's `MarkSheet.settings` applied),
+    output directory (`sheet_output_dir`) and incremental manifest, but the students of all sheets go through
+    one shared pool of workers, so cores stay busy across module boundaries instead of draining at the end of
+    each sheet. In archive mode each sheet's forms go into a folder of the archive named like the sheet.
+
+    Args:
+        mark_sheets: Iterable of `student_reader.MarkSheet`, as found by `student_reader.find_mark_sheets`.
+        statistics: Optional list that receives a `CohortStatistics` for every sheet, filled in as the
+            sheet's rows are read.
+
+    The other arguments match `generate_feedback_forms`.
+
+    Returns:
+        A list of `FormResult`, sheet by sheet in the order of `mark_sheets`; `index` counts within a sheet.
+        In low-memory mode it only holds the failed students.
+    """
+    _check_archive_format(archive_path, output_format, engine)
+    if report is None:
+        report = RunReport()
+    with report.stage('rubric'):
+        rubric = load_rubric(rubric_path) if rubric_path else None
+    jobs = []
+    for key, mark_sheet in enumerate(mark_sheets):
+        job_dir = sheet_output_dir(mark_sheet, output_dir)
+        if not archive_path:
+            os.makedirs(job_dir, exist_ok=True)
+        settings = sheet_config(mark_sheet)
+        sheet_statistics = None
+        if statistics is not None:
+            sheet_statistics = CohortStatistics(mark_sheet.name, settings)
+            statistics.append(sheet_statistics)
+        students = report.timed_iter('read', iter_students(mark_sheet.workbook, _reader_backend(low_memory),
+                                                           mark_sheet.sheet, settings['marking'], sheet_statistics))
+        jobs.append(_FormJob(key, students, settings, rubric, output_format, engine, job_dir,
+                             incremental and not archive_path, archive_prefix=f'{mark_sheet.name}/',
+                             low_memory=low_memory))
+    return _generate_jobs(jobs, rubric, engine, workers, chunk_size, on_result, cancel_event, on_stage,
+                          archive_path, report, pool, converters)
+
+
+def combined_file_name(extension, output_dir=None):
+    file_name = f"Assignment_Feedback_Forms_{config['module_code']}{extension}"
+    return os.path.join(output_dir, file_name) if output_dir else file_name
+
+
+def generate_combined_feedback(students, rubric_path=None, output_format='Word', engine='python-docx',
+                               on_result=None, cancel_event=None, on_stage=None, output_dir=None, report=None,
+                               low_memory=False):
+    """
+    Write the forms of every student into one document, each starting on a new page with its own bookmark.
+
+    The document is saved once at the end and, for PDF output from a Word engine, converted once. Bookmarks
+    are named after the student (e.g. 'S12_Smith__Jo') so a printer or external examiner can jump to a form;
+    ReportLab PDFs also list every student in the PDF outline.
+
+    Arguments match `generate_feedback_forms`. Every successful result points at the combined file and
+    times adding its form as 'build'; `report` receives the 'rubric', 'read', 'save' and 'convert' stages.
+
+    The python-docx engine keeps the whole document tree in memory until it is saved, so in low-memory mode
+    Word documents are streamed by the Direct XML engine instead, which produces the same layout. ReportLab
+    holds every page until the PDF is written and cannot be used in low-memory mode.
+
+    Returns:
+        A list of `FormResult`, in the same order as `students`; in low-memory mode only the failed ones.
+    """
+    if low_memory:
+        if FORM_ENGINES[engine].extension != '.docx':
+            raise ValueError(f"The '{engine}' engine keeps a combined document in memory until it is saved; use "
+                             f"a Word engine, or one file per student, in low-memory mode")
+        engine = 'Direct XML'
+    if report is None:
+        report = RunReport()
+    with report.stage('rubric'):
+        rubric = load_rubric(rubric_path) if rubric_path else None
+        template = form_engine(engine, rubric)
+    file_name = combined_file_name(template.extension, output_dir)
+    title = f"Assignment Feedback Forms - {config['module_code']} {config['assignment_title']}"
+    combined = template.open_combined(file_name, title)
+    results = []
+    for index, (student_name, student_mark, feedback) in enumerate(report.timed_iter('read', students)):
+        if cancel_event is not None and cancel_event.is_set():
+            break
+        start = time.perf_counter()
+        try:
+            combined.add(index, student_name, student_mark, feedback if feedback else ' ')
+            result = FormResult(index, student_name, file_name, None,
+                                timings={'build': time.perf_counter() - start})
+        except Exception as e:
+            result = FormResult(index, student_name, None, str(e))
+        if low_memory:
+            report.add_results([result])
+        if result.error or not low_memory:
+            results.append(result)
+        if on_result:
+            on_result(result)
+
+    if on_stage:
+        on_stage(f"Saving {file_name}")
+    with report.stage('save'):
+        # Forms are only laid out here with ReportLab, so some may fail now; the others are still written
+        failures = combined.close() or {}
+    print(f"Saved: {file_name}")
+    if failures:
+        results = [result._replace(path=None, error=failures[result.index]) if result.index in failures else result
+                   for result in results]
+    if output_format == 'PDF' and template.extension == '.docx':
+        from docx2pdf import convert
+        if on_stage:
+            on_stage("Converting the combined document to PDF")
+        pdf_file_name = file_name.replace('.docx', '.pdf')
+        with report.stage('convert'):
+            convert(file_name, pdf_file_name)
+        os.remove(file_name)
+        file_name = pdf_file_name
+        print(f"Converted to PDF: {pdf_file_name}")
+        results = [result if result.error else result._replace(path=pdf_file_name) for result in results]
+    report.bytes_written += os.path.getsize(file_name)
+    return results
+
+
+def archive_file_name(output_dir=None, label=None):
+    file_name = f"Assignment_Feedback_Forms_{label or config['module_code']}.zip"
+    return os.path.join(output_dir, file_name) if output_dir else file_name
+
+
+class _PackageMarks:
+    # Receives the marks of every block of rows read by `iter_students`, in row order, for the grading
+    # worksheet; they are taken off as the students are matched, so only a block is held at a time
+    def __init__(self, statistics=None):
+        self.marks = deque()
+        self.statistics = statistics
+
+    def add(self, marks, grades):
+        self.marks.extend(marks.tolist())
+        if self.statistics is not None:
+            self.statistics.add(marks, grades)
+
+
+def generate_lms_package(excel_path, worksheet_path, rubric_path=None, output_format='Word', engine='python-docx',
+                         workers=1, output_dir=None, on_result=None, cancel_event=None, report=None, low_memory=False,
+                         statistics=None, **kwargs):
+    """
+    Generate the forms of a mark sheet into a VLE's bulk feedback upload package and update its grading worksheet.
+
+    Every student is joined to a participant of the grading worksheet downloaded from the VLE assignment
+    (see `lms_export.GradingWorksheet`). Each form is rendered in memory and streamed into its participant's
+    folder of the package as soon as it is done, as with `archive_path` of `generate_feedback_forms`, so no
+    form is written to disk and renamed. As a form is stored, its participant's grade and feedback comments
+    are filled in, and the updated worksheet is written next to the package unless the run is cancelled.
+
+    Args:
+        excel_path: The mark sheet, with the `sheet_key` column of `config['lms']`.
+        worksheet_path: The grading worksheet CSV.
+        statistics: Optional `CohortStatistics` that receives every student's mark as the rows are read.
+
+    The other arguments match `generate_feedback_forms`; `incremental` does not apply. Word engines write
+    .docx forms, as PDF output from them needs intermediate files.
+
+    Raises:
+        ValueError: If a column the 'lms' settings name is missing from the mark sheet or the worksheet.
+
+    Returns:
+        A list of `FormResult`, one per student in mark sheet order and with their position in the sheet as
+        `index`; students that could not be matched to a participant get a failed result. In low-memory mode
+        it only holds the failed students.
+    """
+    settings = config['lms']
+    worksheet = GradingWorksheet(worksheet_path, settings)
+    package_path = lms_package_name(output_dir, config['module_code'])
+    _check_archive_format(package_path, output_format, engine)
+    package_marks = _PackageMarks(statistics)
+    # The key of each student comes from the same rows as the student, so the two cannot drift apart
+    students = iter_students(excel_path, _reader_backend(low_memory), statistics=package_marks,
+                             column=settings['sheet_key'])
+    # Reading the first student reads the header, so a missing key column is reported before the package starts
+    students = chain(list(islice(students, 1)), students)
+    if report is None:
+        report = RunReport()
+    decimals = config['marking']['decimals'] if config['marking']['rounding'] else None
+    unmatched = []
+    # Position in the sheet of each matched student, by position among the matched ones, until it is read
+    positions = {}
+    # Position in the sheet of a matched student -> (worksheet row, mark, feedback) until its form is stored
+    participants = {}
+
+    def matched_students():
+        matched = 0
+        for position, (student, key) in enumerate(students):
+            mark = package_marks.marks.popleft()
+            try:
+                number = worksheet.match(key)
+            except ValueError as e:
+                result = FormResult(position, student.name, None, str(e))
+                if low_memory:
+                    report.add_results([result])
+                unmatched.append(result)
+                if on_result:
+                    on_result(result)
+                continue
+            positions[matched] = position
+            participants[position] = (number, mark, student.feedback)
+            matched += 1
+            yield student
+
+    def archive_entry(result):
+        return f'{worksheet.folder_name(participants[result.index][0])}/{result.path}'
+
+    def store(result):
+        number, mark, feedback = participants.pop(result.index)
+        if not result.error:
+            worksheet.set_mark(number, mark, feedback, decimals)
+        if on_result:
+            on_result(result)
+
+    results = generate_feedback_forms(matched_students(), rubric_path=rubric_path, output_format=output_format,
+                                      engine=engine, workers=workers, output_dir=output_dir, on_result=store,
+                                      cancel_event=cancel_event, report=report, low_memory=low_memory,
+                                      archive_path=package_path, archive_entry=archive_entry,
+                                      student_index=positions.pop, **kwargs)
+    if cancel_event is None or not cancel_event.is_set():
+        worksheet_name = worksheet.updated_name(output_dir)
+        with report.stage('worksheet'):
+            worksheet.save(worksheet_name)
+        print(f"Saved: {worksheet_name}")
+    return sorted(results + unmatched, key=lambda result: result.index)
+
+
+def run_generation(excel_path, output_dir=None, output_format='Word', engine='python-docx', workers=1,
+                   rubric_path=None, on_start=None, layout='files', on_report=None, all_sheets=False, low_memory=False,
+                   statistics_formats=STATISTICS_FORMATS, grading_worksheet=None, **kwargs):
+    """
+    Generate the forms for every student in the mark sheet `excel_path`.
+
+    This is the entry point shared by the GUI and the command line: it streams the sheet, creates
+    `output_dir` if needed and hands the students to `generate_feedback_forms`, which also receives any
+    extra keyword arguments (`on_result`, `cancel_event`, `on_stage`, `chunk_size`, `incremental`,
+    `converters`).
+
+    When `all_sheets` is set or `excel_path` is a directory, every sheet of the workbook, or of every
+    workbook under the directory, is processed in one batch by `generate_batch_feedback`; each sheet's forms
+    go to their own folder below `output_dir` (see `student_reader.find_mark_sheets` for per-sheet settings).
+    Otherwise the first sheet is processed, with the settings of its header area and the workbook's sidecar
+    applied to `config` for the run.
+
+    Args:
+        on_start: Optional callable invoked with the number of students the sheet declares (or None if
+            unknown) before generation starts.
+        layout: 'files' for one file per student, 'combined' for one document holding every form (see
+            `generate_combined_feedback`; `workers` and `incremental` do not apply), 'archive' for one ZIP
+            archive of per-student forms (see `archive_path` of `generate_feedback_forms`) or 'lms' for a
+            VLE's bulk feedback upload package of a single sheet (see `generate_lms_package`).
+        on_report: Optional callable invoked with the `RunReport` of the run once it has been saved to
+            `output_dir` as `run_report.REPORT_NAME`.
+        low_memory: Keep peak memory flat however many students the sheets hold, for memory-limited machines:
+            rows are streamed with openpyxl, results are counted in the report rather than collected (which
+            then lists failed students only), and combined Word documents are streamed to disk. Combined
+            ReportLab PDFs are refused. ZIP archives still keep one directory entry per form.
+        statistics_formats: Formats of the cohort statistics (see `cohort_statistics.write_statistics`)
+            written to `output_dir`, with one row per sheet. They are gathered while the rows are read for
+            the forms, and not written when the run is cancelled.
+        grading_worksheet: The grading worksheet CSV downloaded from the VLE, for the 'lms' layout.
+
+    Returns:
+        A list of `FormResult`, one per student; in low-memory mode only the failed students.
+    """
+    report = RunReport(keep_students=not low_memory, excel_path=excel_path, output_format=output_format,
+                       engine=engine, workers=workers, rubric_path=rubric_path, layout=layout, low_memory=low_memory)
+    backend = _reader_backend(low_memory)
+    statistics = []
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    mark_sheets = None
+    if all_sheets or os.path.isdir(excel_path):
+        with report.stage('count'):
+            mark_sheets = list(find_mark_sheets(excel_path))
+    if layout == 'lms':
+        if mark_sheets is not None:
+            raise ValueError("An LMS upload package holds the feedback of one assignment, so it is made from one "
+                             "sheet rather than a folder or every sheet of a workbook")
+        if not grading_worksheet:
+            raise ValueError("An LMS upload package needs the grading worksheet downloaded from the assignment")
+    caller_config = copy.deepcopy(config)
+    if mark_sheets is None:
+        # A single sheet takes the settings of its header area and sidecar too, as it would in a batch
+        with report.stage('count'):
+            mark_sheet = next(find_mark_sheets(excel_path), None)
+        if mark_sheet is not None:
+            settings = sheet_config(mark_sheet, caller_config)
+            config.clear()
+            config.update(settings)
+    try:
+        if on_start:
+            with report.stage('count'):
+                if mark_sheets is None:
+                    total = estimate_student_count(excel_path)
+                else:
+                    total = sum(estimate_student_count(mark_sheet.workbook, mark_sheet.sheet) or 0
+                                for mark_sheet in mark_sheets)
+            on_start(total)
+        if mark_sheets is not None and layout == 'combined':
+            kwargs.pop('incremental', None)
+            kwargs.pop('chunk_size', None)
+            kwargs.pop('converters', None)
+            results = []
+            # One combined document per sheet, each built with that sheet's settings; the caller's are put back after
+            for mark_sheet in mark_sheets:
+                if kwargs.get('cancel_event') is not None and kwargs['cancel_event'].is_set():
+                    break
+                settings = sheet_config(mark_sheet, caller_config)
+                config.clear()
+                config.update(settings)
+                sheet_dir = sheet_output_dir(mark_sheet, output_dir)
+                os.makedirs(sheet_dir, exist_ok=True)
+                statistics.append(CohortStatistics(mark_sheet.name, settings))
+                results.extend(generate_combined_feedback(
+                    iter_students(mark_sheet.workbook, backend, mark_sheet.sheet, statistics=statistics[-1]),
+                    rubric_path=rubric_path, output_format=output_format, engine=engine, output_dir=sheet_dir,
+                    report=report, low_memory=low_memory, **kwargs))
+        elif mark_sheets is not None:
+            if layout == 'archive':
+                label = os.path.splitext(os.path.basename(os.path.normpath(excel_path)))[0]
+                kwargs['archive_path'] = archive_file_name(output_dir, label)
+            results = generate_batch_feedback(mark_sheets, rubric_path=rubric_path, output_format=output_format,
+                                              engine=engine, workers=workers, output_dir=output_dir, report=report,
+                                              low_memory=low_memory, statistics=statistics, **kwargs)
+        elif layout == 'combined':
+            kwargs.pop('incremental', None)
+            kwargs.pop('chunk_size', None)
+            kwargs.pop('converters', None)
+            statistics.append(CohortStatistics(os.path.splitext(os.path.basename(excel_path))[0], config))
+            results = generate_combined_feedback(iter_students(excel_path, backend, statistics=statistics[-1]),
+                                                 rubric_path=rubric_path, output_format=output_format, engine=engine,
+                                                 output_dir=output_dir, report=report, low_memory=low_memory, **kwargs)
+        elif layout == 'lms':
+            statistics.append(CohortStatistics(os.path.splitext(os.path.basename(excel_path))[0], config))
+            results = generate_lms_package(excel_path, grading_worksheet, rubric_path=rubric_path,
+                                           output_format=output_format, engine=engine, workers=workers,
+                                           output_dir=output_dir, report=report, low_memory=low_memory,
+                                           statistics=statistics[-1], **kwargs)
+        else:
+            if layout == 'archive':
+                kwargs['archive_path'] = archive_file_name(output_dir)
+            statistics.append(CohortStatistics(os.path.splitext(os.path.basename(excel_path))[0], config))
+            results = generate_feedback_forms(iter_students(excel_path, backend, statistics=statistics[-1]),
+                                              rubric_path=rubric_path, output_format=output_format, engine=engine,
+                                              workers=workers, output_dir=output_dir, report=report,
+                                              low_memory=low_memory, **kwargs)
+        if not low_memory:
+            # In low-memory mode the results were added as they were settled
+            report.add_results(results)
+        cancel_event = kwargs.get('cancel_event')
+        if statistics_formats and (cancel_event is None or not cancel_event.is_set()):
+            with report.stage('statistics'):
+                write_statistics(statistics, output_dir, statistics_formats)
+        report.finish()
+        report.save(output_dir)
+        if on_report:
+            on_report(report)
+        return results
+    finally:
+        config.clear()
+        config.update(caller_config)
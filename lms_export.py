@@ -0,0 +1,127 @@
+"""Grading worksheet of a Moodle-style VLE assignment, joined to the mark sheet for a bulk feedback upload."""
+import csv
+import math
+import os
+import re
+
+from mark_aggregation import format_mark
+
+# Characters that cannot appear in a folder name of the upload package
+_UNSAFE_CHARACTERS = re.compile(r'[\\/:*?"<>|\x00-\x1f]')
+
+
+def _normalise(value):
+    # Identifiers are compared without case and surrounding spaces; numbers read as 1234.0 match '1234'
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return '' if value is None else str(value).strip().lower()
+
+
+def lms_package_name(output_dir=None, label=None):
+    file_name = f"Feedback_Upload_{label}.zip"
+    return os.path.join(output_dir, file_name) if output_dir else file_name
+
+
+class GradingWorksheet:
+    """
+    The grading worksheet downloaded from a VLE assignment, as CSV, matched to the students of a mark sheet.
+
+    Each row is one participant, keyed by its `identifier_column` ('Participant 1234567'). Students are
+    matched to rows by the `sheet_key` column of the mark sheet and the `worksheet_key` column of the
+    worksheet (email addresses by default), in any case. `folder_name` gives the folder of the upload
+    package that holds a participant's feedback, and `set_mark` fills in the grade, and the feedback
+    comments if the worksheet has that column, of the worksheet written by `save`. Rows of participants
+    that are not in the mark sheet are written back as they were.
+
+    Args:
+        path: The worksheet as downloaded, a UTF-8 CSV file.
+        settings: The 'lms' settings, see `feedback_config.config`.
+
+    Raises:
+        ValueError: If a column named in the settings is missing from the worksheet.
+    """
+
+    def __init__(self, path, settings):
+        self.path = path
+        self.settings = settings
+        with open(path, 'rb') as fh:
+            # Written back the same way, as some VLEs expect the byte order mark they exported
+            self._bom = fh.read(3) == b'\xef\xbb\xbf'
+        with open(path, encoding='utf-8-sig', newline='') as fh:
+            rows = list(csv.reader(fh))
+        if not rows:
+            raise ValueError(f"The grading worksheet {os.path.basename(path)} is empty")
+        self.header, self.rows = rows[0], [row + [''] * (len(rows[0]) - len(row)) for row in rows[1:] if row]
+        self._identifier = self._column(settings['identifier_column'])
+        self._name = self._column(settings['name_column'])
+        self._key = self._column(settings['worksheet_key'])
+        self._grade = self._column(settings['grade_column'])
+        self._comments = None
+        if settings['comments_column'] and _normalise(settings['comments_column']) in map(_normalise, self.header):
+            self._comments = self._column(settings['comments_column'])
+        # Key -> row number, or None for keys held by several participants
+        self._rows_by_key = {}
+        for number, row in enumerate(self.rows):
+            key = _normalise(row[self._key])
+            if key:
+                self._rows_by_key[key] = None if key in self._rows_by_key else number
+        self._matched = set()
+
+    def _column(self, name):
+        names = [_normalise(cell) for cell in self.header]
+        if _normalise(name) not in names:
+            raise ValueError(f"The grading worksheet {os.path.basename(self.path)} has no '{name}' column")
+        return names.index(_normalise(name))
+
+    def match(self, key):
+        """
+        Return the row number of the participant whose `worksheet_key` is `key`.
+
+        Raises:
+            ValueError: With the reason, if no participant or several have that key, or another student of the
+                mark sheet was matched to the participant already.
+        """
+        column = self.settings['worksheet_key']
+        if key is None:
+            raise ValueError(f"No '{self.settings['sheet_key']}' to find the student in the grading worksheet by")
+        number = self._rows_by_key.get(_normalise(key), -1)
+        if number == -1:
+            raise ValueError(f"No participant with {column} '{key}' in the grading worksheet")
+        if number is None:
+            raise ValueError(f"Several participants have {column} '{key}' in the grading worksheet")
+        if number in self._matched:
+            raise ValueError(f"Another student of the mark sheet has {column} '{key}'")
+        self._matched.add(number)
+        return number
+
+    def folder_name(self, number):
+        """Return the folder of the upload package for the participant on row `number`."""
+        row = self.rows[number]
+        identifier = row[self._identifier]
+        # 'Participant 1234567' -> '1234567'
+        participant = re.sub(r'\D', '', identifier) or identifier
+        # The VLE splits folder names at underscores, so none may come from the name
+        full_name = _UNSAFE_CHARACTERS.sub('', row[self._name].replace('_', ' ')).strip()
+        return self.settings['folder_name'].format(full_name=full_name, participant=participant,
+                                                   identifier=_UNSAFE_CHARACTERS.sub('', identifier))
+
+    def set_mark(self, number, mark, feedback=None, decimals=None):
+        """
+        Fill in the grade of a participant from their mark, unless it is NaN, and the feedback comments.
+
+        The grade is written like the mark on the form: with `decimals` places, or as entered when None.
+        """
+        if not math.isnan(mark):
+            self.rows[number][self._grade] = format_mark(mark, decimals)
+        if self._comments is not None and feedback:
+            self.rows[number][self._comments] = str(feedback)
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8-sig' if self._bom else 'utf-8', newline='') as fh:
+            writer = csv.writer(fh)
+            writer.writerow(self.header)
+            writer.writerows(self.rows)
+
+    def updated_name(self, output_dir=None):
+        file_name = f"{os.path.splitext(os.path.basename(self.path))[0]}_updated.csv"
+        return os.path.join(output_dir, file_name) if output_dir else file_name
@@ -0,0 +1,168 @@
+"""Vectorised mark aggregation: weighted criterion totals, late penalties, caps, rounding and grade bands."""
+from itertools import islice
+
+import numpy as np
+
+# Ways of rounding a total to `decimals` places, as accepted by the 'rounding' setting of `config['marking']`
+ROUNDING_POLICIES = {
+    'half_up': lambda values: np.floor(values + 0.5),
+    'half_even': np.rint,
+    'down': np.floor,
+    'up': np.ceil,
+}
+
+
+def _numbers(values):
+    # Numeric cells as floats and everything else (text such as 'Absent', empty cells) as NaN
+    return np.array([value if isinstance(value, (int, float)) and not isinstance(value, bool) else np.nan
+                     for value in values], dtype=float)
+
+
+def format_marks(marks, decimals=None):
+    """
+    Return the text of each mark of a float array: with `decimals` places, or, when that is None, as entered
+    but without trailing zeros, so 65.0 is '65' and 71.5 stays '71.5'.
+    """
+    if decimals is not None:
+        return np.char.mod(f'%.{decimals}f', marks)
+    # Six places are plenty for a mark and drop binary noise such as 64.49999999999999
+    return np.char.rstrip(np.char.rstrip(np.char.mod('%.6f', marks), '0'), '.')
+
+
+def format_mark(mark, decimals=None):
+    """Return the text of one mark, see `format_marks`."""
+    return str(format_marks(np.array([mark], dtype=float), decimals)[0])
+
+
+def _column_index(header, name):
+    names = [str(cell).strip().lower() if cell is not None else '' for cell in header]
+    try:
+        return names.index(name.strip().lower())
+    except ValueError:
+        return None
+
+
+class MarkScheme:
+    """
+    How each student's mark is worked out from their row, compiled from `config['marking']` and a sheet's header.
+
+    With criteria, the mark is the weighted average of the criterion columns, each scaled to a percentage of
+    its `out_of`; the mark column is ignored, except for students missing a criterion score, who keep it as
+    it is (e.g. 'Non-submission', or a number written like the other marks). Without criteria the mark column
+    is used. Numeric marks then lose `late_penalty` points per day in the late column (if the sheet has one),
+    are capped at `cap` and floored at 0. They are kept as they are unless a `rounding` policy is set, which
+    rounds them to `decimals` places. Grade bands are looked up from the final mark, and the mark shown on
+    the form is `mark_format` filled with `mark` and `grade`.
+
+    Args:
+        marking: The 'marking' settings, see `feedback_config.config`.
+        header: The column header row of the sheet, used to find the criterion and late columns.
+
+    Raises:
+        ValueError: If a criterion column is missing from the header or a setting is invalid.
+    """
+
+    def __init__(self, marking, header):
+        header = tuple(header or ())
+        self.criteria = list(marking['criteria'])
+        self.columns = []
+        for name in self.criteria:
+            column = _column_index(header, name)
+            if column is None:
+                raise ValueError(f"The mark sheet has no '{name}' column for the criterion of that name")
+            self.columns.append(column)
+        out_of = marking['out_of']
+        self._out_of = np.array([out_of[name] if isinstance(out_of, dict) else out_of for name in self.criteria],
+                                dtype=float)
+        weights = np.array([marking['criteria'][name] for name in self.criteria], dtype=float)
+        if self.criteria and weights.sum() <= 0:
+            raise ValueError("The criterion weights must add up to more than 0")
+        self._weights = weights / weights.sum() if self.criteria else weights
+        self._late_column = _column_index(header, marking['late_column']) if marking['late_penalty'] else None
+        self._late_penalty = float(marking['late_penalty'] or 0)
+        self._cap = marking['cap']
+        if marking['rounding'] is not None and marking['rounding'] not in ROUNDING_POLICIES:
+            raise ValueError(f"Unknown rounding policy '{marking['rounding']}'; use one of "
+                             f"{', '.join(ROUNDING_POLICIES)}, or null to keep marks as entered")
+        self._round = ROUNDING_POLICIES.get(marking['rounding'])
+        # Places the marks are shown with; None shows them as entered
+        self.decimals = marking['decimals'] if self._round else None
+        self._scale = 10.0 ** (self.decimals or 0)
+        bands = sorted(marking['grade_bands'], key=lambda band: band[0])
+        self._band_floors = np.array([band[0] for band in bands], dtype=float)
+        self._band_labels = np.array([band[1] for band in bands] + [''], dtype=object)
+        self._mark_format = marking['mark_format']
+
+    def totals(self, rows):
+        """Return the unrounded marks of a list of rows as a float array, NaN where there is no numeric mark."""
+        if self.criteria:
+            scores = np.column_stack([_numbers(row[column] if column < len(row) else None for row in rows)
+                                      for column in self.columns])
+            totals = scores / self._out_of * 100 @ self._weights
+        else:
+            totals = _numbers(row[1] for row in rows)
+        if self._late_column is not None:
+            days = _numbers(row[self._late_column] if self._late_column < len(row) else None for row in rows)
+            totals = totals - self._late_penalty * np.nan_to_num(days)
+        if self._cap is not None:
+            totals = np.minimum(totals, self._cap)
+        return np.maximum(totals, 0)
+
+    def round(self, totals):
+        # Rounding happens on scaled values; the inner rounding removes binary noise such as 64.49999999999999
+        if self._round is None:
+            return np.round(totals, 6)
+        return self._round(np.round(totals * self._scale, 6)) / self._scale
+
+    def grades(self, marks):
+        """Return the grade band label of each final mark, '' below the lowest band or without a mark."""
+        indexes = np.searchsorted(self._band_floors, marks, side='right') - 1
+        indexes[(indexes < 0) | np.isnan(marks)] = len(self._band_floors)
+        return self._band_labels[indexes]
+
+    def apply(self, rows):
+        """
+        Work out the marks of a list of rows at once.
+
+        Returns:
+            The final marks as a float array (NaN for students without a numeric mark), the grade of each
+            student and the text shown in each student's mark cell.
+        """
+        marks = self.round(self.totals(rows))
+        grades = self.grades(marks)
+        numbers = format_marks(marks, self.decimals)
+        texts = []
+        for row, missing, number, grade in zip(rows, np.isnan(marks).tolist(), numbers.tolist(), grades):
+            if missing:
+                # A numeric mark column of a student missing a criterion score is written like the other marks
+                entered = _numbers([row[1]])
+                if not np.isnan(entered[0]):
+                    texts.append(format_mark(self.round(entered)[0], self.decimals))
+                else:
+                    # Text such as 'Absent' as it is, and an empty cell as an empty mark rather than 'None'
+                    texts.append('' if row[1] is None else row[1])
+            elif self._mark_format == '{mark}':
+                texts.append(number)
+            else:
+                texts.append(self._mark_format.format(mark=number, grade=grade))
+        return marks, grades, texts
+
+
+def aggregate_marks(rows, scheme, chunk_size=4096, on_chunk=None):
+    """
+    Yield a (name, mark, feedback) tuple for every row, with the mark replaced by the text `scheme` works out.
+
+    Rows are consumed `chunk_size` at a time and every chunk is aggregated with array operations, so a
+    cohort of any size is processed in constant memory. `on_chunk`, if given, is called with the final
+    marks and grades of every chunk as returned by `MarkScheme.apply`, e.g. `CohortStatistics.add`.
+    """
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        marks, grades, texts = scheme.apply(chunk)
+        if on_chunk:
+            on_chunk(marks, grades)
+        for row, mark in zip(chunk, texts):
+            yield row[0], mark, row[2]
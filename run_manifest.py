@@ -0,0 +1,94 @@
+"""Run manifest that lets a generation run skip students whose inputs have not changed since the last run."""
+import hashlib
+import json
+import os
+import sqlite3
+
+MANIFEST_NAME = '.feedback_manifest.json'
+# A header line followed by one [form file name, fingerprint] line per form, so it can be read and written
+# without holding the whole manifest
+MANIFEST_VERSION = 2
+
+
+def run_fingerprint(run_config, rubric_fingerprint, output_format, engine, template_fingerprint=None):
+    """Hash of everything that affects every form of a run: settings, rubric, template, output format and engine."""
+    values = [run_config, rubric_fingerprint, output_format, engine]
+    if template_fingerprint is not None:
+        values.append(template_fingerprint)
+    payload = json.dumps(values, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def student_fingerprint(student, fingerprint_of_run):
+    """Hash of one student's row values combined with the run fingerprint."""
+    payload = json.dumps([list(student), fingerprint_of_run], default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class RunManifest:
+    """
+    Content hashes of the inputs behind every form in an output directory, stored next to the forms.
+
+    A form is current when the manifest holds the same hash for its file and the file still exists. The
+    manifest is rewritten with the forms of each run only, so students removed from the sheet drop out of
+    it: every recorded form is written to a temporary file straight away, which replaces the manifest when
+    the run is saved.
+
+    In low-memory mode the previous run's hashes are not held in a dict but copied into a temporary SQLite
+    database, which spills to disk, and looked up form by form, so memory does not grow with the cohort.
+    """
+
+    def __init__(self, output_dir=None, low_memory=False):
+        self.path = os.path.join(output_dir or '.', MANIFEST_NAME)
+        self._previous = {}
+        self._index = None
+        self._current = None
+        try:
+            with open(self.path, encoding='utf-8') as fh:
+                if json.loads(fh.readline()).get('version') == MANIFEST_VERSION:
+                    entries = (json.loads(line) for line in fh)
+                    if low_memory:
+                        self._index = _on_disk_index(entries)
+                    else:
+                        self._previous = dict(entries)
+        except (OSError, ValueError, AttributeError, sqlite3.Error):
+            self._previous = {}
+            self._index = None
+
+    def is_current(self, form_path, fingerprint):
+        name = os.path.basename(form_path)
+        if self._index is not None:
+            row = self._index.execute('SELECT fingerprint FROM forms WHERE name = ?', (name,)).fetchone()
+            previous = row[0] if row else None
+        else:
+            previous = self._previous.get(name)
+        return previous == fingerprint and os.path.exists(form_path)
+
+    def record(self, form_path, fingerprint):
+        if self._current is None:
+            self._start()
+        self._current.write(json.dumps([os.path.basename(form_path), fingerprint]) + '\n')
+
+    def _start(self):
+        self._current = open(f'{self.path}.tmp', 'w', encoding='utf-8')
+        self._current.write(json.dumps({'version': MANIFEST_VERSION}) + '\n')
+
+    def save(self):
+        if self._current is None:
+            self._start()
+        self._current.close()
+        os.replace(self._current.name, self.path)
+        self._current = None
+        if self._index is not None:
+            self._index.close()
+            self._index = None
+
+
+def _on_disk_index(entries):
+    # An empty name opens a private temporary database, kept in a small page cache and deleted when closed;
+    # lookups come from the thread iterating the students, which need not be the one that built it
+    index = sqlite3.connect('', check_same_thread=False)
+    index.execute('CREATE TABLE forms (name TEXT PRIMARY KEY, fingerprint TEXT)')
+    # A later line for the same file wins, as with a dict
+    index.executemany('INSERT OR REPLACE INTO forms VALUES (?, ?)', entries)
+    return index
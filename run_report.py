@@ -0,0 +1,170 @@
+"""Per-stage and per-student timing and resource report of a generation run, written next to the forms."""
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+REPORT_NAME = 'feedback_run_report.json'
+
+# Per-student timings recorded by `feedback_engine.create_feedback_form_in_docx`, in seconds
+STUDENT_STAGES = ('build', 'save', 'convert')
+
+
+def peak_rss_bytes():
+    """Return the peak resident set size of the current process in bytes, or None if it cannot be read."""
+    try:
+        if sys.platform == 'win32':
+            import ctypes
+            from ctypes import wintypes
+
+            class ProcessMemoryCounters(ctypes.Structure):
+                _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD)] + [
+                    (name, ctypes.c_size_t) for name in (
+                        'PeakWorkingSetSize', 'WorkingSetSize', 'QuotaPeakPagedPoolUsage', 'QuotaPagedPoolUsage',
+                        'QuotaPeakNonPagedPoolUsage', 'QuotaNonPagedPoolUsage', 'PagefileUsage',
+                        'PeakPagefileUsage')]
+
+            counters = ProcessMemoryCounters()
+            counters.cb = ctypes.sizeof(counters)
+            get_process_memory_info = ctypes.windll.psapi.GetProcessMemoryInfo
+            get_process_memory_info.argtypes = [wintypes.HANDLE, ctypes.POINTER(ProcessMemoryCounters),
+                                                wintypes.DWORD]
+            if not get_process_memory_info(ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(counters),
+                                           counters.cb):
+                return None
+            return counters.PeakWorkingSetSize
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+        return peak if sys.platform == 'darwin' else peak * 1024
+    except (ImportError, OSError, AttributeError):
+        return None
+
+
+def _format_bytes(value):
+    if value is None:
+        return "unknown"
+    return f"{value / 1e6:.1f} MB" if value >= 1e6 else f"{value / 1e3:.0f} kB"
+
+
+class RunReport:
+    """
+    Collects the wall time of each stage of a run and the timings of every student's form.
+
+    Stages are timed in the calling process: with worker processes the 'generate' stage is the wall time of
+    the whole pool, while the per-student 'build', 'save' and 'convert' totals add up the time spent in
+    every worker. Peak memory is the largest peak resident set size of the calling process and the workers.
+
+    Args:
+        keep_students: Whether to keep an entry per student; when False only failed students are listed and
+            the report holds the totals and counts, so its size does not grow with the cohort.
+        **settings: Run settings (engine, output format, ...) copied into the report as they are.
+    """
+
+    def __init__(self, keep_students=True, **settings):
+        self.settings = settings
+        self.keep_students = keep_students
+        self.started = datetime.now()
+        self.stages = {}
+        self.students = []
+        self.forms = 0
+        self.skipped = 0
+        self.failed = 0
+        self._totals = dict.fromkeys(STUDENT_STAGES + ('bytes',), 0)
+        self.peak_rss = None
+        # Bytes written that do not belong to one student, such as a combined document
+        self.bytes_written = 0
+        self.path = None
+        self._start = time.perf_counter()
+        self._wall_time = None
+
+    def add_stage(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name):
+        """Context manager adding the time spent inside it to the stage `name`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - start)
+
+    def timed_iter(self, name, iterable):
+        """Yield from `iterable`, adding the time spent producing each item to the stage `name`."""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_stage(name, time.perf_counter() - start)
+                return
+            self.add_stage(name, time.perf_counter() - start)
+            yield item
+
+    def _note_peak_rss(self, value):
+        if value is not None and (self.peak_rss is None or value > self.peak_rss):
+            self.peak_rss = value
+
+    def add_results(self, results):
+        """Record the timings carried by every `FormResult` of the run."""
+        for result in results:
+            timings = result.timings or {}
+            self._note_peak_rss(timings.get('peak_rss'))
+            if result.error:
+                self.failed += 1
+            elif result.skipped:
+                self.skipped += 1
+            else:
+                self.forms += 1
+            for key in self._totals:
+                self._totals[key] += timings.get(key, 0)
+            if self.keep_students or result.error:
+                entry = {'index': result.index, 'student': str(result.student_name), 'path': result.path,
+                         'error': result.error, 'skipped': result.skipped}
+                entry.update((key, timings[key]) for key in self._totals if key in timings)
+                self.students.append(entry)
+
+    def finish(self):
+        self._wall_time = time.perf_counter() - self._start
+        self._note_peak_rss(peak_rss_bytes())
+
+    def totals(self):
+        totals = dict(self._totals)
+        totals['bytes'] += self.bytes_written
+        return totals
+
+    def to_dict(self):
+        return {
+            'started': self.started.isoformat(timespec='seconds'),
+            'settings': self.settings,
+            'wall_seconds': self._wall_time,
+            'stages': self.stages,
+            'student_totals': self.totals(),
+            'peak_rss_bytes': self.peak_rss,
+            'forms': self.forms,
+            'skipped': self.skipped,
+            'failed': self.failed,
+            'students': self.students,
+        }
+
+    def save(self, output_dir=None):
+        """Write the report as `REPORT_NAME` in `output_dir` and return its path."""
+        self.path = os.path.join(output_dir or '.', REPORT_NAME)
+        with open(self.path, 'w', encoding='utf-8') as fh:
+            json.dump(self.to_dict(), fh, indent=1, default=str)
+        return self.path
+
+    def summary(self):
+        """One line naming the slowest stages, peak memory and bytes written, for the GUI and command line."""
+        totals = self.totals()
+        stages = dict(self.stages)
+        stages.update((stage, totals[stage]) for stage in STUDENT_STAGES if totals[stage])
+        slowest = sorted(stages.items(), key=lambda item: item[1], reverse=True)[:4]
+        parts = ', '.join(f"{name} {seconds:.1f}s" for name, seconds in slowest)
+        return (f"{self._wall_time or 0:.1f}s total ({parts}); peak memory {_format_bytes(self.peak_rss)}, "
+                f"{_format_bytes(totals['bytes'])} written")
+
@@ -12,12 +12,14 @@ setup(
     }],
     options={
         "py2exe": {
-            "packages": ["os", "tkinter", "pandas", "docx", "reportlab"],  # Include necessary packages
+            "packages": ["os", "tkinter", "openpyxl", "docx", "reportlab", "numpy"],  # Include necessary packages
             "bundle_files": 1,  # Bundle everything into a single EXE
             "compressed": True,  # Compress the library archive
             "excludes": ["gui_version", "main", "main001", "main002", "gui_version01"],  # Exclude unnecessary modules
         }
     },
     zipfile=None,  # Do not create a separate library zip file
-    py_modules=['FeedbackCreator'],  # Explicit module
+    py_modules=['FeedbackCreator', 'cohort_statistics', 'email_distribution', 'feedback_cli', 'feedback_config',
+                'feedback_engine', 'lms_export', 'mark_aggregation', 'run_manifest', 'run_report',
+                'student_reader', 'watch_folder'],  # Explicit modules
 )
\ No newline at end of file
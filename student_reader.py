@@ -0,0 +1,326 @@
+"""Streaming reader for the student mark sheet: name, mark and feedback in the first three columns."""
+import copy
+import json
+import os
+import time
+from collections import deque, namedtuple
+from itertools import count
+
+from openpyxl import load_workbook
+
+try:
+    from python_calamine import CalamineWorkbook
+except ImportError:
+    CalamineWorkbook = None
+
+from feedback_config import config
+from mark_aggregation import MarkScheme, aggregate_marks
+
+# One student row; a namedtuple keeps the record compact (no per-instance dict) and unpackable
+StudentRecord = namedtuple('StudentRecord', ['name', 'mark', 'feedback'])
+
+# One sheet of a workbook in a batch run. `name` is unique within the batch ('<workbook>/<sheet>', relative to
+# the directory searched) and `settings` are the `config` overrides that apply to this sheet alone
+MarkSheet = namedtuple('MarkSheet', ['workbook', 'sheet', 'name', 'settings'])
+
+# Labels accepted in the settings area above a sheet's column headers besides the `config` keys themselves
+# written with spaces (e.g. 'Module Code:'), mapped to those keys
+SETTING_ALIASES = {
+    'tutor': 'tutor_name',
+    'assignment': 'assignment_title',
+    '% of module': 'percent_of_module',
+}
+
+
+def _openpyxl_rows(path, sheet=None, max_col=3):
+    # read_only mode parses the sheet XML lazily, so memory stays flat regardless of the number of rows
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        worksheet = workbook[sheet] if sheet is not None else workbook.worksheets[0]
+        yield from worksheet.iter_rows(max_col=max_col, values_only=True)
+    finally:
+        workbook.close()
+
+
+def _calamine_rows(path, sheet=None, max_col=3):
+    workbook = CalamineWorkbook.from_path(path)
+    worksheet = workbook.get_sheet_by_name(sheet) if sheet is not None else workbook.get_sheet_by_index(0)
+    for row in worksheet.iter_rows():
+        # calamine reports empty cells as ''
+        yield tuple(value if value != '' else None for value in row[:max_col])
+
+
+# Raw row readers by name, in order of preference when no benchmark result is available
+READER_BACKENDS = {'openpyxl': _openpyxl_rows}
+if CalamineWorkbook is not None:
+    READER_BACKENDS['calamine'] = _calamine_rows
+
+_auto_backend = None
+
+
+def benchmark_readers(path, rows=500):
+    """
+    Time every available backend on the first `rows` rows of `path`.
+
+    Returns:
+        A dict mapping backend name to rows read per second.
+    """
+    timings = {}
+    for name, reader in READER_BACKENDS.items():
+        start = time.perf_counter()
+        count = 0
+        for count, _ in enumerate(reader(path), start=1):
+            if count >= rows:
+                break
+        timings[name] = count / max(time.perf_counter() - start, 1e-9)
+    return timings
+
+
+def select_backend(path):
+    """Return the fastest backend for workbooks like `path`, benchmarking once per process if there is a choice."""
+    global _auto_backend
+    if _auto_backend is None:
+        if len(READER_BACKENDS) == 1:
+            _auto_backend = next(iter(READER_BACKENDS))
+        else:
+            timings = benchmark_readers(path)
+            _auto_backend = max(timings, key=timings.get)
+    return _auto_backend
+
+
+def setting_key(label):
+    """Return the `config` key named by a settings-area label such as 'Module Code:', or None."""
+    if not isinstance(label, str):
+        return None
+    label = label.strip().rstrip(':').strip().lower()
+    key = label.replace(' ', '_')
+    if key in config and not isinstance(config[key], dict):
+        return key
+    return SETTING_ALIASES.get(label)
+
+
+def _settings_area(rows):
+    # Consumes the settings rows (and blank rows) at the top of a sheet and the column header row after them,
+    # and returns the settings and the header row
+    settings = {}
+    header = None
+    for row in rows:
+        row = tuple(row) + (None,) * (3 - len(row))
+        key = setting_key(row[0])
+        if key is not None:
+            value = row[1]
+            if key == 'percent_of_module' and isinstance(value, (int, float)) and value <= 1:
+                # A cell formatted as a percentage holds the fraction
+                value = f'{value:.0%}'
+            settings[key] = '' if value is None else str(value)
+        elif any(value is not None for value in row[:3]):
+            header = row
+            break
+    return settings, header
+
+
+def read_sheet_settings(path, sheet=None):
+    """
+    Return the settings given in the header area of a sheet, as `config` overrides.
+
+    The header area is any number of rows above the column headers with a setting label in the first column
+    and its value in the second, e.g. 'Module Code:' | 'GD102'. Labels are `config` keys written with spaces
+    or one of `SETTING_ALIASES`, in any case and with or without a trailing colon.
+    """
+    rows = READER_BACKENDS['openpyxl'](path, sheet)
+    try:
+        return _settings_area(rows)[0]
+    finally:
+        rows.close()
+
+
+def iter_students(path, backend='auto', sheet=None, marking=None, statistics=None, column=None):
+    """
+    Yield a `StudentRecord` for every row of a sheet of `path`, streaming it row by row.
+
+    The settings area read by `read_sheet_settings`, if any, and the column header row after it are skipped,
+    as are rows with no name, mark or feedback. Missing cells are returned as None, except an empty mark
+    cell, which is ''.
+
+    Each record's mark is the text worked out by a `mark_aggregation.MarkScheme`, e.g. '65' for a cell
+    holding 65.0, or a weighted total when the marking settings list criterion columns; marks that are not
+    numbers, such as 'Absent', are passed on as they are.
+
+    Args:
+        path: The .xlsx mark sheet.
+        backend: Name of a reader in `READER_BACKENDS`, or 'auto' to pick one with `select_backend`.
+        sheet: Name of the sheet to read; the first sheet when not given.
+        marking: The marking settings to apply; `config['marking']` as it is when this is called by default.
+        statistics: Optional `cohort_statistics.CohortStatistics` that receives every student's mark as the
+            rows are read.
+        column: Header of a further column to read from the same rows, in any case, such as the email
+            addresses that join students to a VLE's grading worksheet. Each student is then yielded as a
+            (`StudentRecord`, value) pair, the value read as by `iter_student_column`.
+
+    Raises:
+        ValueError: On iteration, if the marking settings do not fit the sheet (see `MarkScheme`) or the
+            sheet has no column headed `column`.
+    """
+    # Resolved now, as the rows are only read once iteration starts, when `config` may hold another sheet's settings
+    marking = copy.deepcopy(config['marking'] if marking is None else marking)
+    return _iter_students(path, backend, sheet, marking, statistics, column)
+
+
+def _iter_students(path, backend, sheet, marking, statistics, column):
+    if backend == 'auto':
+        backend = select_backend(path)
+    # Criterion, late and extra columns may be anywhere in the row; otherwise only the first three columns are read
+    max_col = None if marking['criteria'] or marking['late_penalty'] or column else 3
+    rows = READER_BACKENDS[backend](path, sheet, max_col)
+    _, header = _settings_area(rows)
+    records = (row for row in (tuple(row) + (None,) * (3 - len(row)) for row in rows)
+               if row[0] is not None or row[1] is not None or row[2] is not None)
+    if column is None:
+        yield from map(StudentRecord._make, aggregate_marks(records, MarkScheme(marking, header),
+                                                            on_chunk=statistics.add if statistics else None))
+        return
+    index = _header_index(header, column)
+    # The values of the rows taken in by `aggregate_marks` but not yet yielded, at most a block of them
+    values = deque()
+
+    def noting_values(records):
+        for row in records:
+            values.append(_cell_value(row, index))
+            yield row
+
+    for record in aggregate_marks(noting_values(records), MarkScheme(marking, header),
+                                  on_chunk=statistics.add if statistics else None):
+        yield StudentRecord._make(record), values.popleft()
+
+
+def _header_index(header, column):
+    names = [str(cell).strip().lower() if cell is not None else '' for cell in header or ()]
+    if column.strip().lower() not in names:
+        raise ValueError(f"The mark sheet has no '{column}' column")
+    return names.index(column.strip().lower())
+
+
+def _cell_value(row, index):
+    value = row[index] if index < len(row) else None
+    if isinstance(value, str):
+        value = value.strip() or None
+    return value
+
+
+def iter_student_column(path, column, sheet=None):
+    """
+    Return an iterator of (name, value) pairs for every student row of a sheet, in the order of `iter_students`.
+
+    The value is read from the column whose header is `column`, in any case; text is stripped of surrounding
+    spaces and empty cells are None. Used for columns the forms do not show, such as email addresses.
+
+    Raises:
+        ValueError: If the sheet has no column headed `column`. The header is read straight away, so this
+            is raised before any student is read.
+    """
+    rows = READER_BACKENDS['openpyxl'](path, sheet, None)
+    _, header = _settings_area(rows)
+    try:
+        index = _header_index(header, column)
+    except ValueError:
+        rows.close()
+        raise
+    return _iter_column(rows, index)
+
+
+def _iter_column(rows, index):
+    try:
+        for row in rows:
+            row = tuple(row) + (None,) * (3 - len(row))
+            if row[0] is None and row[1] is None and row[2] is None:
+                continue
+            yield row[0], _cell_value(row, index)
+    finally:
+        rows.close()
+
+
+def estimate_student_count(path, sheet=None):
+    """
+    Return the number of rows below the settings area and column headers, from the sheet's recorded dimensions.
+
+    Only the top rows are read, so this is cheap on a large sheet. It is an upper bound on the number of
+    students, as blank rows among them count too. Returns None if the dimensions are not recorded.
+    """
+    workbook = load_workbook(path, read_only=True)
+    try:
+        worksheet = workbook[sheet] if sheet is not None else workbook.worksheets[0]
+        max_row = worksheet.max_row
+        if not max_row:
+            return None
+        # zip draws a number for every row the settings area consumes, up to and including the header row
+        consumed = count()
+        _, header = _settings_area(row for row, _ in zip(worksheet.iter_rows(max_col=3, values_only=True), consumed))
+    finally:
+        workbook.close()
+    # Without a header row every row belongs to the settings area
+    return max(max_row - next(consumed), 0) if header is not None else 0
+
+
+def list_sheets(path):
+    """Return the names of the worksheets of `path`, in workbook order."""
+    workbook = load_workbook(path, read_only=True)
+    try:
+        return [worksheet.title for worksheet in workbook.worksheets]
+    finally:
+        workbook.close()
+
+
+def find_workbooks(path):
+    """Yield every .xlsx workbook under the directory `path`, in sorted order, skipping Excel lock files."""
+    for directory, subdirectories, files in os.walk(path):
+        subdirectories[:] = sorted(name for name in subdirectories if not name.startswith('.'))
+        for name in sorted(files):
+            if name.lower().endswith('.xlsx') and not name.startswith('~$'):
+                yield os.path.join(directory, name)
+
+
+def sidecar_settings(workbook_path):
+    """
+    Return the settings of the JSON sidecar next to a workbook (marks.xlsx -> marks.json), if there is one.
+
+    The sidecar holds `config` overrides for every sheet of the workbook, plus an optional "sheets" object
+    with overrides per sheet name, e.g. {"tutor_name": "Dr. Smith", "sheets": {"GD102": {"module_code": "GD102"}}}.
+
+    Returns:
+        A (workbook settings, {sheet name: sheet settings}) pair.
+    """
+    try:
+        with open(sidecar_path(workbook_path), encoding='utf-8') as fh:
+            settings = json.load(fh)
+    except FileNotFoundError:
+        return {}, {}
+    sheets = settings.pop('sheets', {})
+    return settings, sheets
+
+
+def sidecar_path(workbook_path):
+    return os.path.splitext(workbook_path)[0] + '.json'
+
+
+def find_mark_sheets(path, root=None):
+    """
+    Yield a `MarkSheet` for every worksheet of the workbook `path`, or of every workbook under the directory `path`.
+
+    The settings of a sheet combine, from lowest to highest precedence, the workbook-wide settings of its
+    sidecar, its header area (see `read_sheet_settings`) and the sidecar's entry for the sheet. Sheet names
+    are relative to `root`, which defaults to the directory `path` or the directory holding the workbook.
+    """
+    if os.path.isdir(path):
+        workbooks = find_workbooks(path)
+        root = root or path
+    else:
+        workbooks = [path]
+        root = root or os.path.dirname(path) or '.'
+    for workbook in workbooks:
+        workbook_settings, sheet_settings = sidecar_settings(workbook)
+        workbook_name = os.path.splitext(os.path.relpath(workbook, root))[0].replace(os.sep, '/')
+        for sheet in list_sheets(workbook):
+            settings = dict(workbook_settings)
+            settings.update(read_sheet_settings(workbook, sheet))
+            settings.update(sheet_settings.get(sheet, {}))
+            yield MarkSheet(workbook, sheet, f'{workbook_name}/{sheet}', settings)
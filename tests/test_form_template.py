@@ -0,0 +1,63 @@
+"""Regression tests for own form templates compiled once per run."""
+import copy
+import os
+import sys
+import zipfile
+
+import pytest
+from docx import Document
+from openpyxl import Workbook
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from feedback_config import config  # noqa: E402
+from feedback_engine import run_generation  # noqa: E402
+
+
+@pytest.fixture
+def restore_config():
+    saved = copy.deepcopy(config)
+    yield
+    config.clear()
+    config.update(saved)
+
+
+def make_template(path, version):
+    doc = Document()
+    doc.add_paragraph(f'{version} {{{{student}}}}')
+    doc.add_paragraph('Mark: {{mark}}')
+    doc.add_paragraph('{{comment}}')
+    doc.save(path)
+
+
+def form_text(path):
+    with zipfile.ZipFile(path) as archive:
+        return archive.read('word/document.xml').decode('utf-8')
+
+
+def test_edited_template_is_recompiled_in_the_same_process(tmp_path, restore_config):
+    workbook_path = tmp_path / 'marks.xlsx'
+    workbook = Workbook()
+    workbook.active.append(['Name', 'Mark', 'Feedback'])
+    workbook.active.append(['Ann', 65, 'Good work'])
+    workbook.save(workbook_path)
+    template_path = tmp_path / 'template.docx'
+    output_dir = tmp_path / 'forms'
+    form_path = output_dir / 'Assignment_Feedback_Form_Ann.docx'
+    config['form_template'] = str(template_path)
+
+    make_template(template_path, 'VERSION-ONE')
+    run_generation(str(workbook_path), str(output_dir), engine='Direct XML', incremental=True,
+                   statistics_formats=())
+    assert 'VERSION-ONE' in form_text(form_path)
+
+    make_template(template_path, 'VERSION-TWO')
+    run_generation(str(workbook_path), str(output_dir), engine='Direct XML', incremental=True,
+                   statistics_formats=())
+    assert 'VERSION-TWO' in form_text(form_path)
+
+    # The manifest now records the form of the new template as current
+    results = run_generation(str(workbook_path), str(output_dir), engine='Direct XML', incremental=True,
+                             statistics_formats=())
+    assert [result.skipped for result in results] == [True]
+    assert 'VERSION-TWO' in form_text(form_path)
@@ -0,0 +1,167 @@
+"""Watch a drop folder and regenerate feedback forms whenever a mark sheet or the rubric changes."""
+import os
+import time
+
+from feedback_engine import generate_batch_feedback, load_rubric, start_worker_pool
+from run_report import RunReport
+from student_reader import find_mark_sheets, find_workbooks, sidecar_path
+
+
+def _file_signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class FolderWatcher:
+    """
+    Polls a folder for new or modified mark workbooks, and the rubric, and regenerates the affected forms.
+
+    A workbook is only processed once it and its JSON sidecar have kept the same size and modification time
+    for `debounce` seconds, so a burst of Excel autosaves or a copy arriving over a share triggers a single
+    rebuild. A workbook or rubric that cannot be processed is reported once and only tried again when it
+    changes. Rebuilds are incremental: the `RunManifest` of each sheet's folder skips students whose rows
+    have not changed. A changed rubric changes every student's fingerprint, so all workbooks are rebuilt.
+
+    The parsed rubric and the worker pool with its form engines stay in memory between events; the pool is
+    only restarted when the rubric changes.
+
+    Args:
+        folder: Drop folder searched recursively for .xlsx workbooks. Every sheet of every workbook is
+            processed, as in a batch run, and written below `output_dir` under the same relative name.
+        rubric_path: Optional rubric .docx appended to every form, watched like the workbooks.
+        on_event: Callable receiving a one-line message for every rebuild or error; prints by default.
+    """
+
+    def __init__(self, folder, output_dir, rubric_path=None, output_format='Word', engine='python-docx',
+                 workers=1, interval=1.0, debounce=2.0, on_event=print):
+        self.folder = folder
+        self.output_dir = output_dir
+        self.rubric_path = rubric_path
+        self.output_format = output_format
+        self.engine = engine
+        self.workers = workers
+        self.interval = interval
+        self.debounce = debounce
+        self.on_event = on_event
+        # Path -> signature of the files as last processed
+        self._processed = {}
+        # Path -> (signature, time it was first seen with that signature) of files waiting to settle
+        self._pending = {}
+        # Path -> signature of the files that could not be processed, so a lasting error is reported once
+        self._failed = {}
+        self._pool = None
+
+    def _signatures(self):
+        signatures = {}
+        for workbook in find_workbooks(self.folder):
+            signatures[workbook] = (_file_signature(workbook), _file_signature(sidecar_path(workbook)))
+        if self.rubric_path:
+            signatures[self.rubric_path] = _file_signature(self.rubric_path)
+        return signatures
+
+    def poll(self, now=None):
+        """
+        Check the folder once and rebuild every workbook whose changes have settled.
+
+        Returns:
+            A list of (workbook path, list of `FormResult`) pairs for the workbooks rebuilt by this poll.
+        """
+        now = time.monotonic() if now is None else now
+        signatures = self._signatures()
+        for waiting in (self._pending, self._failed):
+            for path in list(waiting):
+                if path not in signatures:
+                    del waiting[path]
+        settled = []
+        for path, signature in signatures.items():
+            if self._processed.get(path) == signature or self._failed.get(path) == signature:
+                self._pending.pop(path, None)
+                continue
+            pending = self._pending.get(path)
+            if pending is None or pending[0] != signature:
+                self._pending[path] = (signature, now)
+            elif now - pending[1] >= self.debounce:
+                settled.append(path)
+        if not settled:
+            return []
+        if self.rubric_path in self._failed and self.rubric_path not in settled:
+            # Every form includes the rubric, so the workbooks wait until it is fixed and then are all rebuilt
+            return []
+
+        if self.rubric_path in settled:
+            settled.remove(self.rubric_path)
+            if not self._reload_rubric(signatures[self.rubric_path]):
+                return []
+            # Every form includes the rubric
+            settled = [path for path in signatures if path != self.rubric_path]
+        rebuilt = []
+        for workbook in settled:
+            results = self._rebuild(workbook)
+            self._pending.pop(workbook, None)
+            if results is None:
+                # Unreadable, or its settings do not fit it; try again once it changes
+                self._failed[workbook] = signatures[workbook]
+                continue
+            self._processed[workbook] = signatures[workbook]
+            self._failed.pop(workbook, None)
+            rebuilt.append((workbook, results))
+        return rebuilt
+
+    def _reload_rubric(self, signature):
+        try:
+            load_rubric(self.rubric_path)
+        except Exception as e:
+            self.on_event(f"Cannot read rubric {self.rubric_path}: {e}")
+            self._pending.pop(self.rubric_path, None)
+            self._failed[self.rubric_path] = signature
+            return False
+        self._processed[self.rubric_path] = signature
+        self._pending.pop(self.rubric_path, None)
+        self._failed.pop(self.rubric_path, None)
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        return True
+
+    def _rebuild(self, workbook):
+        if self.workers > 1 and self._pool is None:
+            self._pool = start_worker_pool(self.workers, self.rubric_path, self.engine)
+        report = RunReport(excel_path=workbook, output_format=self.output_format, engine=self.engine,
+                           workers=self.workers, rubric_path=self.rubric_path, layout='files')
+        try:
+            mark_sheets = list(find_mark_sheets(workbook, root=self.folder))
+            results = generate_batch_feedback(mark_sheets, rubric_path=self.rubric_path,
+                                              output_format=self.output_format, engine=self.engine,
+                                              workers=self.workers, output_dir=self.output_dir, incremental=True,
+                                              report=report, pool=self._pool)
+        except Exception as e:
+            self.on_event(f"Cannot process {workbook}: {e}")
+            return None
+        report.add_results(results)
+        report.finish()
+        report.save(self.output_dir)
+        skipped = sum(1 for result in results if result.skipped)
+        failed = sum(1 for result in results if result.error)
+        self.on_event(f"{os.path.relpath(workbook, self.folder)}: {len(results) - skipped - failed} forms updated, "
+                      f"{skipped} unchanged, {failed} failed")
+        return results
+
+    def run(self, stop_event=None):
+        """Poll every `interval` seconds until `stop_event` is set or the process is interrupted."""
+        self.on_event(f"Watching {os.path.abspath(self.folder)} for changed mark sheets")
+        try:
+            while stop_event is None or not stop_event.is_set():
+                self.poll()
+                time.sleep(self.interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None